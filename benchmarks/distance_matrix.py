@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the distance and azimuth matrices of helpers.angles
+against scalar loops, and the error of the equirectangular fast path.
+
+Run from the repository root:
+python3 -m benchmarks.distance_matrix
+"""
+
+import time
+import numpy as np
+
+import helpers.angles
+
+
+def make_random_points(no_points, lat0_deg = 50., lon0_deg = 11., spread_deg = 1., seed = 0):
+    rng = np.random.default_rng(seed)
+    lat_deg = lat0_deg + spread_deg * rng.uniform(-.5, .5, no_points)
+    lon_deg = lon0_deg + spread_deg * rng.uniform(-.5, .5, no_points)
+    return lat_deg, lon_deg
+
+
+def scalar_distance_loop(lat1_deg, lon1_deg, lat2_deg, lon2_deg):
+    """
+    @brief: reference, one haversine_distance call per pair of points.
+    """
+    d = np.zeros( (len(lat1_deg), len(lat2_deg)) )
+    for i in range(len(lat1_deg)):
+        for j in range(len(lat2_deg)):
+            d[i,j] = helpers.angles.haversine_distance( lat1_deg[i], lon1_deg[i], lat2_deg[j], lon2_deg[j] )
+    return d
+
+
+def scalar_azimuth_loop(lat1_deg, lon1_deg, lat2_deg, lon2_deg):
+    """
+    @brief: reference, one calc_properties_of_airline call per pair of points.
+    """
+    azim = np.zeros( (len(lat1_deg), len(lat2_deg)) )
+    for i in range(len(lat1_deg)):
+        for j in range(len(lat2_deg)):
+            airline = helpers.angles.calc_properties_of_airline( lat1_deg[i], lon1_deg[i], lat2_deg[j], lon2_deg[j] )
+            azim[i,j] = airline["azimuth_from_point_1_towards_2_deg"]
+    return azim
+
+
+def best_time(function, repetitions = 3):
+    times = []
+    for i in range(repetitions):
+        t0 = time.perf_counter()
+        result = function()
+        times.append( time.perf_counter() - t0 )
+    return min(times), result
+
+
+def equirectangular_relative_error(max_distance_m, max_lat_deg = 70., no_samples = 100000, seed = 1):
+    """
+    @return error (float) maximum relative deviation from the haversine distance
+            for random pairs with distances up to max_distance_m
+    """
+    rng = np.random.default_rng(seed)
+    r = 6365000
+    lat1_deg = rng.uniform(-max_lat_deg, max_lat_deg, no_samples)
+    lon1_deg = rng.uniform(-180, 180, no_samples)
+    azim     = rng.uniform(0, 2*np.pi, no_samples)
+    dist_m   = rng.uniform(10, max_distance_m, no_samples)
+    lat2_deg = lat1_deg + np.degrees( dist_m * np.cos(azim) / r )
+    lon2_deg = lon1_deg + np.degrees( dist_m * np.sin(azim) / r / np.cos(np.radians(lat1_deg)) )
+
+    d_hav = helpers.angles.haversine_distance( lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = r )
+    d_equ = np.zeros(no_samples)
+    for i in range(0, no_samples, 1000):
+        # the diagonals of small matrices are the pairs
+        block = helpers.angles.equirectangular_distance_matrix( lat1_deg[i:i+1000], lon1_deg[i:i+1000], lat2_deg[i:i+1000], lon2_deg[i:i+1000], r = r )
+        d_equ[i:i+1000] = np.diagonal(block)
+    return np.max( np.abs(d_equ - d_hav) / d_hav )
+
+
+if __name__ == "__main__":
+    print("N x M         scalar dist [s]   matrix dist [s]   scalar azim [s]   matrix azim [s]")
+    for n in [10, 30, 100, 300]:
+        lat1_deg, lon1_deg = make_random_points(n, seed = 1)
+        lat2_deg, lon2_deg = make_random_points(n, seed = 2)
+
+        t_sd, d_scalar = best_time( lambda: scalar_distance_loop(lat1_deg, lon1_deg, lat2_deg, lon2_deg), repetitions = 1 )
+        t_md, d_matrix = best_time( lambda: helpers.angles.haversine_distance_matrix(lat1_deg, lon1_deg, lat2_deg, lon2_deg) )
+        t_sa, a_scalar = best_time( lambda: scalar_azimuth_loop(lat1_deg, lon1_deg, lat2_deg, lon2_deg), repetitions = 1 )
+        t_ma, a_matrix = best_time( lambda: helpers.angles.azimuth_matrix(lat1_deg, lon1_deg, lat2_deg, lon2_deg) )
+        assert np.allclose(d_scalar, d_matrix, atol = 1E-6)
+        assert np.allclose( (a_scalar - a_matrix + 180) % 360 - 180, 0, atol = 1E-6 )
+        print("%4d x %-4d   %15.4f   %15.5f   %15.4f   %15.5f" % (n, n, t_sd, t_md, t_sa, t_ma))
+
+    print()
+    print("N x M           float64 [s]   float32 [s]   chunked 1E4 [s]   equirect. [s]   float32 max error [m]")
+    for n in [1000, 3000]:
+        lat1_deg, lon1_deg = make_random_points(n, seed = 1)
+        lat2_deg, lon2_deg = make_random_points(n, seed = 2)
+        t64, d64 = best_time( lambda: helpers.angles.haversine_distance_matrix(lat1_deg, lon1_deg, lat2_deg, lon2_deg) )
+        t32, d32 = best_time( lambda: helpers.angles.haversine_distance_matrix(lat1_deg, lon1_deg, lat2_deg, lon2_deg, dtype = np.float32) )
+        tch, dch = best_time( lambda: helpers.angles.haversine_distance_matrix(lat1_deg, lon1_deg, lat2_deg, lon2_deg, max_chunk_elements = 10000) )
+        teq, deq = best_time( lambda: helpers.angles.equirectangular_distance_matrix(lat1_deg, lon1_deg, lat2_deg, lon2_deg) )
+        assert np.array_equal(d64, dch)
+        print("%4d x %-4d   %11.4f   %11.4f   %15.4f   %13.4f   %21.3f" % (n, n, t64, t32, tch, teq, np.max(np.abs(d64 - d32))))
+
+    print()
+    print("equirectangular fast path, latitudes within +-70 deg")
+    print("max distance [m]   max relative error")
+    for max_distance_m in [1E3, 1E4, 1E5]:
+        print("%16d   %18.2e" % (max_distance_m, equirectangular_relative_error(max_distance_m)))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the geodesic accuracy tiers of helpers.angles.geodesic_distance:
+throughput and error over array sizes from 1 to 1E6.
+
+The error is relative to the ellipsoidal tier with a tight tolerance,
+which itself is checked against the example of Vincenty (1975).
+
+Run from the repository root:
+python3 -m benchmarks.geodesic_tiers
+"""
+
+import time
+import numpy as np
+
+import helpers.angles
+
+
+def make_random_pairs(no_pairs, max_distance_m, seed = 0):
+    """
+    @return lat1_deg, lon1_deg, lat2_deg, lon2_deg (1d numpy arrays)
+            pairs at random positions and directions with distances up to max_distance_m
+    """
+    rng = np.random.default_rng(seed)
+    r = 6365000
+    lat1_deg = rng.uniform(-70, 70, no_pairs)
+    lon1_deg = rng.uniform(-180, 180, no_pairs)
+    azim     = rng.uniform(0, 2*np.pi, no_pairs)
+    dist_m   = rng.uniform(.1, 1., no_pairs) * max_distance_m
+    # destination on the sphere, valid for long distances, too
+    lat1, delta = np.radians(lat1_deg), dist_m / r
+    lat2 = np.arcsin( np.sin(lat1) * np.cos(delta) + np.cos(lat1) * np.sin(delta) * np.cos(azim) )
+    lat2_deg = np.degrees(lat2)
+    lon2_deg = lon1_deg + np.degrees( np.arctan2( np.sin(azim) * np.sin(delta) * np.cos(lat1), np.cos(delta) - np.sin(lat1) * np.sin(lat2) ) )
+    return lat1_deg, lon1_deg, lat2_deg, lon2_deg
+
+
+def throughput(tier, pairs, min_duration_s = .2):
+    """
+    @return pairs_per_s (float)
+    """
+    no_calls = 0
+    t0 = time.perf_counter()
+    while True:
+        helpers.angles.geodesic_distance( *pairs, tier = tier )
+        no_calls += 1
+        t = time.perf_counter() - t0
+        if t > min_duration_s:
+            return no_calls * len(pairs[0]) / t
+
+
+if __name__ == "__main__":
+    # Flinders Peak to Buninyong, Vincenty (1975)
+    d = helpers.angles.geodesic_distance( -(37+57/60+3.72030/3600), 144+25/60+29.52440/3600,
+                                          -(37+39/60+10.15610/3600), 143+55/60+35.38390/3600, tier = "ellipsoidal" )
+    assert abs(d - 54972.271) < 1E-3
+
+    tiers = list(helpers.angles.GEODESIC_TIERS)
+
+    print("throughput [pairs/s], pairs within 100 km")
+    print("pairs      " + "".join( "%14s" % tier for tier in tiers ))
+    for no_pairs in [1, 10, 100, 1000, 10000, 100000, 1000000]:
+        pairs = make_random_pairs(no_pairs, max_distance_m = 1E5)
+        print("%7d    " % no_pairs + "".join( "%14.3g" % throughput(tier, pairs) for tier in tiers ))
+
+    print()
+    print("max relative error vs. ellipsoidal with tolerance 1E-15, 1E5 pairs")
+    print("max distance [m]" + "".join( "%14s" % tier for tier in tiers ))
+    for max_distance_m in [1E3, 1E4, 1E5, 1E6, 1E7]:
+        pairs = make_random_pairs(100000, max_distance_m = max_distance_m)
+        d_ref = helpers.angles.vincenty_distance( *pairs, max_iterations = 200, tolerance = 1E-15 )
+        errors = [ np.max( np.abs( helpers.angles.geodesic_distance( *pairs, tier = tier ) - d_ref ) / d_ref ) for tier in tiers ]
+        print("%16d" % max_distance_m + "".join( "%14.2e" % e for e in errors ))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the route assembly in OSRM.__set_maneuvers 
+on synthetic OSRM responses.
+
+Run from the repository root:
+python3 -m benchmarks.route_assembly
+"""
+
+import time
+import numpy as np
+
+import providers.route
+
+
+def make_synthetic_osrm_route(no_steps, points_per_step = 5):
+    """
+    @brief: make an OSRM route dict with the structure of a "steps=true&geometries=geojson" response.
+    
+    @param no_steps (int)
+    @param points_per_step (int)
+    
+    @return route (dict) like d["routes"][0] of an OSRM response
+    """
+    steps = []
+    lat = 50.
+    lon = 11.
+    for i_step in range(no_steps):
+        coords = []
+        for i_point in range(points_per_step):
+            coords.append([lon, lat])
+            lon += 1E-4
+            lat += 5E-5 * np.sin(i_step)
+        lon -= 1E-4 # steps share their end and start points
+        
+        typ = "turn"
+        if i_step == 0:
+            typ = "depart"
+        elif i_step == no_steps - 1:
+            typ = "arrive"
+        steps.append({"geometry"     : {"coordinates": coords},
+                      "maneuver"     : {"type": typ, "modifier": "right"},
+                      "intersections": [{"location": coords[0], "bearings": [0, 90, 180, 270], "in": 2, "out": 1}],
+                      "driving_side" : "right",
+                      "name"         : "Street " + str(i_step),
+                      "distance"     : 30.,
+                      "duration"     : 3.,
+                     })
+    route = {"legs": [{"steps": steps}]}
+    return route
+
+
+def quadratic_assembly(route):
+    """
+    @brief: reference, the route is grown by np.hstack once per step.
+    """
+    lat_deg = []
+    lon_deg = []
+    for leg in route["legs"]:
+        for step in leg["steps"]:
+            coords = np.array(step["geometry"]["coordinates"])
+            lat_deg = np.hstack([lat_deg, coords[:,1]])
+            lon_deg = np.hstack([lon_deg, coords[:,0]])
+    return lat_deg, lon_deg
+
+
+def linear_assembly(route):
+    router = providers.route.OSRM()
+    router._OSRM__set_maneuvers(route = route)
+    return router.lat_deg, router.lon_deg
+
+
+def best_time(function, route, repetitions = 3):
+    times = []
+    for i in range(repetitions):
+        t0 = time.perf_counter()
+        function(route)
+        times.append( time.perf_counter() - t0 )
+    return min(times)
+
+
+if __name__ == "__main__":
+    print("steps   quadratic hstack [s]   __set_maneuvers [s]")
+    for no_steps in [1000, 2000, 5000, 10000, 20000]:
+        route = make_synthetic_osrm_route(no_steps = no_steps)
+        
+        lat_q, lon_q = quadratic_assembly(route)
+        lat_l, lon_l = linear_assembly(route)
+        assert np.array_equal(lat_q, lat_l) and np.array_equal(lon_q, lon_l)
+        
+        t_quadratic = best_time(quadratic_assembly, route)
+        t_linear    = best_time(linear_assembly, route)
+        print("%5d   %20.4f   %19.4f" % (no_steps, t_quadratic, t_linear))
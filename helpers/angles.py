@@ -44,6 +44,138 @@ def haversine_distance(lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = 6365000 ):
     d = 2 * r * np.arcsin( np.sqrt(tmp) )
     return d
 
+
+def iter_distance_matrix_chunks(lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = 6365000, kind = "haversine", max_chunk_elements = 100000, dtype = np.float64):
+    """
+    @brief: Matrix of all distances (or azimuths) between 2 sets of points,
+            in blocks of rows, so that the memory of each block is bounded.
+    
+    Useful if the full matrix is too large, 
+    e.g. to find the nearest point of set 2 for each point of set 1 chunk by chunk.
+    
+    @param lat1_deg (1d numpy array of N float) Latitudes  of set 1 in degree.
+    @param lon1_deg (1d numpy array of N float) Longitudes of set 1 in degree.
+    @param lat2_deg (1d numpy array of M float) Latitudes  of set 2 in degree.
+    @param lon2_deg (1d numpy array of M float) Longitudes of set 2 in degree.
+    @param r        (float) Sphere radius.
+    @param kind     (str) 
+           "haversine"       distance, see haversine_distance
+           "equirectangular" distance, see equirectangular_distance_matrix
+           "azimuth"         compass direction from point 1 towards point 2 in degree
+    @param max_chunk_elements (int) maximum number of matrix elements per block
+    @param dtype (numpy dtype) np.float64 or np.float32.
+           With np.float32, the angles are taken relative to the mean of all points 
+           before rounding, so the resolution is some cm for points within about 100 km.
+    
+    @return chunks (generator of (int, 2d numpy array))
+           first row of the block and block of shape (rows, M)
+    """
+    lat1_deg = np.asarray(lat1_deg, dtype=float).reshape(-1)
+    lon1_deg = np.asarray(lon1_deg, dtype=float).reshape(-1)
+    lat2_deg = np.asarray(lat2_deg, dtype=float).reshape(-1)
+    lon2_deg = np.asarray(lon2_deg, dtype=float).reshape(-1)
+    
+    # reference angles, subtracted in float64 so that float32 keeps the small differences
+    lat_ref = 0.
+    lon_ref = 0.
+    if len(lat1_deg) + len(lat2_deg) != 0:
+        lat_ref = np.mean( np.hstack([lat1_deg, lat2_deg]) )
+        lon_ref = np.mean( np.hstack([lon1_deg, lon2_deg]) )
+    lat1 = ( (lat1_deg - lat_ref) * pi / 180.0 ).astype(dtype)
+    lon1 = ( (lon1_deg - lon_ref) * pi / 180.0 ).astype(dtype)
+    lat2 = ( (lat2_deg - lat_ref) * pi / 180.0 ).astype(dtype)
+    lon2 = ( (lon2_deg - lon_ref) * pi / 180.0 ).astype(dtype)
+    
+    # everything that depends on one point only is computed once per point
+    cos_lat1 = np.cos( lat1_deg * pi / 180.0 ).astype(dtype)[:,np.newaxis]
+    cos_lat2 = np.cos( lat2_deg * pi / 180.0 ).astype(dtype)[np.newaxis,:]
+    sin_lat1 = np.sin( lat1_deg * pi / 180.0 ).astype(dtype)[:,np.newaxis]
+    sin_lat2 = np.sin( lat2_deg * pi / 180.0 ).astype(dtype)[np.newaxis,:]
+    # cos of the mean latitude of a pair by the addition theorem, without trigonometry per element
+    cos_half_lat1 = np.cos( lat1_deg * pi / 360.0 ).astype(dtype)[:,np.newaxis]
+    cos_half_lat2 = np.cos( lat2_deg * pi / 360.0 ).astype(dtype)[np.newaxis,:]
+    sin_half_lat1 = np.sin( lat1_deg * pi / 360.0 ).astype(dtype)[:,np.newaxis]
+    sin_half_lat2 = np.sin( lat2_deg * pi / 360.0 ).astype(dtype)[np.newaxis,:]
+    lons_deg = np.hstack([lon1_deg, lon2_deg])
+    crosses_date_line = len(lons_deg) != 0 and np.max(lons_deg) - np.min(lons_deg) > 180
+    
+    rows_per_chunk = max( 1, int(max_chunk_elements) // max(1, len(lat2)) )
+    for i0 in range(0, len(lat1), rows_per_chunk):
+        i1 = min( len(lat1), i0 + rows_per_chunk )
+        dlat = lat2[np.newaxis,:] - lat1[i0:i1,np.newaxis]
+        dlon = lon2[np.newaxis,:] - lon1[i0:i1,np.newaxis]
+        
+        if kind == "haversine":
+            tmp = hav(dlat) + cos_lat1[i0:i1] * cos_lat2 * hav(dlon)
+            block = 2 * dtype(r) * np.arcsin( np.sqrt( np.minimum(tmp, 1) ) )
+        elif kind == "equirectangular":
+            if crosses_date_line:
+                dlon = ( dlon + dtype(pi) ) % dtype(2*pi) - dtype(pi)
+            cos_mean_lat = cos_half_lat1[i0:i1] * cos_half_lat2 - sin_half_lat1[i0:i1] * sin_half_lat2
+            dlon *= cos_mean_lat
+            block = dtype(r) * np.sqrt( dlat * dlat + dlon * dlon )
+        elif kind == "azimuth":
+            y = np.sin(dlon) * cos_lat2
+            x = cos_lat1[i0:i1] * sin_lat2 - sin_lat1[i0:i1] * cos_lat2 * np.cos(dlon)
+            block = np.arctan2(y, x) * dtype(180 / pi) % dtype(360)
+        else:
+            raise Exception("Unknown kind of matrix: " + str(kind))
+        yield i0, block.astype(dtype, copy=False)
+
+
+def __fill_matrix__(lat1_deg, lon1_deg, lat2_deg, lon2_deg, r, kind, max_chunk_elements, dtype):
+    shape = ( np.size(lat1_deg), np.size(lat2_deg) )
+    out = np.empty( shape, dtype=dtype )
+    for i0, block in iter_distance_matrix_chunks( lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = r, kind = kind, max_chunk_elements = max_chunk_elements, dtype = dtype ):
+        out[i0:i0+len(block)] = block
+    return out
+
+
+def haversine_distance_matrix(lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = 6365000, max_chunk_elements = 100000, dtype = np.float64):
+    """
+    @brief: Haversine distance of every point of set 1 to every point of set 2.
+    
+    The temporary arrays are bounded by max_chunk_elements, the result has N x M elements.
+    See iter_distance_matrix_chunks for the parameters.
+    
+    @return d (2d numpy array of shape (N, M)) d[i,j] is the distance of point 1 i to point 2 j.
+    """
+    return __fill_matrix__( lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = r, kind = "haversine", max_chunk_elements = max_chunk_elements, dtype = dtype )
+
+
+def equirectangular_distance_matrix(lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = 6365000, max_chunk_elements = 100000, dtype = np.float64):
+    """
+    @brief: Fast approximation of haversine_distance_matrix for short distances.
+    
+    The points are projected to a plane with longitudes scaled by the cosine of the mean latitude
+    of each pair. This needs no trigonometric function per matrix element,
+    whereas the haversine formula needs 2 sines, a square root and an arcsin.
+    
+    Error bound, relative to haversine_distance: 
+    below 1E-6 for distances up to 10 km and below 1E-4 for distances up to 100 km,
+    for latitudes within +-70 degree (measured by benchmarks/distance_matrix.py).
+    The error grows quadratically with the distance and with the tangent of the latitude.
+    Use haversine_distance_matrix for longer distances or near the poles.
+    
+    See iter_distance_matrix_chunks for the parameters.
+    
+    @return d (2d numpy array of shape (N, M))
+    """
+    return __fill_matrix__( lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = r, kind = "equirectangular", max_chunk_elements = max_chunk_elements, dtype = dtype )
+
+
+def azimuth_matrix(lat1_deg, lon1_deg, lat2_deg, lon2_deg, max_chunk_elements = 100000, dtype = np.float64):
+    """
+    @brief: Azimuth (compass direction, 0 is north, 90 is east) 
+            from every point of set 1 towards every point of set 2.
+    
+    See iter_distance_matrix_chunks for the parameters.
+    
+    @return azim_deg (2d numpy array of shape (N, M)) in degree, from 0 to 360
+    """
+    return __fill_matrix__( lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = 1, kind = "azimuth", max_chunk_elements = max_chunk_elements, dtype = dtype )
+
+
 def mercator_distance(lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = 6365000 ):
     """
     Calculates the air line distance between 2 points on the surface of a sphere.
@@ -81,6 +213,150 @@ def mercator_xy_distance(lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = 6365000 ):
     return dx,dy
 
 
+# WGS84 ellipsoid
+WGS84_A_M = 6378137.0
+WGS84_F   = 1 / 298.257223563
+
+def vincenty_distance(lat1_deg, lon1_deg, lat2_deg, lon2_deg, a = WGS84_A_M, f = WGS84_F, max_iterations = 20, tolerance = 1E-12 ):
+    """
+    Calculates the geodesic distance between 2 points on an ellipsoid
+    with the inverse formula of Vincenty (1975).
+    All pairs are iterated together. The iteration stops when all pairs 
+    have converged or after max_iterations.
+    
+    The error is below 1 mm for converged pairs.
+    The iteration may not converge for nearly antipodal points.
+    For these pairs, the spherical distance with the mean radius 
+    of the ellipsoid is returned, which is off by up to 0.5%.
+    
+    @param lat1_deg (float or numpy array) Latitude  of Point 1 in degree.
+    @param lon1_deg (float or numpy array) Longitude of Point 1 in degree.
+    @param lat2_deg (float or numpy array) Latitude  of Point 2 in degree.
+    @param lon2_deg (float or numpy array) Longitude of Point 2 in degree.
+    @param a        (float) Equatorial radius of the ellipsoid.
+    @param f        (float) Flattening of the ellipsoid.
+    @param max_iterations (int)
+    @param tolerance (float) in rad, convergence threshold of the longitude on the auxiliary sphere
+    
+    @return d (float or numpy array)
+           Distance between the 2 points. 
+           Unit is the same as the unit of a.
+    """
+    lat1_deg, lon1_deg, lat2_deg, lon2_deg = np.broadcast_arrays( np.asarray(lat1_deg, dtype=float), np.asarray(lon1_deg, dtype=float),
+                                                                  np.asarray(lat2_deg, dtype=float), np.asarray(lon2_deg, dtype=float) )
+    b = a * (1 - f)
+    L = ( lon2_deg - lon1_deg ) * pi / 180.0
+    U1 = np.arctan( (1 - f) * np.tan( lat1_deg * pi / 180.0 ) )
+    U2 = np.arctan( (1 - f) * np.tan( lat2_deg * pi / 180.0 ) )
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+    
+    lam = L
+    is_converged = np.zeros( np.shape(L), dtype=bool )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i_iteration in range(max_iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt( (cosU2 * sin_lam)**2 + (cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)**2 )
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2( sin_sigma, cos_sigma )
+            sin_alpha = np.where( sin_sigma == 0, 0, cosU1 * cosU2 * sin_lam / sin_sigma )
+            cos_sq_alpha = 1 - sin_alpha**2
+            # on the equator, cos_sq_alpha is 0 and the term is irrelevant
+            cos_2sigma_m = np.where( cos_sq_alpha == 0, 0, cos_sigma - 2 * sinU1 * sinU2 / cos_sq_alpha )
+            C = f / 16 * cos_sq_alpha * ( 4 + f * (4 - 3 * cos_sq_alpha) )
+            lam_previous = lam
+            lam = L + (1 - C) * f * sin_alpha * ( sigma + C * sin_sigma * ( cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m**2) ) )
+            is_converged = np.abs(lam - lam_previous) < tolerance
+            if np.all(is_converged):
+                break
+    
+    u_sq = cos_sq_alpha * (a**2 - b**2) / b**2
+    A = 1 + u_sq / 16384 * ( 4096 + u_sq * ( -768 + u_sq * (320 - 175 * u_sq) ) )
+    B = u_sq / 1024 * ( 256 + u_sq * ( -128 + u_sq * (74 - 47 * u_sq) ) )
+    delta_sigma = B * sin_sigma * ( cos_2sigma_m + B / 4 * ( cos_sigma * (-1 + 2 * cos_2sigma_m**2) 
+                                                             - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sigma_m**2) ) )
+    d = b * A * (sigma - delta_sigma)
+    
+    if not np.all(is_converged):
+        r_mean = (2 * a + b) / 3
+        d_sphere = haversine_distance( lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = r_mean )
+        d = np.where( is_converged, d, d_sphere )
+    return d[()]
+
+
+def flat_distance(lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = 6365000 ):
+    """
+    Calculates the distance between 2 points in a flat, local frame
+    (equirectangular projection at the mean latitude, see mercator_distance).
+    Fastest, but only accurate for short distances, 
+    see equirectangular_distance_matrix for the error bound.
+    """
+    return mercator_distance( lat1_deg=lat1_deg, lon1_deg=lon1_deg, lat2_deg=lat2_deg, lon2_deg=lon2_deg, r = r )
+
+
+# geodesic accuracy tiers, from fast to accurate
+GEODESIC_TIERS = {
+    "flat"        : flat_distance,
+    "spherical"   : haversine_distance,
+    "ellipsoidal" : vincenty_distance,
+    }
+
+def geodesic_distance(lat1_deg, lon1_deg, lat2_deg, lon2_deg, tier = "spherical", **kwargs ):
+    """
+    Calculates the distance between 2 points with a selectable trade-off
+    between speed and accuracy.
+    
+    @param lat1_deg (float or numpy array) Latitude  of Point 1 in degree.
+    @param lon1_deg (float or numpy array) Longitude of Point 1 in degree.
+    @param lat2_deg (float or numpy array) Latitude  of Point 2 in degree.
+    @param lon2_deg (float or numpy array) Longitude of Point 2 in degree.
+    @param tier (str) one of GEODESIC_TIERS
+           "flat"        local plane,     for short distances in the frame loop
+           "spherical"   haversine,       off by up to 0.5% due to the flattening of the earth
+           "ellipsoidal" Vincenty, WGS84, below 1 mm
+    @param kwargs are passed to the distance function of the tier, e.g. r or max_iterations
+    
+    @return d (float or numpy array) in m
+    """
+    if tier not in GEODESIC_TIERS:
+        raise Exception("Unknown geodesic tier '" + str(tier) + "'. Choose one of " + str(list(GEODESIC_TIERS)))
+    return GEODESIC_TIERS[tier]( lat1_deg=lat1_deg, lon1_deg=lon1_deg, lat2_deg=lat2_deg, lon2_deg=lon2_deg, **kwargs )
+
+
+def angles_to_local_east_north(lat_deg, lon_deg, lat0_deg, lon0_deg, r = 6365000 ):
+    """
+    @brief: Projects angles to a flat, local east-north frame around a reference point.
+    
+    Equirectangular projection, so the result is accurate 
+    for a few kilometers around the reference point only.
+    
+    @param lat_deg  (float or numpy array)
+    @param lon_deg  (float or numpy array)
+    @param lat0_deg (float) Latitude  of the reference point (origin) in degree.
+    @param lon0_deg (float) Longitude of the reference point (origin) in degree.
+    @param r        (float) Sphere radius.
+    
+    @return east_m  (float or numpy array)
+    @return north_m (float or numpy array)
+           Unit is the same as the unit of r.
+    """
+    east_m  = r * np.cos(lat0_deg * pi / 180.0) * (lon_deg - lon0_deg) * pi / 180.0
+    north_m = r * (lat_deg - lat0_deg) * pi / 180.0
+    return east_m, north_m
+
+
+def local_east_north_to_angles(east_m, north_m, lat0_deg, lon0_deg, r = 6365000 ):
+    """
+    @brief: Inverse of angles_to_local_east_north.
+    
+    @return lat_deg (float or numpy array)
+    @return lon_deg (float or numpy array)
+    """
+    lat_deg = lat0_deg + north_m / r * 180.0 / pi
+    lon_deg = lon0_deg + east_m / ( r * np.cos(lat0_deg * pi / 180.0) ) * 180.0 / pi
+    return lat_deg, lon_deg
+
+
 def relation_of_cartesian_polyline_segments_to_origin(x,y):
     """
     @brief: Calculates the closest point to the origin for each segment of a polygon line.
@@ -149,16 +425,21 @@ def relation_of_angular_polyline_segments_to_reference_position(lat_poly_deg, lo
 def calc_angle_C(a,b,c, lon1_deg, lon2_deg):
     """
     @brief: Function to assist the airline function (do not use externally).
+    
+    All parameters may be floats or numpy arrays of the same shape.
     """
-    cosC = ( np.cos(c) - np.cos(a) * np.cos(b) ) / ( np.sin(a) * np.sin(b) )
-    cosC = min( 1, cosC )
-    cosC = max(-1, cosC )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cosC = ( np.cos(c) - np.cos(a) * np.cos(b) ) / ( np.sin(a) * np.sin(b) )
+    # degenerate triangles (identical points, points on a pole) have the angle 0
+    cosC = np.where( np.isnan(cosC), 1, cosC )
+    cosC = np.clip( cosC, -1, 1 )
     C = np.arccos(cosC)
     
-    if lon1_deg > lon2_deg:
-        C = 2*pi - C
+    # point 2 is west of point 1, the shorter way around the globe
+    is_west = np.sin( ( np.asarray(lon2_deg) - lon1_deg ) * pi / 180 ) < 0
+    C = np.where( is_west, 2*pi - C, C )
 
-    return C
+    return C[()]
 
 def calc_properties_of_airline(lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = 6365000):
     """
@@ -169,7 +450,12 @@ def calc_properties_of_airline(lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = 63650
     Consider a "triangle" on a unit sphere with edges on point1, point2, and the north pole.
     Apply the spherical law of cosines.
     https://en.wikipedia.org/wiki/Spherical_law_of_cosines
+    
+    The coordinates may be floats or numpy arrays, which are broadcast against each other.
+    The dict values then are arrays of the broadcast shape.
     """
+    lat1_deg, lon1_deg, lat2_deg, lon2_deg = np.broadcast_arrays( np.asarray(lat1_deg, dtype=float), np.asarray(lon1_deg, dtype=float),
+                                                                  np.asarray(lat2_deg, dtype=float), np.asarray(lon2_deg, dtype=float) )
     a = haversine_distance(lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = 1 )
     b = (90 - lat1_deg) * pi / 180
     c = (90 - lat2_deg) * pi / 180
@@ -177,17 +463,28 @@ def calc_properties_of_airline(lat1_deg, lon1_deg, lat2_deg, lon2_deg, r = 63650
     C = calc_angle_C( a=a, b=b, c=c, lon1_deg=lon1_deg, lon2_deg=lon2_deg )
     B = calc_angle_C( a=a, b=c, c=b, lon1_deg=lon2_deg, lon2_deg=lon1_deg )
     
-    return {"distance_m": a * r,
+    return {"distance_m": (a * r)[()],
             "azimuth_from_point_1_towards_2_deg": C * 180/pi,
             "azimuth_from_point_2_towards_1_deg": B * 180/pi,
             }
-    
+
+# compass sectors of 45 degree, sector i is centered at i * 45 degree
+NESW_SECTOR_NAMES = np.array(["North", "North-East", "East", "South-East", "South", "South-West", "West", "North-West"])
+
 def azimuth_to_nesw_string(azim_deg):
-    dir_to_name = {337.5:"North-West", 292.5:"West", 247.5:"South-West", 202.5:"South", 157.5:"South-East", 112.5:"East", 67.5:"North-East", 22.5 :"North" }
-    borders = np.array(list(dir_to_name.keys()), dtype=float)
-    direction  = borders[-1]
-    for b in borders:
-        if azim_deg % 360 <= b:
-            direction = b
-    nesw_string = dir_to_name[direction]
+    """
+    @brief: name of the compass sector of an azimuth. 
+            A border between sectors belongs to the sector counterclockwise of it.
+            NaN is North.
+    
+    @param azim_deg (float or numpy array of float)
+    
+    @return nesw_string (str or numpy array of str)
+    """
+    azim_deg = np.asarray(azim_deg, dtype=float)
+    sector = np.ceil( ( azim_deg % 360 - 22.5 ) / 45 )
+    sector = np.where( np.isnan(sector), 0, sector ).astype(int) % 8
+    nesw_string = NESW_SECTOR_NAMES[sector]
+    if nesw_string.ndim == 0:
+        return str(nesw_string)
     return nesw_string
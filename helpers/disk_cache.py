@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A directory of files that is limited in size, the base of the route and audio caches.
+"""
+
+import os
+import hashlib
+
+
+class DiskCache(object):
+    def __init__(self, directory, extension, max_size_bytes):
+        """
+        @brief: One file per cache entry, named by the key of the entry.
+
+        If the files grow larger than max_size_bytes,
+        the files with the oldest modification times are deleted.
+        Derived classes that update the modification time on each hit
+        (see touch) delete the least recently used entries.
+
+        @param directory (str) is created if it does not exist
+        @param extension (str) of the files, e.g. ".pickle"
+        @param max_size_bytes (int)
+        """
+        self.directory      = directory
+        self.extension      = extension
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def hash_key(self, *parts):
+        """
+        @param parts (str or bytes) everything that identifies an entry
+
+        @return key (str)
+        """
+        m = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode("utf-8")
+            m.update(part)
+            m.update(b"\0")
+        return m.hexdigest()
+
+    def get_filename(self, key):
+        return os.path.join(self.directory, key + self.extension)
+
+    def touch(self, key):
+        """
+        @brief: mark an entry as recently used.
+
+        @return filename (str or None) None if the entry does not exist
+        """
+        filename = self.get_filename(key)
+        try:
+            os.utime(filename)
+        except OSError:
+            return None
+        return filename
+
+    def write(self, key, data):
+        """
+        @param key (str)
+        @param data (bytes)
+
+        @return filename (str)
+        """
+        filename = self.get_filename(key)
+        with open(filename + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(filename + ".tmp", filename) # readers never see half written files
+        self.limit_size()
+        return filename
+
+    def limit_size(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.extension):
+                stat = os.stat( os.path.join(self.directory, name) )
+                entries.append( (stat.st_mtime, stat.st_size, name) )
+        entries.sort()
+        total_size = sum( e[1] for e in entries )
+        for mtime, size, name in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            os.remove( os.path.join(self.directory, name) )
+            total_size -= size
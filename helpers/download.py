@@ -7,6 +7,7 @@ from PIL import PngImagePlugin
 import numpy as np
 import urllib.parse
 import requests
+import codecs
 import json
 
 
@@ -81,3 +82,20 @@ def remote_json_to_py(url):
     p = json.JSONDecoder().decode( s = json_request.content.decode("utf-8") )
     return p
     
+
+
+def remote_text_chunks(url, chunk_size = 65536):
+    """
+    @brief: Download a text file piece by piece, 
+            without holding the whole file in RAM.
+    
+    @param  url (str) Remote file location
+    @param  chunk_size (int) in bytes
+    @return chunks (generator of str)
+    """
+    print("Downloading", url)
+    text_request = requests.get(url, stream = True)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for byte_chunk in text_request.iter_content( chunk_size = chunk_size ):
+        yield decoder.decode(byte_chunk)
+    yield decoder.decode(b"", final = True)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental parsing of large JSON documents.
+
+Instead of decoding a whole response into one object tree,
+the elements of selected arrays are decoded and handed out one by one,
+so that only one element is held in memory at a time.
+"""
+
+import re
+import json
+import itertools
+
+
+class ArrayItemStreamer(object):
+    def __init__(self, key, max_outside_chars = 1000000):
+        """
+        @brief: Finds all arrays with the given key in a stream of JSON text
+                and decodes their elements one at a time.
+        
+        The text outside these arrays is kept in self.outside_text,
+        e.g. to read status codes after the stream has ended.
+        
+        example:
+        streamer = ArrayItemStreamer(key = "steps")
+        for step in streamer.iter_items( chunks = ['{"code": "Ok", "steps": [{"a"', ': 1}, {"a": 2}]}'] ):
+            print(step)
+        print(streamer.outside_text)
+        
+        @param key (str) name of the arrays
+        @param max_outside_chars (int) 
+               The text outside the arrays is not stored beyond this length.
+        """
+        self.pattern = re.compile( r'"' + re.escape(key) + r'"\s*:\s*\[' )
+        self.separators = re.compile( r'[ \t\r\n,]*' )
+        self.max_outside_chars = max_outside_chars
+        self.decoder = json.JSONDecoder()
+        self.outside_text = ""
+    
+    def __keep_outside_text__(self, text):
+        if len(self.outside_text) < self.max_outside_chars:
+            self.outside_text += text[ : self.max_outside_chars - len(self.outside_text) ]
+    
+    def iter_items(self, chunks, keep_chars = 64):
+        """
+        @param chunks (iterable of str) consecutive pieces of the JSON text
+        @param keep_chars (int) 
+               text kept between chunks when searching for the key,
+               so that keys spread over 2 chunks are found.
+        
+        @return items (generator) decoded array elements
+        """
+        buf = ""
+        pos = 0 # read position in buf, buf is trimmed once per chunk
+        min_len_for_retry = 0 # an incomplete element is decoded again when the text after pos is this long
+        is_in_array = False
+        for chunk in itertools.chain(chunks, [None]):
+            is_final = ( chunk is None )
+            if not is_final:
+                buf = buf[pos:] + chunk
+                pos = 0
+                if len(buf) < min_len_for_retry:
+                    continue
+            while True:
+                if not is_in_array:
+                    match = self.pattern.search(buf, pos)
+                    if match is None:
+                        keep_from = max( pos, len(buf) - keep_chars )
+                        self.__keep_outside_text__( buf[pos:keep_from] )
+                        pos = keep_from
+                        break
+                    self.__keep_outside_text__( buf[pos:match.start()] )
+                    pos = match.end()
+                    is_in_array = True
+                
+                # skip separators between the elements
+                pos = self.separators.match(buf, pos).end()
+                if pos == len(buf):
+                    break
+                if buf[pos] == "]":
+                    pos += 1
+                    is_in_array = False
+                    continue
+                
+                try:
+                    item, end = self.decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # element is not complete yet, it is decoded again when its text has doubled,
+                    # so that a long element is not decoded once per chunk
+                    min_len_for_retry = 2 * ( len(buf) - pos )
+                    break
+                min_len_for_retry = 0
+                pos = end
+                yield item
+        
+        if is_in_array:
+            raise Exception("JSON text ended inside the array")
+        self.__keep_outside_text__( buf[pos:] )
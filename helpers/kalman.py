@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file provides Kalman filters to smooth and predict positions.
+"""
+
+import numpy as np
+
+
+class ConstantVelocityKalmanFilter(object):
+    def __init__(self, acceleration_sigma = 2.0):
+        """
+        @brief: Kalman filter for a point that moves with (almost) constant velocity in a plane.
+        
+        The state is [east, north, velocity_east, velocity_north]
+        in a local metric frame.
+        Changes of the velocity are modelled as white noise acceleration.
+        
+        @param acceleration_sigma (float)
+               Standard deviation of the unmodelled acceleration in m/s^2.
+        """
+        self.acceleration_sigma = acceleration_sigma
+        self.x = np.zeros(4)
+        self.P = np.eye(4)
+        
+    def reset(self, east_m, north_m, velocity_east, velocity_north, position_sigma_m, velocity_sigma):
+        """
+        @brief: forget the history and start over at a measured state.
+        """
+        self.x = np.array([east_m, north_m, velocity_east, velocity_north], dtype=float)
+        self.P = np.diag([position_sigma_m**2, position_sigma_m**2, velocity_sigma**2, velocity_sigma**2])
+
+    def transition_matrices(self, dt):
+        """
+        @param dt (float) time step in s
+        
+        @return F (2d numpy array of 4x4 float) state transition
+        @return Q (2d numpy array of 4x4 float) process noise
+        """
+        F = np.eye(4)
+        F[0,2] = dt
+        F[1,3] = dt
+        
+        q = self.acceleration_sigma**2
+        Q = np.zeros((4,4))
+        Q[0,0] = Q[1,1] = q * dt**4 / 4
+        Q[0,2] = Q[2,0] = Q[1,3] = Q[3,1] = q * dt**3 / 2
+        Q[2,2] = Q[3,3] = q * dt**2
+        return F, Q
+    
+    def predict(self, dt):
+        """
+        @brief: state after a time step, without changing the filter.
+        
+        @param dt (float) time since the last update in s
+        
+        @return x (1d numpy array of 4 float) predicted state
+        @return P (2d numpy array of 4x4 float) predicted covariance
+        """
+        F, Q = self.transition_matrices(dt)
+        x = np.dot(F, self.x)
+        P = np.dot( np.dot(F, self.P), F.T ) + Q
+        return x, P
+    
+    def update(self, dt, z, R, gate = 13.8):
+        """
+        @brief: propagate the filter to the time of a measurement and apply the measurement.
+        
+        @param dt (float) time since the last update in s
+        @param z (1d numpy array of 2 or 4 float)
+               Measured east and north position, 
+               optionally followed by the measured velocity east and north.
+        @param R (2d numpy array of float) measurement covariance
+        @param gate (float)
+               Outlier threshold for the squared Mahalanobis distance 
+               of the position innovation.
+               The default is the 99.9% quantile of the chi square distribution 
+               with 2 degrees of freedom.
+               
+        @return is_accepted (bool)
+               False if the measurement was rejected as an outlier.
+               In that case, the filter is not changed.
+        """
+        x, P = self.predict(dt)
+        n = len(z)
+        H = np.eye(4)[:n]
+        
+        y = z - np.dot(H, x)
+        S = np.dot( np.dot(H, P), H.T ) + R
+        
+        # gate on the position part only, velocity errors are no outliers
+        mahalanobis_sq = np.dot( y[:2], np.linalg.solve(S[:2,:2], y[:2]) )
+        is_accepted = ( mahalanobis_sq <= gate )
+        
+        if is_accepted:
+            K = np.dot( P, np.linalg.solve(S, H).T )
+            self.x = x + np.dot(K, y)
+            self.P = np.dot( np.eye(4) - np.dot(K, H), P )
+        return is_accepted
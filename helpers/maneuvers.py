@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Column-wise storage of the maneuvers of a route.
+
+A route with thousands of maneuvers is stored in a few numpy arrays
+instead of thousands of dicts. Consumers that work on one maneuver at a time
+get a ManeuverRow, which behaves like the former maneuver dict.
+"""
+
+import numpy as np
+
+
+# column name -> (numpy dtype, default value)
+NUMERIC_COLUMNS = {
+    "in_bearing_deg"   : (float,    np.nan),
+    "out_bearing_deg"  : (float,    np.nan),
+    "left_driving"     : (bool,     False),
+    "exit_number"      : (np.int32, 0),
+    "ind_on_route"     : (np.int64, 0),
+    "distance_to_next" : (float,    0.),
+    "distance_to_prev" : (float,    0.),
+    "duration_to_next" : (float,    np.nan),
+    }
+
+# columns of strings, stored as codes of the string pool of the table
+STRING_COLUMNS = ["type", "icon_type", "street_name_after", "movement_modifier"]
+
+# row keys that refer to the whole route, stored once per table
+ROUTE_KEYS = ["route_lat_deg", "route_lon_deg", "distances_from_route_start", "route_index"]
+
+
+class ManeuverTable(object):
+    def __init__(self, maneuver_dicts = []):
+        """
+        @brief: The maneuvers of a route as struct of arrays.
+
+        Columns:
+        self.location      (2d numpy array of Nx2 float) longitude and latitude
+        self.bearings_deg  (1d numpy array of float) bearings of all maneuvers,
+                           the bearings of maneuver i are
+                           bearings_deg[ bearing_starts[i] : bearing_starts[i+1] ]
+        self.columns       (dict of 1d numpy arrays) see NUMERIC_COLUMNS
+        self.string_codes  (dict of 1d numpy arrays of int) see STRING_COLUMNS,
+                           indices in self.strings
+        self.extras        (dict of lists)
+                           all other row keys, e.g. text_blocks of a Director
+        self.route         (dict) see ROUTE_KEYS
+
+        @param maneuver_dicts (list of dicts) maneuvers in the format of OSRM.__step_to_maneuver__
+        """
+        no_maneuvers = len(maneuver_dicts)
+
+        self.location = np.array( [ m.get("location", (np.nan, np.nan)) for m in maneuver_dicts ], dtype=float ).reshape(-1,2)
+
+        bearings = [ np.array( m.get("bearings_deg", []), dtype=float ).reshape(-1) for m in maneuver_dicts ]
+        self.bearing_starts = np.zeros( no_maneuvers+1, dtype=np.int64 )
+        self.bearing_starts[1:] = np.cumsum( [ len(b) for b in bearings ] )
+        self.bearings_deg = np.concatenate( [np.zeros(0)] + bearings )
+
+        self.columns = {}
+        for key in NUMERIC_COLUMNS:
+            dtype, default = NUMERIC_COLUMNS[key]
+            self.columns[key] = np.array( [ m.get(key, default) for m in maneuver_dicts ], dtype=dtype ).reshape(-1)
+
+        self.strings = []
+        self.string_to_code = {}
+        self.string_codes = {}
+        for key in STRING_COLUMNS:
+            self.string_codes[key] = np.array( [ self.intern( m.get(key, "") ) for m in maneuver_dicts ], dtype=np.int32 ).reshape(-1)
+
+        known_keys = set( ["location", "bearings_deg"] + list(NUMERIC_COLUMNS) + STRING_COLUMNS + ROUTE_KEYS )
+        self.extras = {}
+        for i_man, m in enumerate(maneuver_dicts):
+            for key in m:
+                if key not in known_keys:
+                    self.extras.setdefault( key, [None] * no_maneuvers )[i_man] = m[key]
+
+        self.route = {}
+
+    def intern(self, string):
+        """
+        @return code (int) index of the string in self.strings
+        """
+        if string not in self.string_to_code:
+            self.string_to_code[string] = len(self.strings)
+            self.strings.append(string)
+        return self.string_to_code[string]
+
+    def set_route(self, lat_deg, lon_deg, dist_from_start, route_index):
+        """
+        @brief: the whole route, which every row refers to
+        """
+        self.route = {"route_lat_deg"              : lat_deg,
+                      "route_lon_deg"              : lon_deg,
+                      "distances_from_route_start" : dist_from_start,
+                      "route_index"                : route_index,
+                     }
+
+    def set_extras(self, key, values):
+        """
+        @brief: sets a row key that is no column for all rows at once
+        
+        @param key (str)
+        @param values (list) one value per maneuver
+        """
+        if len(values) != len(self):
+            raise Exception("expected " + str(len(self)) + " values for '" + key + "', got " + str(len(values)))
+        self.extras[key] = list(values)
+
+    def get_strings(self, key):
+        """
+        @return strings (list of str) the whole string column
+        """
+        return [ self.strings[code] for code in self.string_codes[key] ]
+
+    def __getstate__(self):
+        # the route is stored by the router, not per table
+        state = self.__dict__.copy()
+        state["route"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # tables pickled by an older version may lack columns
+        for key in NUMERIC_COLUMNS:
+            if key not in self.columns:
+                dtype, default = NUMERIC_COLUMNS[key]
+                self.columns[key] = np.full( len(self.location), default, dtype=dtype )
+
+    def __len__(self):
+        return len(self.location)
+
+    def __getitem__(self, i_man):
+        if i_man < 0:
+            i_man += len(self)
+        if not 0 <= i_man < len(self):
+            raise IndexError("maneuver index out of range")
+        return ManeuverRow( table = self, i_man = int(i_man) )
+
+    def __iter__(self):
+        for i_man in range(len(self)):
+            yield ManeuverRow( table = self, i_man = i_man )
+
+
+class ManeuverRow(object):
+    def __init__(self, table, i_man):
+        """
+        @brief: One maneuver of a ManeuverTable, with the interface of a dict.
+                Reading and writing goes to the columns of the table.
+
+        @param table (ManeuverTable)
+        @param i_man (int)
+        """
+        self.table = table
+        self.i_man = i_man
+
+    def keys(self):
+        table = self.table
+        keys = ["location", "bearings_deg"] + list(table.columns) + list(table.string_codes)
+        keys += [ key for key in table.extras if table.extras[key][self.i_man] is not None ]
+        keys += list(table.route)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        table = self.table
+        return ( key in table.columns or key in table.string_codes or key in ["location", "bearings_deg"] or key in table.route
+                 or ( key in table.extras and table.extras[key][self.i_man] is not None ) )
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key):
+        table = self.table
+        i = self.i_man
+        if key in table.columns:
+            return table.columns[key][i]
+        elif key in table.string_codes:
+            return table.strings[ table.string_codes[key][i] ]
+        elif key == "location":
+            return table.location[i]
+        elif key == "bearings_deg":
+            return table.bearings_deg[ table.bearing_starts[i] : table.bearing_starts[i+1] ]
+        elif key in table.route:
+            return table.route[key]
+        elif key in table.extras and table.extras[key][i] is not None:
+            return table.extras[key][i]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        table = self.table
+        i = self.i_man
+        if key in table.columns:
+            table.columns[key][i] = value
+        elif key in table.string_codes:
+            table.string_codes[key][i] = table.intern(value)
+        elif key == "location":
+            table.location[i] = value
+        elif key == "bearings_deg" or key in ROUTE_KEYS:
+            raise Exception("'" + key + "' can not be set for a single maneuver")
+        else:
+            table.extras.setdefault( key, [None] * len(table) )[i] = value
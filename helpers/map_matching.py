@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Map matching of noisy position fixes onto a route.
+"""
+
+import numpy as np
+
+import helpers.angles
+
+
+class MatchedPosition(object):
+    def __init__(self, position, lat_deg, lon_deg):
+        """
+        @brief: A position provider snapshot with the position replaced by a matched one.
+                Has the attributes that markers and the map read from a position provider.
+
+        @param position (providers.positions.PositionProvider)
+        @param lat_deg (float)
+        @param lon_deg (float)
+        """
+        self.latitude  = lat_deg
+        self.longitude = lon_deg
+        self.heading   = position.heading
+        self.velocity  = position.velocity
+
+
+class HMMRouteMatcher(object):
+    def __init__(self, route_index, dist_from_start,
+                 sigma_m = 10., beta_m = 20., backward_penalty_m = 50.,
+                 max_candidate_distance_m = 60., max_candidates = 8):
+        """
+        @brief: Online Viterbi decoder of a hidden Markov model,
+                whose hidden states are the route segments close to the fixes.
+
+        The emission probability of a fix is a Gaussian of its distance to the segment.
+        The transition probability decays exponentially with the difference
+        between the air line distance of consecutive fixes and their distance along the route
+        (Newson and Krumm, 2009). Moving backwards along the route costs backward_penalty_m extra.
+
+        Each fix is matched to the last state of the most likely state sequence,
+        so a single outlier fix does not pull the match to a parallel street.
+
+        @param route_index (helpers.route_index.RouteIndex)
+        @param dist_from_start (1d numpy array of float) road distance of each route point
+        @param sigma_m (float) standard deviation of the position fixes
+        @param beta_m (float) scale of the transition probability
+        @param backward_penalty_m (float)
+        @param max_candidate_distance_m (float) segments farther away from a fix are no candidates
+        @param max_candidates (int) only the closest segments are candidates
+        """
+        self.route_index              = route_index
+        self.dist_from_start          = np.asarray(dist_from_start, dtype=float)
+        self.sigma_m                  = sigma_m
+        self.beta_m                   = beta_m
+        self.backward_penalty_m       = backward_penalty_m
+        self.max_candidate_distance_m = max_candidate_distance_m
+        self.max_candidates           = max_candidates
+        self.reset()
+
+    def reset(self):
+        self.previous_offsets_m = np.zeros(0)  # route offsets of the previous candidates
+        self.previous_scores    = np.zeros(0)  # log probabilities of the previous candidates
+        self.previous_lat_deg   = 0.
+        self.previous_lon_deg   = 0.
+
+    def get_candidates(self, lat_deg, lon_deg):
+        """
+        @return segments (1d numpy array of int)
+        @return a_rel (1d numpy array of float) relative position of the closest point on each segment
+        @return distances_m (1d numpy array of float)
+        """
+        r = self.max_candidate_distance_m
+        segments = self.route_index.segments_near_point( lat_deg = lat_deg, lon_deg = lon_deg, radius_m = r )
+        if len(segments) == 0:
+            return segments, np.zeros(0), np.zeros(0)
+
+        a_rel, distances_m = self.route_index.relation_of_segments_to_point( segments = segments, lat_deg = lat_deg, lon_deg = lon_deg )
+        is_close = ( distances_m <= r )
+        segments, a_rel, distances_m = segments[is_close], a_rel[is_close], distances_m[is_close]
+
+        if len(segments) > self.max_candidates:
+            closest = np.argpartition( distances_m, self.max_candidates )[:self.max_candidates]
+            segments, a_rel, distances_m = segments[closest], a_rel[closest], distances_m[closest]
+        return segments, a_rel, distances_m
+
+    def update(self, lat_deg, lon_deg):
+        """
+        @param lat_deg (float) position fix
+        @param lon_deg (float)
+
+        @return match (dict or None) None if the fix is not close to the route, otherwise
+                "lat_deg", "lon_deg" (float) matched position on the route
+                "i_segment" (int) matched segment
+                "distance_along_route_m" (float) route offset of the matched position
+                "distance_to_route_m" (float) distance between fix and matched position
+        """
+        if self.route_index.no_segments == 0:
+            return None
+        segments, a_rel, distances_m = self.get_candidates( lat_deg = lat_deg, lon_deg = lon_deg )
+        if len(segments) == 0:
+            self.reset()
+            return None
+
+        segment_lengths = self.dist_from_start[segments+1] - self.dist_from_start[segments]
+        offsets_m = self.dist_from_start[segments] + a_rel * segment_lengths
+
+        scores = -0.5 * ( distances_m / self.sigma_m )**2
+        if len(self.previous_scores) != 0:
+            air_distance_m = helpers.angles.haversine_distance( self.previous_lat_deg, self.previous_lon_deg, lat_deg, lon_deg )
+            route_distances_m = offsets_m[np.newaxis,:] - self.previous_offsets_m[:,np.newaxis]
+            transition_cost = np.abs( route_distances_m - air_distance_m ) + self.backward_penalty_m * ( route_distances_m < 0 )
+            scores = scores + np.max( self.previous_scores[:,np.newaxis] - transition_cost / self.beta_m, axis = 0 )
+            scores = scores - np.max(scores) # keep the numbers small
+
+        self.previous_offsets_m = offsets_m
+        self.previous_scores    = scores
+        self.previous_lat_deg   = lat_deg
+        self.previous_lon_deg   = lon_deg
+
+        i_best = np.argmax(scores)
+        i_segment = segments[i_best]
+        matched_lat_deg, matched_lon_deg = self.route_index.point_on_segment( i_segment = i_segment, a_rel = a_rel[i_best] )
+
+        return {"lat_deg"                : matched_lat_deg,
+                "lon_deg"                : matched_lon_deg,
+                "i_segment"              : int(i_segment),
+                "distance_along_route_m" : offsets_m[i_best],
+                "distance_to_route_m"    : distances_m[i_best],
+               }
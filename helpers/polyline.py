@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file provides an encoder and decoder for encoded polylines,
+as used by Valhalla (precision 6) and OSRM (precision 5).
+https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+
+Whole strings are processed with numpy operations,
+not character by character.
+"""
+
+import numpy as np
+
+
+def decode(shape, precision = 6):
+    """
+    @brief: decode an encoded polyline.
+    
+    @param shape (str or bytes) encoded polyline
+    @param precision (int) number of decimal places, 5 or 6
+    
+    @return lat_deg (1d numpy array of float64)
+    @return lon_deg (1d numpy array of float64)
+    """
+    if isinstance(shape, str):
+        shape = shape.encode("ascii")
+    chunks = np.frombuffer(shape, dtype=np.uint8).astype(np.int64) - 63
+    if len(chunks) == 0:
+        return np.zeros(0), np.zeros(0)
+    
+    # Each value is a series of 5 bit chunks, least significant first.
+    # Bit 0x20 is set on all chunks of a value except the last one.
+    is_last = ( chunks & 0x20 ) == 0
+    if not is_last[-1]:
+        raise Exception("Encoded polyline is truncated.")
+    value_starts = np.hstack([ [0], np.nonzero(is_last)[0][:-1] + 1 ])
+    
+    pos_in_value = np.arange(len(chunks)) - np.repeat( value_starts, np.diff( np.hstack([value_starts, [len(chunks)]]) ) )
+    values = np.add.reduceat( (chunks & 0x1f) << (5 * pos_in_value), value_starts )
+    
+    # undo the zig-zag encoding of the sign
+    values = np.where( values & 1, ~(values >> 1), values >> 1 )
+    
+    if len(values) % 2 != 0:
+        raise Exception("Encoded polyline has an odd number of values.")
+    
+    # values are differences to the previous point
+    factor  = 10.0**precision
+    lat_deg = np.cumsum( values[0::2] ) / factor
+    lon_deg = np.cumsum( values[1::2] ) / factor
+    return lat_deg, lon_deg
+
+
+def encode(lat_deg, lon_deg, precision = 6):
+    """
+    @brief: encode a polyline.
+    
+    @param lat_deg (1d numpy array of float)
+    @param lon_deg (1d numpy array of float)
+    @param precision (int) number of decimal places, 5 or 6
+    
+    @return shape (str) encoded polyline
+    """
+    factor = 10.0**precision
+    points = np.empty( 2 * len(lat_deg), dtype=np.int64 )
+    points[0::2] = np.round( np.asarray(lat_deg, dtype=float) * factor )
+    points[1::2] = np.round( np.asarray(lon_deg, dtype=float) * factor )
+    if len(points) == 0:
+        return ""
+    
+    values = np.diff( np.hstack([ [0, 0], points ]).reshape(-1,2), axis=0 ).ravel()
+    values = np.where( values < 0, ~(values << 1), values << 1 )
+    
+    # split each value into 5 bit chunks, at least one chunk per value
+    max_no_chunks = 13 # sufficient for 64 bit
+    shifts = 5 * np.arange(max_no_chunks)
+    chunks = ( values[:,None] >> shifts[None,:] ) & 0x1f
+    no_chunks = np.maximum( 1, np.sum( (values[:,None] >> shifts[None,:]) > 0, axis=1 ) )
+    
+    is_used = np.arange(max_no_chunks)[None,:] < no_chunks[:,None]
+    has_more = np.arange(max_no_chunks)[None,:] < no_chunks[:,None] - 1
+    chars = ( chunks | (0x20 * has_more) ) + 63
+    shape = chars[is_used].astype(np.uint8).tobytes().decode("ascii")
+    return shape
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A compact road graph for offline routing.
+
+The graph is stored as a directory of numpy files in compressed sparse row (CSR) layout:
+the outgoing edges of node i are edge_starts[i] ... edge_starts[i+1]-1.
+The arrays are memory-mapped on loading, so only the parts of the graph
+that are visited by a query are read from disk.
+"""
+
+import os
+import json
+import heapq
+import xml.etree.ElementTree
+
+import numpy as np
+
+import helpers.angles
+
+
+# typical car speeds by OSM highway tag, roads with other tags are not routable
+CAR_SPEEDS_KM_PER_H = {
+    "motorway"       : 120,
+    "motorway_link"  : 60,
+    "trunk"          : 100,
+    "trunk_link"     : 50,
+    "primary"        : 80,
+    "primary_link"   : 40,
+    "secondary"      : 70,
+    "secondary_link" : 40,
+    "tertiary"       : 60,
+    "tertiary_link"  : 30,
+    "unclassified"   : 50,
+    "residential"    : 30,
+    "living_street"  : 10,
+    "service"        : 20,
+    "road"           : 30,
+    }
+
+ARRAY_NAMES = ["node_lat_deg", "node_lon_deg",
+               "edge_starts", "edge_sources", "edge_targets", "edge_lengths_m", "edge_durations_s", "edge_name_ids",
+               "reverse_edge_starts", "reverse_edges",
+               "node_cell_keys", "node_cell_starts", "node_cell_nodes"]
+
+# the node grid of nearest_node, cells of 0.01 deg are about 1 km high
+NODE_CELL_SIZE_DEG = 0.01
+NODE_GRID_NX = int( round( 360. / NODE_CELL_SIZE_DEG ) ) + 1
+
+
+def read_osm_xml(osm_filename):
+    """
+    @brief: Reads the car-routable roads of an OSM XML extract (*.osm).
+
+    The file is read twice, first the ways, then the coordinates of the nodes of the ways,
+    so that only the nodes of roads are held in memory.
+
+    @param osm_filename (str)
+
+    @return edges (dict of 1d numpy arrays)
+            "sources", "targets" (OSM node ids), "speeds_km_per_h", "name_ids"
+    @return node_coords (dict) OSM node id -> (lat_deg, lon_deg)
+    @return names (list of str) street names, indexed by name id
+    """
+    names   = [""]
+    name_to_id = {"": 0}
+    sources = []
+    targets = []
+    speeds  = []
+    name_ids = []
+
+    for event, elem in xml.etree.ElementTree.iterparse(osm_filename, events = ("end",)):
+        if elem.tag == "way":
+            tags = { tag.get("k"): tag.get("v") for tag in elem.iter("tag") }
+            highway = tags.get("highway", "")
+            if highway in CAR_SPEEDS_KM_PER_H and tags.get("access", "yes") not in ["no", "private"]:
+                refs = [ int(nd.get("ref")) for nd in elem.iter("nd") ]
+
+                name = tags.get("name", tags.get("ref", ""))
+                if name not in name_to_id:
+                    name_to_id[name] = len(names)
+                    names.append(name)
+
+                oneway = tags.get("oneway", "no")
+                is_forward  = ( oneway != "-1" )
+                is_backward = ( oneway in ["no", "false", "0"]
+                                and highway not in ["motorway", "motorway_link"]
+                                and tags.get("junction", "") not in ["roundabout", "circular"] )
+
+                pairs = []
+                if is_forward:
+                    pairs += list( zip(refs[:-1], refs[1:]) )
+                if is_backward or oneway == "-1":
+                    pairs += list( zip(refs[1:], refs[:-1]) )
+                for a, b in pairs:
+                    sources.append(a)
+                    targets.append(b)
+                speeds   += [ CAR_SPEEDS_KM_PER_H[highway] ] * len(pairs)
+                name_ids += [ name_to_id[name] ] * len(pairs)
+            elem.clear()
+        elif elem.tag == "node":
+            elem.clear()
+
+    used_nodes = set(sources) | set(targets)
+    node_coords = {}
+    for event, elem in xml.etree.ElementTree.iterparse(osm_filename, events = ("end",)):
+        if elem.tag == "node":
+            node_id = int(elem.get("id"))
+            if node_id in used_nodes:
+                node_coords[node_id] = ( float(elem.get("lat")), float(elem.get("lon")) )
+            elem.clear()
+        elif elem.tag == "way":
+            elem.clear()
+
+    edges = {"sources"         : np.array(sources, dtype=np.int64),
+             "targets"         : np.array(targets, dtype=np.int64),
+             "speeds_km_per_h" : np.array(speeds,  dtype=float),
+             "name_ids"        : np.array(name_ids, dtype=np.int32),
+             }
+    return edges, node_coords, names
+
+
+def get_node_cells(lat_deg, lon_deg):
+    """
+    @return cx, cy (int or numpy array of int) cell column and row of a position in the node grid
+    """
+    cx = np.floor( ( np.asarray(lon_deg) + 180. ) / NODE_CELL_SIZE_DEG ).astype(np.int64)
+    cy = np.floor( ( np.asarray(lat_deg) +  90. ) / NODE_CELL_SIZE_DEG ).astype(np.int64)
+    return cx, cy
+
+
+def make_node_grid_arrays(node_lat_deg, node_lon_deg):
+    """
+    @brief: Uniform grid over the nodes, for nearest_node.
+
+    The cells are stored sorted by cell number (compressed sparse rows),
+    so looking up a cell is a binary search, just like in helpers.route_index.RouteIndex.
+
+    @param node_lat_deg (1d numpy array of float)
+    @param node_lon_deg (1d numpy array of float)
+
+    @return arrays (dict of 1d numpy arrays)
+            "node_cell_keys" (sorted cell numbers of non-empty cells),
+            "node_cell_starts" (first entry of each cell in node_cell_nodes, plus the end),
+            "node_cell_nodes" (node indices sorted by cell number)
+    """
+    cx, cy = get_node_cells( lat_deg = node_lat_deg, lon_deg = node_lon_deg )
+    keys  = cy * NODE_GRID_NX + cx
+    order = np.argsort(keys, kind="stable")
+    cell_keys, cell_starts = np.unique(keys[order], return_index=True)
+    return {"node_cell_keys"   : cell_keys.astype(np.int64),
+            "node_cell_starts" : np.hstack([ cell_starts, [len(keys)] ]).astype(np.int64),
+            "node_cell_nodes"  : order.astype(np.int32),
+            }
+
+
+def make_road_graph_arrays(edges, node_coords):
+    """
+    @brief: Converts edges between OSM node ids to CSR arrays.
+
+    @param edges (dict of 1d numpy arrays) see read_osm_xml
+    @param node_coords (dict) see read_osm_xml
+
+    @return arrays (dict of 1d numpy arrays) with the keys in ARRAY_NAMES
+    """
+    # drop edges to nodes that are not part of the extract
+    is_complete = np.array([ (a in node_coords) and (b in node_coords) for a, b in zip(edges["sources"], edges["targets"]) ], dtype=bool).reshape(-1)
+
+    osm_ids = np.unique( np.hstack([ edges["sources"][is_complete], edges["targets"][is_complete] ]) )
+    coords  = np.array( [ node_coords[osm_id] for osm_id in osm_ids ], dtype=float ).reshape(-1,2)
+
+    sources = np.searchsorted( osm_ids, edges["sources"][is_complete] )
+    targets = np.searchsorted( osm_ids, edges["targets"][is_complete] )
+
+    # sort by source for the forward CSR layout
+    order = np.argsort(sources, kind="stable")
+    sources  = sources[order].astype(np.int32)
+    targets  = targets[order].astype(np.int32)
+    speeds   = edges["speeds_km_per_h"][is_complete][order]
+    name_ids = edges["name_ids"][is_complete][order]
+
+    lengths = helpers.angles.haversine_distance( lat1_deg = coords[sources,0], lon1_deg = coords[sources,1],
+                                                 lat2_deg = coords[targets,0], lon2_deg = coords[targets,1] )
+
+    no_nodes = len(osm_ids)
+    edge_starts = np.zeros(no_nodes + 1, dtype=np.int64)
+    edge_starts[1:] = np.cumsum( np.bincount(sources, minlength = no_nodes) )
+
+    # the reverse CSR layout refers to the forward edges, sorted by target
+    reverse_edges = np.argsort(targets, kind="stable").astype(np.int32)
+    reverse_edge_starts = np.zeros(no_nodes + 1, dtype=np.int64)
+    reverse_edge_starts[1:] = np.cumsum( np.bincount(targets, minlength = no_nodes) )
+
+    arrays = {"node_lat_deg"        : coords[:,0],
+              "node_lon_deg"        : coords[:,1],
+              "edge_starts"         : edge_starts,
+              "edge_sources"        : sources,
+              "edge_targets"        : targets,
+              "edge_lengths_m"      : lengths.astype(np.float32),
+              "edge_durations_s"    : ( lengths / (speeds / 3.6) ).astype(np.float32),
+              "edge_name_ids"       : name_ids,
+              "reverse_edge_starts" : reverse_edge_starts,
+              "reverse_edges"       : reverse_edges,
+              }
+    arrays.update( make_node_grid_arrays( node_lat_deg = arrays["node_lat_deg"], node_lon_deg = arrays["node_lon_deg"] ) )
+    return arrays
+
+
+def save_road_graph(directory, arrays, names):
+    """
+    @param directory (str) is created if it does not exist
+    @param arrays (dict of 1d numpy arrays) see make_road_graph_arrays
+    @param names (list of str) street names
+    """
+    os.makedirs(directory, exist_ok = True)
+    for array_name in ARRAY_NAMES:
+        np.save( os.path.join(directory, array_name + ".npy"), arrays[array_name] )
+
+    max_speed = 0.
+    if len(arrays["edge_durations_s"]) != 0:
+        max_speed = float( np.max( arrays["edge_lengths_m"] / np.maximum( arrays["edge_durations_s"], 1E-6 ) ) )
+    f = open( os.path.join(directory, "meta.json"), "w" )
+    json.dump( {"names": names, "max_speed_m_per_s": max_speed}, f )
+    f.close()
+
+
+class RoadGraph(object):
+    def __init__(self, directory):
+        """
+        @brief: A road graph, memory-mapped from the files of save_road_graph.
+
+        @param directory (str)
+        """
+        for array_name in ARRAY_NAMES:
+            filename = os.path.join(directory, array_name + ".npy")
+            if os.path.exists(filename) or not array_name.startswith("node_cell_"):
+                setattr( self, array_name, np.load( filename, mmap_mode = "r" ) )
+        if not hasattr(self, "node_cell_keys"):
+            # graphs saved before the node grid existed
+            for array_name, array in make_node_grid_arrays( node_lat_deg = self.node_lat_deg, node_lon_deg = self.node_lon_deg ).items():
+                setattr( self, array_name, array )
+
+        f = open( os.path.join(directory, "meta.json"), "r" )
+        meta = json.load(f)
+        f.close()
+        self.names = meta["names"]
+        self.max_speed_m_per_s = meta["max_speed_m_per_s"]
+        self.no_nodes = len(self.node_lat_deg)
+
+    def __nodes_in_cell_range__(self, cx_lo, cx_hi, cy_lo, cy_hi):
+        """
+        @param cx_lo, cx_hi, cy_lo, cy_hi (int) inclusive cell range of the node grid
+
+        @return nodes (1d numpy array of int)
+        """
+        cx_lo, cx_hi = max(cx_lo, 0), min(cx_hi, NODE_GRID_NX - 1)
+        rows = np.arange( max(cy_lo, 0), cy_hi + 1, dtype=np.int64 )
+        # for each cell row, the keys of the cell range are contiguous
+        u_lo = np.searchsorted( self.node_cell_keys, rows * NODE_GRID_NX + cx_lo, side="left" )
+        u_hi = np.searchsorted( self.node_cell_keys, rows * NODE_GRID_NX + cx_hi, side="right" )
+        parts = list( self.node_cell_nodes[ self.node_cell_starts[lo] : self.node_cell_starts[hi] ] for lo, hi in zip(u_lo, u_hi) if hi > lo )
+        if len(parts) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.hstack(parts)
+
+    def nearest_node(self, lat_deg, lon_deg):
+        """
+        @brief: The search starts in the grid cell of the position and
+                the search radius is doubled until a node is found
+                that is closer than the search radius.
+
+        @return i_node (int) the node that is closest to the given position
+        """
+        cx, cy = get_node_cells( lat_deg = lat_deg, lon_deg = lon_deg )
+        # distance in the east-north frame of the position to the border of the searched cells, per cell
+        cell_size_m = min( 1., np.cos( np.radians(lat_deg) ) ) * np.radians(NODE_CELL_SIZE_DEG) * 6365000
+
+        radius_cells = 1
+        while True:
+            covers_grid = ( radius_cells >= NODE_GRID_NX )
+            if covers_grid:
+                nodes = np.arange(self.no_nodes)
+            else:
+                nodes = self.__nodes_in_cell_range__( cx - radius_cells, cx + radius_cells, cy - radius_cells, cy + radius_cells )
+            if len(nodes) != 0:
+                east_m, north_m = helpers.angles.angles_to_local_east_north( lat_deg  = self.node_lat_deg[nodes],
+                                                                             lon_deg  = self.node_lon_deg[nodes],
+                                                                             lat0_deg = lat_deg,
+                                                                             lon0_deg = lon_deg )
+                squared_dist = east_m**2 + north_m**2
+                i = np.argmin(squared_dist)
+                # a closer node would be in the searched cells
+                if covers_grid or squared_dist[i] <= ( radius_cells * cell_size_m )**2:
+                    return int(nodes[i])
+            elif covers_grid:
+                raise Exception("The road graph does not have any nodes.")
+            radius_cells *= 2
+
+    def get_edge_weights(self, metric):
+        """
+        @param metric (str) "duration" or "distance"
+
+        @return weights (1d numpy array of float)
+        @return heuristic_scale (float)
+                air line distance times heuristic_scale is a lower bound of the weight
+        """
+        if metric == "duration":
+            return self.edge_durations_s, 1. / self.max_speed_m_per_s
+        elif metric == "distance":
+            return self.edge_lengths_m, 1.
+        raise Exception("Unknown metric: " + str(metric))
+
+    def shortest_path(self, i_source, i_target, metric = "duration"):
+        """
+        @brief: Bidirectional A* search.
+
+        Both searches use the average of the forward and backward air line potentials,
+        so the potentials are consistent on both sides and the search may stop
+        as soon as the sum of the smallest keys of both queues exceeds the best path found.
+
+        @param i_source (int) node index
+        @param i_target (int) node index
+        @param metric (str) "duration" or "distance"
+
+        @return edges (list of int) edge indices from source to target,
+                None if there is no path
+        """
+        if i_source == i_target:
+            return []
+        weights, heuristic_scale = self.get_edge_weights(metric)
+
+        lat_s, lon_s = float(self.node_lat_deg[i_source]), float(self.node_lon_deg[i_source])
+        lat_t, lon_t = float(self.node_lat_deg[i_target]), float(self.node_lon_deg[i_target])
+        potentials = {}
+        def potential(i_node):
+            # forward potential, the backward potential is its negative
+            if i_node not in potentials:
+                lat = float(self.node_lat_deg[i_node])
+                lon = float(self.node_lon_deg[i_node])
+                to_target   = helpers.angles.haversine_distance(lat, lon, lat_t, lon_t)
+                from_source = helpers.angles.haversine_distance(lat_s, lon_s, lat, lon)
+                potentials[i_node] = 0.5 * heuristic_scale * (to_target - from_source)
+            return potentials[i_node]
+
+        # per direction: distances, predecessor edges, priority queue, CSR arrays, edge end to follow
+        forward  = ( {i_source: 0.}, {i_source: -1}, [(potential(i_source), i_source)],
+                     self.edge_starts, None, self.edge_targets, 1. )
+        backward = ( {i_target: 0.}, {i_target: -1}, [(-potential(i_target), i_target)],
+                     self.reverse_edge_starts, self.reverse_edges, self.edge_sources, -1. )
+
+        best_weight = float("inf")
+        i_meeting   = None
+
+        while forward[2] and backward[2]:
+            if forward[2][0][0] + backward[2][0][0] >= best_weight:
+                break
+
+            # expand the direction with the smaller queue
+            this, other = forward, backward
+            if len(backward[2]) < len(forward[2]):
+                this, other = backward, forward
+            distances, predecessors, queue, starts, edge_ids, ends, sign = this
+
+            key, i_node = heapq.heappop(queue)
+            if key > distances[i_node] + sign * potential(i_node):
+                continue # outdated queue entry
+
+            if edge_ids is None:
+                edges = range( int(starts[i_node]), int(starts[i_node+1]) )
+            else:
+                edges = edge_ids[ int(starts[i_node]) : int(starts[i_node+1]) ].tolist()
+            for i_edge in edges:
+                i_next = int(ends[i_edge])
+                distance = distances[i_node] + float(weights[i_edge])
+                if distance < distances.get(i_next, float("inf")):
+                    distances[i_next]    = distance
+                    predecessors[i_next] = i_edge
+                    heapq.heappush( queue, (distance + sign * potential(i_next), i_next) )
+                    if i_next in other[0] and distance + other[0][i_next] < best_weight:
+                        best_weight = distance + other[0][i_next]
+                        i_meeting   = i_next
+
+        if i_meeting is None:
+            return None
+
+        path = []
+        i_node = i_meeting
+        while forward[1][i_node] != -1:
+            path.append( forward[1][i_node] )
+            i_node = int( self.edge_sources[ path[-1] ] )
+        path.reverse()
+        i_node = i_meeting
+        while backward[1][i_node] != -1:
+            path.append( backward[1][i_node] )
+            i_node = int( self.edge_targets[ path[-1] ] )
+        return path
+
+    def get_neighbor_bearings(self, i_node):
+        """
+        @return bearings_deg (1d numpy array of float)
+                bearings of all roads that meet at this node, pointing away from it
+        """
+        out_nodes = self.edge_targets[ self.edge_starts[i_node] : self.edge_starts[i_node+1] ]
+        in_edges  = self.reverse_edges[ self.reverse_edge_starts[i_node] : self.reverse_edge_starts[i_node+1] ]
+        neighbors = np.unique( np.hstack([ out_nodes, self.edge_sources[in_edges] ]) )
+        return get_bearings( lat1_deg = self.node_lat_deg[i_node], lon1_deg = self.node_lon_deg[i_node],
+                             lat2_deg = self.node_lat_deg[neighbors], lon2_deg = self.node_lon_deg[neighbors] )
+
+
+def get_bearings(lat1_deg, lon1_deg, lat2_deg, lon2_deg):
+    """
+    @brief: bearings of short lines, in a local flat approximation.
+
+    @return bearings_deg (numpy array of float) 0 is north, 90 is east
+    """
+    east_m, north_m = helpers.angles.angles_to_local_east_north( lat_deg = lat2_deg, lon_deg = lon2_deg, lat0_deg = lat1_deg, lon0_deg = lon1_deg )
+    return np.arctan2( east_m, north_m ) * 180 / np.pi % 360
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file contains a spatial index over the segments of a route.
+It answers "which segment is closest to this position ?" 
+and "which segments are in this box ?" 
+without looking at every segment of the route.
+"""
+
+import numpy as np
+
+import helpers.angles
+
+
+class RouteIndex(object):
+    def __init__(self, lat_deg, lon_deg, cell_size_m = 100., tile_size_deg = 0.1, r = 6365000):
+        """
+        @brief: Uniform grid over the segments of a polygon line.
+        
+        The polygon line is projected once to a local metric frame.
+        Each segment is registered in every grid cell its bounding box touches.
+        The cells are stored sorted by cell number (compressed sparse rows),
+        so looking up a cell is a binary search.
+        
+        For distances, a single frame would be distorted on long routes.
+        Therefore each segment is also projected to the frame of its tile,
+        a tile_size_deg x tile_size_deg square of latitude and longitude
+        with the reference point in its center.
+        Segment vectors, lengths and bearings in these frames are computed once,
+        so a query is a few multiply-adds per segment.
+        
+        @param lat_deg (1d numpy array of N float) polygon line of the route
+        @param lon_deg (1d numpy array of N float)
+        @param cell_size_m (float) edge length of a grid cell in m
+        @param tile_size_deg (float) edge length of the tiles of the distance frames
+        @param r (float) earth radius in m
+        """
+        self.lat_deg     = np.asarray(lat_deg, dtype=float)
+        self.lon_deg     = np.asarray(lon_deg, dtype=float)
+        self.cell_size_m = cell_size_m
+        self.no_segments = max( 0, len(self.lat_deg) - 1 )
+        
+        self.lat0_deg = 0.
+        self.lon0_deg = 0.
+        if len(self.lat_deg) != 0:
+            self.lat0_deg = .5 * ( np.min(self.lat_deg) + np.max(self.lat_deg) )
+            self.lon0_deg = .5 * ( np.min(self.lon_deg) + np.max(self.lon_deg) )
+        
+        # reference point of the tile of each segment (tile of the segment start)
+        self.tile_lat0_deg = ( np.floor( self.lat_deg[:-1] / tile_size_deg ) + .5 ) * tile_size_deg
+        self.tile_lon0_deg = ( np.floor( self.lon_deg[:-1] / tile_size_deg ) + .5 ) * tile_size_deg
+        self.north_m_per_deg = r * np.pi / 180.
+        self.east_m_per_deg  = self.north_m_per_deg * np.cos( self.tile_lat0_deg * np.pi / 180. )
+        
+        # segments in the frames of their tiles
+        self.x0 = self.east_m_per_deg  * ( self.lon_deg[:-1] - self.tile_lon0_deg )
+        self.y0 = self.north_m_per_deg * ( self.lat_deg[:-1] - self.tile_lat0_deg )
+        self.dx = self.east_m_per_deg  * ( self.lon_deg[1:] - self.lon_deg[:-1] )
+        self.dy = self.north_m_per_deg * ( self.lat_deg[1:] - self.lat_deg[:-1] )
+        self.length_sq   = self.dx**2 + self.dy**2
+        self.length_m    = np.sqrt(self.length_sq)
+        self.bearing_deg = np.arctan2( self.dx, self.dy ) * 180 / np.pi % 360
+        
+        # The grid frame stretches east distances by up to this factor in either direction,
+        # search radii in the grid are enlarged accordingly.
+        self.max_grid_distortion = 1.
+        if len(self.lat_deg) != 0:
+            cos_ratio = np.cos( self.lat0_deg * np.pi / 180. ) / np.cos( self.lat_deg * np.pi / 180. )
+            self.max_grid_distortion = max( np.max(cos_ratio), np.max(1. / cos_ratio) )
+        
+        east_m, north_m = self.project( lat_deg = self.lat_deg, lon_deg = self.lon_deg )
+        self.__build_grid__( east_m = east_m, north_m = north_m )
+        
+    def project(self, lat_deg, lon_deg):
+        """
+        @return east_m, north_m (float or numpy array) in the frame of the grid
+        """
+        return helpers.angles.angles_to_local_east_north( lat_deg = lat_deg, lon_deg = lon_deg, lat0_deg = self.lat0_deg, lon0_deg = self.lon0_deg )
+        
+    def __build_grid__(self, east_m, north_m):
+        if self.no_segments == 0:
+            self.cx_min = self.cy_min = 0
+            self.nx = self.ny = 0
+            self.cell_keys   = np.zeros(0, dtype=np.int64)
+            self.cell_starts = np.zeros(1, dtype=np.int64)
+            self.cell_segments = np.zeros(0, dtype=np.int64)
+            return
+        
+        cx = np.floor( east_m  / self.cell_size_m ).astype(np.int64)
+        cy = np.floor( north_m / self.cell_size_m ).astype(np.int64)
+        self.cx_min = np.min(cx)
+        self.cy_min = np.min(cy)
+        self.nx     = np.max(cx) - self.cx_min + 1
+        self.ny     = np.max(cy) - self.cy_min + 1
+        
+        # cell range of the bounding box of each segment
+        cx0 = np.minimum(cx[:-1], cx[1:]) - self.cx_min
+        cy0 = np.minimum(cy[:-1], cy[1:]) - self.cy_min
+        ncx = np.abs(cx[1:] - cx[:-1]) + 1
+        ncy = np.abs(cy[1:] - cy[:-1]) + 1
+        counts = ncx * ncy
+        
+        # one entry per (segment, cell) pair
+        segments = np.repeat( np.arange(self.no_segments), counts )
+        k        = np.arange( len(segments) ) - np.repeat( np.cumsum(counts) - counts, counts )
+        cell_x   = cx0[segments] + k %  ncx[segments]
+        cell_y   = cy0[segments] + k // ncx[segments]
+        keys     = cell_x * self.ny + cell_y
+        
+        order = np.argsort(keys, kind="stable")
+        keys  = keys[order]
+        self.cell_segments = segments[order]
+        self.cell_keys, self.cell_starts = np.unique(keys, return_index=True)
+        self.cell_starts = np.hstack([ self.cell_starts, [len(keys)] ])
+        
+    def __segments_in_cell_range__(self, cx_lo, cx_hi, cy_lo, cy_hi):
+        """
+        @param cx_lo, cx_hi, cy_lo, cy_hi (int) inclusive cell range, relative to the grid origin.
+        
+        @return segments (1d numpy array of int) may contain duplicates
+        """
+        cx_lo = max(cx_lo, 0)
+        cy_lo = max(cy_lo, 0)
+        cx_hi = min(cx_hi, self.nx - 1)
+        cy_hi = min(cy_hi, self.ny - 1)
+        if cx_lo > cx_hi or cy_lo > cy_hi:
+            return np.zeros(0, dtype=np.int64)
+        
+        # for each cell column, the keys of the cell range are contiguous
+        columns = np.arange(cx_lo, cx_hi+1)
+        u_lo = np.searchsorted( self.cell_keys, columns * self.ny + cy_lo, side="left" )
+        u_hi = np.searchsorted( self.cell_keys, columns * self.ny + cy_hi, side="right" )
+        parts = list( self.cell_segments[ self.cell_starts[lo] : self.cell_starts[hi] ] for lo, hi in zip(u_lo, u_hi) if hi > lo )
+        if len(parts) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(parts)
+    
+    def relation_of_segments_to_point(self, segments, lat_deg, lon_deg):
+        """
+        @param segments (1d numpy array of int) segment indices
+        @param lat_deg (float) point
+        @param lon_deg (float)
+        
+        @return a_rel   (1d numpy array of float) 
+                 relative position of the closest point on each segment
+        @return mindist (1d numpy array of float) distance of the closest point in m
+        """
+        dx = self.dx[segments]
+        dy = self.dy[segments]
+        length_sq = self.length_sq[segments]
+        px = self.east_m_per_deg[segments] * ( lon_deg - self.tile_lon0_deg[segments] ) - self.x0[segments]
+        py = self.north_m_per_deg          * ( lat_deg - self.tile_lat0_deg[segments] ) - self.y0[segments]
+        
+        a_rel = np.zeros(len(segments))
+        ind = ( length_sq != 0 )
+        a_rel[ind] = ( px[ind] * dx[ind] + py[ind] * dy[ind] ) / length_sq[ind]
+        a_rel = np.clip(a_rel, 0, 1)
+        
+        mindist = np.sqrt( (a_rel * dx - px)**2 + (a_rel * dy - py)**2 )
+        return a_rel, mindist
+    
+    def point_on_segment(self, i_segment, a_rel):
+        """
+        @param i_segment (int or numpy array of int)
+        @param a_rel (float or numpy array of float) relative position on the segment, from 0 to 1
+        
+        @return lat_deg, lon_deg (float or numpy array)
+        """
+        lat_deg = self.lat_deg[i_segment] + a_rel * ( self.lat_deg[i_segment+1] - self.lat_deg[i_segment] )
+        lon_deg = self.lon_deg[i_segment] + a_rel * ( self.lon_deg[i_segment+1] - self.lon_deg[i_segment] )
+        return lat_deg, lon_deg
+    
+    def closest_segment(self, lat_deg, lon_deg, i_min = 0, i_max = None):
+        """
+        @brief: find the segment closest to a position.
+        
+        The search starts in the cell of the position and 
+        the search radius is doubled until a segment is found 
+        that is closer than the search radius.
+        
+        @param lat_deg (float)
+        @param lon_deg (float)
+        @param i_min (int) only consider segments i_min <= i < i_max
+        @param i_max (int or None) None means up to the end of the route
+        
+        @return i_segment (int or None)
+                Segment i connects point i and i+1. None if no segment is in range.
+        @return a_rel (float)
+                Relative position of the closest point on the segment, from 0 to 1.
+        @return mindist (float)
+                Distance to the closest point in m.
+        """
+        if i_max is None or i_max > self.no_segments:
+            i_max = self.no_segments
+        i_min = max(0, i_min)
+        if i_max <= i_min:
+            return None, float("nan"), float("inf")
+        
+        east_m, north_m = self.project( lat_deg = lat_deg, lon_deg = lon_deg )
+        cx = int( np.floor( east_m  / self.cell_size_m ) ) - self.cx_min
+        cy = int( np.floor( north_m / self.cell_size_m ) ) - self.cy_min
+        
+        radius_cells = 1
+        while True:
+            covers_grid = ( cx - radius_cells <= 0 and cy - radius_cells <= 0 and cx + radius_cells >= self.nx - 1 and cy + radius_cells >= self.ny - 1 )
+            if covers_grid:
+                segments = np.arange(i_min, i_max)
+            else:
+                segments = self.__segments_in_cell_range__( cx - radius_cells, cx + radius_cells, cy - radius_cells, cy + radius_cells )
+                segments = segments[ (segments >= i_min) & (segments < i_max) ]
+            
+            if len(segments) != 0:
+                a_rel, mindist = self.relation_of_segments_to_point( segments = segments, lat_deg = lat_deg, lon_deg = lon_deg )
+                i = np.argmin(mindist)
+                # a closer segment would have been registered in the searched cells
+                if covers_grid or mindist[i] * self.max_grid_distortion <= radius_cells * self.cell_size_m:
+                    return int(segments[i]), a_rel[i], mindist[i]
+            elif covers_grid:
+                return None, float("nan"), float("inf")
+            radius_cells *= 2
+    
+    def segments_in_box(self, south_lat, west_lon, north_lat, east_lon):
+        """
+        @brief: find all segments that may touch a box.
+        
+        @return segments (1d numpy array of int) sorted, without duplicates
+        """
+        if self.no_segments == 0:
+            return np.zeros(0, dtype=np.int64)
+        west_m, south_m = self.project( lat_deg = south_lat, lon_deg = west_lon )
+        east_m, north_m = self.project( lat_deg = north_lat, lon_deg = east_lon )
+        segments = self.__segments_in_cell_range__( 
+                        int( np.floor( min(west_m, east_m)   / self.cell_size_m ) ) - self.cx_min,
+                        int( np.floor( max(west_m, east_m)   / self.cell_size_m ) ) - self.cx_min,
+                        int( np.floor( min(south_m, north_m) / self.cell_size_m ) ) - self.cy_min,
+                        int( np.floor( max(south_m, north_m) / self.cell_size_m ) ) - self.cy_min )
+        return np.unique(segments)
+    
+    def segments_near_point(self, lat_deg, lon_deg, radius_m):
+        """
+        @brief: find all segments that may be closer than radius_m to a point.
+        
+        @param lat_deg (float)
+        @param lon_deg (float)
+        @param radius_m (float)
+        
+        @return segments (1d numpy array of int) sorted, without duplicates
+        """
+        if self.no_segments == 0:
+            return np.zeros(0, dtype=np.int64)
+        east_m, north_m = self.project( lat_deg = lat_deg, lon_deg = lon_deg )
+        radius_m = radius_m * self.max_grid_distortion
+        segments = self.__segments_in_cell_range__( 
+                        int( np.floor( (east_m  - radius_m) / self.cell_size_m ) ) - self.cx_min,
+                        int( np.floor( (east_m  + radius_m) / self.cell_size_m ) ) - self.cx_min,
+                        int( np.floor( (north_m - radius_m) / self.cell_size_m ) ) - self.cy_min,
+                        int( np.floor( (north_m + radius_m) / self.cell_size_m ) ) - self.cy_min )
+        return np.unique(segments)
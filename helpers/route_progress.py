@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Progress of the ego vehicle along a route.
+"""
+
+import time
+
+import numpy as np
+
+
+class RouteProgress(object):
+    def __init__(self, dist_from_start, route_index, maneuver_inds_on_route, maneuver_durations_s,
+                 window_segments = 16, max_snap_distance_m = 50, passed_tolerance_m = 20):
+        """
+        @brief: Tracks the position along a route with a cursor that only moves forward.
+
+        Each fix is searched in a few segments ahead of the cursor.
+        Only if the fix is not close to these segments, the whole rest of the route is searched.
+        All figures are then available in constant time.
+
+        @param dist_from_start (1d numpy array of float) road distance of each route point
+        @param route_index (helpers.route_index.RouteIndex) of the route points
+        @param maneuver_inds_on_route (1d numpy array of int) route point of each maneuver
+        @param maneuver_durations_s (1d numpy array of float)
+               travel time from each maneuver to the next one, NaN if unknown
+        @param window_segments (int) number of segments searched ahead of the cursor
+        @param max_snap_distance_m (float)
+               a fix farther away from the window is searched on the whole rest of the route
+        @param passed_tolerance_m (float)
+               a maneuver stays the next maneuver until it is passed by this distance
+        """
+        self.dist_from_start     = np.asarray(dist_from_start, dtype=float)
+        self.route_index         = route_index
+        self.window_segments     = window_segments
+        self.max_snap_distance_m = max_snap_distance_m
+        self.passed_tolerance_m  = passed_tolerance_m
+
+        self.maneuver_dist_from_start = self.dist_from_start[ np.asarray(maneuver_inds_on_route, dtype=np.int64) ]
+        durations_s = np.asarray(maneuver_durations_s, dtype=float)
+        # remaining_durations_s[i] is the travel time from maneuver i to the destination
+        self.remaining_durations_s = np.hstack([ np.cumsum( durations_s[::-1] )[::-1], [0] ])
+
+        self.total_distance_m = 0.
+        if len(self.dist_from_start) != 0:
+            self.total_distance_m = self.dist_from_start[-1]
+        self.reset()
+
+    def reset(self):
+        self.i_segment                    = 0
+        self.distance_along_route_m       = 0.
+        self.distance_to_route_m          = np.nan
+        self.i_next_maneuver              = 0
+        self.velocity                     = 0.
+
+    def update(self, lat_deg, lon_deg, velocity = 0.):
+        """
+        @param lat_deg (float) ego position
+        @param lon_deg (float)
+        @param velocity (float) in m/s
+
+        @return is_on_route (bool) False if the fix is not close to the rest of the route
+        """
+        self.velocity = velocity
+        no_segments = self.route_index.no_segments
+        if no_segments == 0:
+            return False
+
+        segments = np.arange( self.i_segment, min( no_segments, self.i_segment + self.window_segments ) )
+        a_rel, distances = self.route_index.relation_of_segments_to_point( segments = segments, lat_deg = lat_deg, lon_deg = lon_deg )
+        i_best = np.argmin(distances)
+        i_segment, a_rel, distance = segments[i_best], a_rel[i_best], distances[i_best]
+
+        if distance > self.max_snap_distance_m:
+            # lost in the local window, e.g. after a gap in the fixes
+            i_far, a_far, distance_far = self.route_index.closest_segment( lat_deg = lat_deg, lon_deg = lon_deg, i_min = self.i_segment )
+            if i_far is not None and distance_far < distance:
+                i_segment, a_rel, distance = i_far, a_far, distance_far
+            if distance > self.max_snap_distance_m:
+                self.distance_to_route_m = distance
+                return False
+
+        segment_length = self.dist_from_start[i_segment+1] - self.dist_from_start[i_segment]
+        self.__advance_to__( i_segment = i_segment, 
+                             distance_along_route_m = self.dist_from_start[i_segment] + a_rel * segment_length, 
+                             distance_to_route_m = distance )
+        return True
+
+    def update_from_match(self, match, velocity = 0.):
+        """
+        @brief: like update, but with a position that is already matched to the route,
+                see helpers.map_matching.HMMRouteMatcher.update
+        
+        @param match (dict)
+        @param velocity (float) in m/s
+        """
+        self.velocity = velocity
+        if match["i_segment"] >= self.i_segment:
+            self.__advance_to__( i_segment = match["i_segment"], 
+                                 distance_along_route_m = match["distance_along_route_m"], 
+                                 distance_to_route_m = match["distance_to_route_m"] )
+
+    def __advance_to__(self, i_segment, distance_along_route_m, distance_to_route_m):
+        self.i_segment = int(i_segment)
+        self.distance_to_route_m = distance_to_route_m
+        self.distance_along_route_m = distance_along_route_m
+
+        while ( self.i_next_maneuver < len(self.maneuver_dist_from_start) - 1
+                and self.distance_along_route_m - self.maneuver_dist_from_start[self.i_next_maneuver] > self.passed_tolerance_m ):
+            self.i_next_maneuver += 1
+
+    def get_position_on_route(self):
+        """
+        @return lat_deg (float) position of the cursor on the route
+        @return lon_deg (float)
+        """
+        i = self.i_segment
+        segment_length = self.dist_from_start[i+1] - self.dist_from_start[i]
+        a_rel = 0.
+        if segment_length > 0:
+            a_rel = ( self.distance_along_route_m - self.dist_from_start[i] ) / segment_length
+        return self.route_index.point_on_segment( i_segment = i, a_rel = min( 1., max( 0., a_rel ) ) )
+
+    @property
+    def distance_to_next_maneuver_m(self):
+        if len(self.maneuver_dist_from_start) == 0:
+            return np.nan
+        return max( 0., self.maneuver_dist_from_start[self.i_next_maneuver] - self.distance_along_route_m )
+
+    @property
+    def remaining_distance_m(self):
+        return max( 0., self.total_distance_m - self.distance_along_route_m )
+
+    @property
+    def remaining_duration_s(self):
+        """
+        @brief: The time to the next maneuver is taken from the current velocity, if driving,
+                or from the share of the step duration otherwise.
+                The time from the next maneuver on comes from the step durations.
+        """
+        i_next = self.i_next_maneuver
+        if len(self.maneuver_dist_from_start) == 0:
+            return np.nan
+        step_length, step_duration = 0., 0.
+        if i_next > 0:
+            step_length   = self.maneuver_dist_from_start[i_next] - self.maneuver_dist_from_start[i_next-1]
+            step_duration = self.remaining_durations_s[i_next-1] - self.remaining_durations_s[i_next]
+        if self.velocity > 1.:
+            to_next_s = self.distance_to_next_maneuver_m / self.velocity
+        elif step_length > 0:
+            to_next_s = step_duration * self.distance_to_next_maneuver_m / step_length
+        else:
+            to_next_s = 0.
+        return to_next_s + self.remaining_durations_s[i_next]
+
+    def get_eta(self, now = None):
+        """
+        @param now (float or None) unix time, None means now
+        @return eta (float) estimated unix time of arrival, NaN if unknown
+        """
+        if now is None:
+            now = time.time()
+        return now + self.remaining_duration_s
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file provides polygon line simplification,
+used to draw long routes with fewer points at low zoom levels.
+"""
+
+import numpy as np
+
+
+def douglas_peucker_significance(x, y, min_tolerance = 0):
+    """
+    @brief: Douglas-Peucker simplification for all tolerances at once.
+    
+    The Douglas-Peucker algorithm keeps a point if its distance to the 
+    line between the already kept points is larger than the tolerance.
+    Instead of running it once per tolerance, this function records 
+    for each point the largest tolerance at which it is kept.
+    The simplified line for tolerance t consists of all points with 
+    significance > t. Lines for larger tolerances are subsets of lines 
+    for smaller tolerances.
+    
+    @param x (1d numpy array of N float) metric coordinates
+    @param y (1d numpy array of N float)
+    @param min_tolerance (float)
+           Spans are not subdivided further if all points are closer than this.
+           Saves time if very small tolerances are not needed.
+    
+    @return significance (1d numpy array of N float)
+           inf for the first and last point, 0 for points that are never kept.
+    """
+    n = len(x)
+    significance = np.zeros(n)
+    if n == 0:
+        return significance
+    significance[0]  = np.inf
+    significance[-1] = np.inf
+    
+    # All spans of one recursion depth are split at once.
+    starts  = np.array([0])
+    ends    = np.array([n-1])
+    parents = np.array([np.inf]) # significance of the split that created the span
+    while True:
+        has_inner_points = ( ends - starts >= 2 )
+        starts  = starts[has_inner_points]
+        ends    = ends[has_inner_points]
+        parents = parents[has_inner_points]
+        if len(starts) == 0:
+            break
+        
+        # all inner points of all spans in one array
+        counts  = ends - starts - 1
+        offsets = np.cumsum(counts) - counts
+        span    = np.repeat( np.arange(len(starts)), counts )
+        points  = starts[span] + 1 + np.arange(np.sum(counts)) - offsets[span]
+        
+        # distance of the inner points to the line from span start to span end
+        dx = ( x[ends] - x[starts] )[span]
+        dy = ( y[ends] - y[starts] )[span]
+        px = x[points] - x[starts][span]
+        py = y[points] - y[starts][span]
+        length = np.sqrt(dx**2 + dy**2)
+        dist = np.sqrt(px**2 + py**2)
+        ind = ( length != 0 )
+        dist[ind] = np.abs(px[ind] * dy[ind] - py[ind] * dx[ind]) / length[ind]
+        
+        # the farthest point of each span
+        max_dist = np.maximum.reduceat( dist, offsets )
+        is_max   = ( dist == max_dist[span] )
+        first    = np.unique( span[is_max], return_index = True )[1]
+        i_split  = points[is_max][first]
+        
+        is_split = ( max_dist > min_tolerance )
+        i_split  = i_split[is_split]
+        # a point cannot be kept at a tolerance at which its parent is dropped
+        sig      = np.minimum( max_dist, parents )[is_split]
+        significance[i_split] = sig
+        
+        starts, ends = np.hstack([starts[is_split], i_split]), np.hstack([i_split, ends[is_split]])
+        parents = np.hstack([sig, sig])
+    
+    return significance
+
+
+def slippy_map_meters_per_pixel(zoom, lat_deg, tile_size_px = 256):
+    """
+    @brief: map scale of slippy map tiles (Web Mercator).
+    
+    @param zoom (int or numpy array of int)
+    @param lat_deg (float)
+    
+    @return m_per_px (float or numpy array)
+    """
+    equator_length_m = 40075016.686
+    return equator_length_m * np.cos( lat_deg * np.pi / 180 ) / ( tile_size_px * 2.0**zoom )
@@ -7,6 +7,8 @@ A tile is a small section of a map.
 import numpy as np
 from PIL import Image
 
+import helpers.angles
+
 class RasterTile(object):
     def __init__(self, 
                  zoom,
@@ -26,11 +28,10 @@ class RasterTile(object):
                             north, south, east and west 
                             latitude and longitude in deg.
                             
-        Approximation for the scale: 1 degree latitude is 111 km.
-        (Actually, the earth is elliptical, and an
+        The scale is the length of the meridian arc of the tile on the WGS84 ellipsoid.
+        (A fixed 111 km per degree latitude would be off by up to 0.5%, because an
         equatorial degree latitude corresponds to 110574 m, whereas a
-        polar degree latitude corresponds to 111694 m,
-        so this result is off by up to 0.5%)
+        polar degree latitude corresponds to 111694 m.)
         
         In the Mercator projection, the longitudinal magnification
         varies greatly with latitude, so a scale may be inappropriate
@@ -46,7 +47,9 @@ class RasterTile(object):
         self.ysize_px      = shap[0]
         self.xsize_px      = shap[1]
         
-        total_ns_extent_in_m   = 111000 * (self.north_lat - self.south_lat)
+        total_ns_extent_in_m   = helpers.angles.geodesic_distance( lat1_deg = self.north_lat, lon1_deg = self.west_lon, 
+                                                                   lat2_deg = self.south_lat, lon2_deg = self.west_lon, 
+                                                                   tier = "ellipsoidal" )
         self.scale_in_m_per_px = total_ns_extent_in_m / self.ysize_px
         
         
@@ -89,6 +92,12 @@ class RasterTile(object):
         lon_deg = self.west_lon  + ix / self.xsize_px * (self.east_lon  - self.west_lon )
         return lat_deg, lon_deg
 
+    def get_bounding_box(self):
+        """
+        @return south_lat, west_lon, north_lat, east_lon (float) in deg
+        """
+        return self.south_lat, self.west_lon, self.north_lat, self.east_lon
+
     def get_cropping_indices(self, center_lat_deg, center_lon_deg, cropped_xsize_px, cropped_ysize_px):
         """
         @brief: get pixel coordinates to cut a tile.
@@ -264,6 +273,16 @@ class RotatedRasterTile(object):
         eb = np.array([self.angular_extent["bottom_left_lon"] - self.angular_extent["top_left_lon"], self.angular_extent["bottom_left_lat"] - self.angular_extent["top_left_lat"]])
         self.inve = np.linalg.inv(np.transpose([ea,eb]))
 
+    def get_bounding_box(self):
+        """
+        @return south_lat, west_lon, north_lat, east_lon (float) in deg
+                of a straight box that encloses the rotated tile
+        """
+        e = self.angular_extent
+        lats = [e["top_left_lat"], e["bottom_left_lat"], e["top_right_lat"], e["bottom_left_lat"] + e["top_right_lat"] - e["top_left_lat"]]
+        lons = [e["top_left_lon"], e["bottom_left_lon"], e["top_right_lon"], e["bottom_left_lon"] + e["top_right_lon"] - e["top_left_lon"]]
+        return min(lats), min(lons), max(lats), max(lons)
+
     def angles_to_pxpos(self, lat_deg, lon_deg):
 
         c = np.array([lon_deg - self.angular_extent["top_right_lon"], lat_deg - self.angular_extent["top_right_lat"]])
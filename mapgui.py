@@ -7,6 +7,7 @@ from gi.repository import Gtk, Gdk, GLib
 
 import os
 import json
+import time
 import numpy as np
 
 import providers.maps
@@ -14,6 +15,7 @@ import providers.positions
 import providers.search
 import providers.route
 import providers.directions
+import providers.voice
 
 import widgets.marker_layer
 import widgets.map_layer
@@ -23,6 +25,7 @@ import widgets.maneuver_bar
 
 import helpers.angles
 import helpers.round
+import helpers.map_matching
 
 class MapWindow(Gtk.Window):
     def __init__(self, 
@@ -40,12 +43,20 @@ class MapWindow(Gtk.Window):
         self.settings_filename     = settings_filename
         if os.path.isfile(settings_filename):
             self.settings              = self.json2dict(settings_filename)
-            self.settings_have_changed = False
+            self.settings_have_changed = self.add_missing_settings(settings=self.settings, profiles=self.profiles)
         else:
             self.settings = self.get_new_settings_dict(profiles=self.profiles)
             self.settings_have_changed = True
         
         self.auto_rotate = False
+        self.__previous_view = None
+        self.providers_version = 0 # incremented whenever a provider is replaced
+        self.__matched_fix  = (None, None) # map matcher and fix time of the last match
+        self.__match        = None
+        self.destination = None
+        self.off_route_detector = providers.route.OffRouteDetector()
+        self.rerouter           = providers.route.BackgroundRerouter()
+        self.async_search       = providers.search.AsyncSearch( call_in_main_loop = GLib.idle_add, call_later = GLib.timeout_add )
 
         # providers for map, position, search, and routing
         self.providers = {}
@@ -71,6 +82,7 @@ class MapWindow(Gtk.Window):
         self.entry = Gtk.Entry()
         #self.entry.set_text("Hello World")
         self.entry.connect("activate", self.on_search_activated)
+        self.entry_changed_handler_id = self.entry.connect("changed", self.on_search_entry_changed)
         
         # Create the top search bar
         size = Gtk.icon_size_from_name("Button")
@@ -100,6 +112,10 @@ class MapWindow(Gtk.Window):
         self.canvas.add_overlay( self.interactive_layer )
         self.make_nav_buttons( layer = self.interactive_layer )
 
+        # Create the remaining distance and arrival time line
+        self.progress_label = Gtk.Label("")
+        self.widgets.pack_start(child = self.progress_label, expand=False, fill=False, padding=0)
+
         # Create the bottom maneuver bar.
         self.maneuver_bar = widgets.maneuver_bar.ManeuverBar( in_bearing_is_down = self.auto_rotate )
         self.widgets.pack_start(child = self.maneuver_bar, expand=True, fill=True, padding=0)
@@ -115,10 +131,23 @@ class MapWindow(Gtk.Window):
     
     def get_new_settings_dict(self, profiles):
         settings = {}
-        for provider_type in profiles:
-            s = list( profiles[provider_type].keys() )
-            settings[provider_type] = s[0]
+        self.add_missing_settings(settings=settings, profiles=profiles)
         return settings
+    
+    def add_missing_settings(self, settings, profiles):
+        """
+        @brief: choose the first profile for each provider type that is not in the settings,
+                e.g. for provider types that are newer than the settings file.
+        
+        @return settings_have_changed (bool)
+        """
+        settings_have_changed = False
+        for provider_type in profiles:
+            if provider_type not in settings:
+                s = list( profiles[provider_type].keys() )
+                settings[provider_type] = s[0]
+                settings_have_changed = True
+        return settings_have_changed
             
 
     def collect_available_provider_classes(self):
@@ -126,7 +155,8 @@ class MapWindow(Gtk.Window):
               "position": providers.positions.get_mapping_of_names_to_classes(),
               "search":   providers.search.get_mapping_of_names_to_classes(), 
               "router":   providers.route.get_mapping_of_names_to_classes(),
-              "directions": providers.directions.get_mapping_of_names_to_classes()
+              "directions": providers.directions.get_mapping_of_names_to_classes(),
+              "voice":    providers.voice.get_mapping_of_names_to_classes()
             }
         return p
 
@@ -177,18 +207,21 @@ class MapWindow(Gtk.Window):
         return provider
 
     def enrich_results_with_data_rel_to_ego_pos(self,list_of_result_dicts):
-        for res in list_of_result_dicts:
-            airline = helpers.angles.calc_properties_of_airline(
-                         lat1_deg = self.providers["position"].latitude,
-                         lon1_deg = self.providers["position"].longitude,
-                         lat2_deg = float(res["lat"]),
-                         lon2_deg = float(res["lon"])
-                         )
-            blocks = helpers.round.distance_to_rounded_textblocks(airline["distance_m"])
+        # one vectorized call for all results
+        airline = helpers.angles.calc_properties_of_airline(
+                     lat1_deg = self.providers["position"].latitude,
+                     lon1_deg = self.providers["position"].longitude,
+                     lat2_deg = np.array( [ float(res["lat"]) for res in list_of_result_dicts ] ),
+                     lon2_deg = np.array( [ float(res["lon"]) for res in list_of_result_dicts ] ),
+                     )
+        nesw = helpers.angles.azimuth_to_nesw_string(azim_deg = airline["azimuth_from_point_1_towards_2_deg"])
+        
+        for i_res, res in enumerate(list_of_result_dicts):
+            blocks = helpers.round.distance_to_rounded_textblocks(airline["distance_m"][i_res])
             res["rounded_distance_str"] = blocks["distance"] + " " + blocks["distance_unit_abbrev"]
                         
-            res["azimuth_deg"] = airline["azimuth_from_point_1_towards_2_deg"]
-            res["nesw"]        = helpers.angles.azimuth_to_nesw_string(azim_deg = airline["azimuth_from_point_1_towards_2_deg"])
+            res["azimuth_deg"] = airline["azimuth_from_point_1_towards_2_deg"][i_res]
+            res["nesw"]        = str(nesw[i_res])
 
         return list_of_result_dicts
 
@@ -231,6 +264,14 @@ class MapWindow(Gtk.Window):
         layer.show_all()
 
 
+    def on_search_message_timed_out(self, search_generation):
+        # a newer search or a route has replaced the message in the meantime
+        if search_generation == self.async_search.generation:
+            self.make_nav_buttons(layer = self.interactive_layer )
+        
+        repeat = False
+        return repeat
+
     def from_no_result_to_nav_buttons(self, button):
         
         self.make_nav_buttons(layer = self.interactive_layer )
@@ -250,7 +291,7 @@ class MapWindow(Gtk.Window):
             layer.attach( child=button, left=0, top=0, width=1, height=1)
             
             # show "no result" only for a short time and auto-return to nav buttons
-            GLib.timeout_add( 3000, self.from_no_result_to_nav_buttons, None)
+            GLib.timeout_add( 3000, self.on_search_message_timed_out, self.async_search.generation)
 
         else:  
             # make a Button for each result
@@ -328,19 +369,80 @@ class MapWindow(Gtk.Window):
             if old_setting != new_setting:
                 self.make_message_button(layer = self.interactive_layer, label = "Waiting for initialisation of " + provider_type + " provider ...")
                 
+                if provider_type == "search":
+                    self.async_search.cancel()
+                if provider_type == "router":
+                    self.rerouter.cancel()
+                if provider_type == "voice":
+                    self.providers["voice"].cancel() # stops the synthesis of the replaced provider
+                
+                if provider_type == "directions" and self.is_language_change( provider_type, old_setting, new_setting ):
+                    # same director, only the text blocks of the current maneuvers are rendered again
+                    self.settings[provider_type] = new_setting
+                    self.providers["directions"].set_language( self.profiles[provider_type][new_setting]["parameters"]["language"] )
+                    self.settings_have_changed   = True
+                    if self.destination is not None:
+                        self.show_directions( keep_valid_widgets = False )
+                    continue
+                
                 self.settings[provider_type]  = new_setting
                 self.providers[provider_type] = self.make_provider_object( provider_type = provider_type, settings = self.settings, profiles = self.profiles, provider_dict = self.collect_available_provider_classes()[provider_type] )
+                self.providers_version       += 1
                 self.settings_have_changed    = True
+                
+                if provider_type in ["directions", "voice"] and self.destination is not None:
+                    # new text blocks and prompts for the current route, without routing again
+                    self.show_route( keep_valid_widgets = False )
 
         self.make_nav_buttons( layer = self.interactive_layer )
 
 
+    def is_language_change(self, provider_type, old_setting, new_setting):
+        """
+        @brief: checks whether two profiles differ in the language parameter only.
+        
+        @param provider_type (str)
+        @param old_setting (str) profile name
+        @param new_setting (str) profile name
+        
+        @return is_language_change (bool)
+        """
+        old_profile = self.profiles[provider_type].get(old_setting)
+        new_profile = self.profiles[provider_type].get(new_setting)
+        if old_profile is None or new_profile is None or old_profile["class_name"] != new_profile["class_name"]:
+            return False
+        old_parameters = dict( old_profile["parameters"] )
+        new_parameters = dict( new_profile["parameters"] )
+        if "language" not in old_parameters or "language" not in new_parameters:
+            return False
+        del old_parameters["language"], new_parameters["language"]
+        return old_parameters == new_parameters
+
+
     def on_search_activated(self, entry):
         
         self.make_message_button(layer = self.interactive_layer, label = "Waiting for search results ...")
         
-        # request results from the search provider
-        list_of_result_dicts = self.providers["search"].find( entry.get_text() )
+        # request results from the search provider, without blocking the GUI
+        self.async_search.search( provider = self.providers["search"], query = entry.get_text(), on_results = self.on_search_results )
+
+
+    def on_search_entry_changed(self, entry):
+        if not self.providers["search"].as_you_type:
+            return
+        query = entry.get_text()
+        if len(query.strip()) < 3:
+            self.async_search.cancel()
+            return
+        self.async_search.search_as_you_type( provider = self.providers["search"], query = query, on_results = self.on_search_results )
+
+
+    def on_search_results(self, query, list_of_result_dicts, error):
+        if error is not None:
+            self.make_message_button(layer = self.interactive_layer, label = "Search failed: " + str(error))
+            GLib.timeout_add( 3000, self.on_search_message_timed_out, self.async_search.generation)
+            return
+        
         list_of_result_dicts = self.enrich_results_with_data_rel_to_ego_pos(list_of_result_dicts)
         
         # make a Button for each result  
@@ -349,28 +451,91 @@ class MapWindow(Gtk.Window):
 
     def on_search_result_clicked(self, button):
         
+        self.async_search.cancel() # results of queries typed meanwhile would hide the route
+        self.rerouter.cancel() # a reroute to the previous destination must not replace the new route
         self.make_message_button(layer = self.interactive_layer, label = "Waiting for route calculation ...")
         self.providers["router"].set_route(waypoints = np.array([ [self.providers["position"].longitude, self.providers["position"].latitude],[float(button.result["lon"]), float(button.result["lat"])] ]))
+        self.destination = button.result
+        self.off_route_detector.reset()
 
         self.make_message_button(layer = self.interactive_layer, label = "Waiting for directions calculation ...")
-        self.providers["directions"].set_data(router_maneuvers = self.providers["router"].maneuvers )
-        
-        self.maneuver_bar.set_new_route(maneuvers_with_direction_data = self.providers["directions"].maneuvers, window_xsize_px = self.get_size()[0] )
+        self.show_route( keep_valid_widgets = False )
         
         self.hide_map_layer_for_some_time( duration_in_ms = 500 ) # hide the map so that the other widgets have enough space to rearrange
+
+        self.make_nav_buttons( layer = self.interactive_layer )        
+        
+        # showing the destination is no typed query
+        self.entry.handler_block(self.entry_changed_handler_id)
+        self.entry.set_text(button.result["display_name"])
+        self.entry.handler_unblock(self.entry_changed_handler_id)
+
+
+    def show_directions(self, keep_valid_widgets):
+        """
+        @brief: update voice prompts and maneuver bar from the maneuvers of the current direction provider.
+        
+        @param keep_valid_widgets (bool) reuse maneuver widgets that are still part of the route
+        """
+        self.providers["voice"].set_route(maneuvers = self.providers["directions"].maneuvers )
+        
+        self.maneuver_bar.set_new_route(maneuvers_with_direction_data = self.providers["directions"].maneuvers, 
+                                        window_xsize_px = self.get_size()[0], 
+                                        keep_valid_widgets = keep_valid_widgets )
+
+
+    def show_route(self, keep_valid_widgets):
+        """
+        @brief: update directions, maneuver bar, and route line from the current router.
+        
+        @param keep_valid_widgets (bool) reuse maneuver widgets that are still part of the route
+        """
+        self.providers["directions"].set_data(router_maneuvers = self.providers["router"].maneuvers )
+        self.show_directions( keep_valid_widgets = keep_valid_widgets )
         
         route_line_dicts = []
         whole_route_line = self.providers["router"].get_polyline_of_whole_route()
         if len(whole_route_line["lat_deg"]) != 0:
             route_line_dicts.append(whole_route_line)
         
-        self.marker_layer.make_marker_list( destination    = button.result, 
+        self.marker_layer.make_marker_list( destination    = self.destination, 
                                             map_copyright  = self.providers["map"].map_copyright,
                                             route_line_dicts = route_line_dicts,
                                           )
 
-        self.make_nav_buttons( layer = self.interactive_layer )        
-        self.entry.set_text(button.result["display_name"])
+
+    def check_for_reroute(self):
+        """
+        @brief: start a background reroute if the position left the route,
+                and swap in the new route when it is finished.
+                Must be called from the GUI thread.
+        """
+        router   = self.providers["router"]
+        position = self.providers["position"]
+        
+        new_router = self.rerouter.poll()
+        if new_router is not None and self.rerouter.source_router is router:
+            # single assignment, so every reader sees either the old or the new route
+            self.providers["router"] = new_router
+            self.providers_version  += 1
+            self.off_route_detector.reset()
+            self.show_route( keep_valid_widgets = True )
+            return
+        
+        if router.poll_better_route():
+            self.off_route_detector.reset()
+            self.show_route( keep_valid_widgets = True )
+            return
+        
+        if self.destination is None or len(router.lat_deg) < 2 or self.rerouter.is_busy:
+            return
+        if self.off_route_detector.update( lat_deg     = position.latitude, 
+                                           lon_deg     = position.longitude, 
+                                           heading_deg = position.heading, 
+                                           velocity    = position.velocity, 
+                                           route_index = router.route_index ):
+            waypoints = router.get_waypoints_ahead( lat_deg = position.latitude, lon_deg = position.longitude )
+            self.rerouter.start( router = router, waypoints = waypoints )
 
 
     def on_north_arrow_clicked(self, da, event):
@@ -383,7 +548,20 @@ class MapWindow(Gtk.Window):
         return repeat
           
     def on_timeout(self, data):
-        self.providers["position"].update_position()
+        position_has_changed = self.providers["position"].update_position()
+        self.check_for_reroute()
+        
+        # skip the redraw if neither the position nor the view has changed
+        view = ( self.get_size(), 
+                 self.providers["map"].current_zoom, 
+                 self.providers_version,
+                 self.marker_layer.version,
+                 self.auto_rotate, 
+                 self.map_layer.hide_map )
+        if not position_has_changed and view == self.__previous_view:
+            repeat = True
+            return repeat
+        self.__previous_view = view
         
         #TODO: the following map size allocation only works 
         #      if self.widgets is a vertical box (portrait mode)
@@ -396,22 +574,64 @@ class MapWindow(Gtk.Window):
         map_width  = window_size[0]
         map_height = window_size[1] - sum_of_all_widget_heights_except_map_canvas # TODO: hard coded size!!!
                 
-        angle_rad = self.providers["position"].heading * np.pi / 180. * self.auto_rotate
+        # snap the position to the route, if it is close to the route
+        position = self.providers["position"]
+        route_progress = self.providers["router"].route_progress
+        map_matcher = self.providers["router"].map_matcher
+        is_new_fix = ( self.__matched_fix[0] is not map_matcher or self.__matched_fix[1] != position.fix_time )
+        if is_new_fix:
+            # only measured fixes are observations of the map matcher, 
+            # neither redraws nor positions predicted between fixes
+            self.__matched_fix = (map_matcher, position.fix_time)
+            self.__match = map_matcher.update( lat_deg = position.latitude, lon_deg = position.longitude )
+            
+        if self.__match is None:
+            route_progress.update( lat_deg = position.latitude, lon_deg = position.longitude, velocity = position.velocity )
+            shown_position = position
+        else:
+            if is_new_fix:
+                route_progress.update_from_match( match = self.__match, velocity = position.velocity )
+            else:
+                # follow the predicted position on the branch of the last match, the cursor only moves forward
+                route_progress.update( lat_deg = position.latitude, lon_deg = position.longitude, velocity = position.velocity )
+            lat_deg, lon_deg = route_progress.get_position_on_route()
+            shown_position = helpers.map_matching.MatchedPosition( position = position, lat_deg = lat_deg, lon_deg = lon_deg )
+                
+        angle_rad = shown_position.heading * np.pi / 180. * self.auto_rotate
         cropped_tile = self.providers["map"].get_rotated_cropped_tile( 
                                     xsize_px = map_width, 
                                     ysize_px = map_height, 
-                                    center_lat_deg = self.providers["position"].latitude, 
-                                    center_lon_deg = self.providers["position"].longitude,
+                                    center_lat_deg = shown_position.latitude, 
+                                    center_lon_deg = shown_position.longitude,
                                     angle_rad = angle_rad
                                     )
         self.map_layer.update(cropped_tile)
-        self.marker_layer.update(cropped_tile = cropped_tile, position = self.providers["position"] )
+        self.marker_layer.update(cropped_tile = cropped_tile, position = shown_position )
         self.north_arrow.update(north_bearing_deg = angle_rad * -180/np.pi)
-        self.maneuver_bar.update( lat_deg = self.providers["position"].latitude, lon_deg = self.providers["position"].longitude, in_bearing_is_down = self.auto_rotate )
+        self.maneuver_bar.update( route_progress = route_progress, in_bearing_is_down = self.auto_rotate )
+        self.update_progress_label( route_progress = route_progress )
+        self.providers["voice"].update( route_progress = route_progress )
         
         repeat = True
         return repeat
     
+    def update_progress_label(self, route_progress):
+        """
+        @brief: show remaining distance, remaining time and arrival time.
+        
+        @param route_progress (helpers.route_progress.RouteProgress)
+        """
+        text = ""
+        if route_progress.total_distance_m > 0:
+            dist_blocks = helpers.round.distance_to_rounded_textblocks( route_progress.remaining_distance_m )
+            text = dist_blocks["distance"] + " " + dist_blocks["distance_unit_abbrev"]
+            remaining_s = route_progress.remaining_duration_s
+            if not np.isnan(remaining_s):
+                eta = time.strftime( "%H:%M", time.localtime( route_progress.get_eta() ) )
+                text += "  |  " + str( int( np.round( remaining_s / 60 ) ) ) + " min  |  " + eta
+        if text != self.progress_label.get_text():
+            self.progress_label.set_text(text)
+    
     def on_zoom_in_clicked(self, button, event):
         self.providers["map"].zoom_in()
 
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Converts an OSM XML extract to a road graph for the OfflineRouter.
+
+Usage:
+python3 osm_to_road_graph.py extract.osm road_graph
+"""
+
+import sys
+
+import helpers.road_graph
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    osm_filename, graph_directory = sys.argv[1], sys.argv[2]
+    
+    edges, node_coords, names = helpers.road_graph.read_osm_xml( osm_filename )
+    arrays = helpers.road_graph.make_road_graph_arrays( edges = edges, node_coords = node_coords )
+    helpers.road_graph.save_road_graph( directory = graph_directory, arrays = arrays, names = names )
+    
+    print( "nodes:", len(arrays["node_lat_deg"]), "edges:", len(arrays["edge_targets"]) )
@@ -5,6 +5,10 @@ This file defines direction providers.
 A direction provider converts a route to text, sign and speech data.
 """
 
+import os
+import re
+import json
+
 import helpers.angles
 
 def get_mapping_of_names_to_classes():
@@ -20,172 +24,192 @@ def get_mapping_of_names_to_classes():
     return d
 
 
-def english_dicts():
-    verbs = {
-       "arrive"     :"arrive",
-       "continue"   :"turn",
-       "straight"   :"continue",
-       "depart"     :"depart",
-       "end of road":"at the end of the road, turn",
-       "exit rotary":"take the",
-       "new name"   :"continue",
-       "turn"       :"turn",
-       "fork"       :"fork",
-       "merge"      :"merge",
-       "on ramp"    :"take the ramp to the",
-       "off ramp"   :"take the ramp on the",
-       "roundabout" :"enter the",
-       "rotary"     :"enter the",
-       "roundabout turn" : 	"at the roundabout, turn",
-       "exit roundabout":"take the",
-        }
-        
-    modifiers = {            
-       "arrive"     :"",
-       "continue"   :"{movement_modifier}",
-       "straight"   :"{movement_modifier}",
-       "depart"     :"{nesw_after}",
-       "end of road":"{movement_modifier}",
-       "exit rotary":"{exit_number} exit",
-       "new name"   :"{movement_modifier}",
-       "turn"       :"{movement_modifier}",
-       "fork"       :"{movement_modifier}",
-       "merge"      :"",
-       "on ramp"    :"{movement_modifier}",
-       "off ramp"   :"{movement_modifier} and exit",
-       "roundabout" :"roundabout",
-       "rotary"     :"rotary",
-       "roundabout turn" : 	"{movement_modifier}",
-       "exit roundabout":"{exit_number} exit",
-        }
+# one json file per language, e.g. languages/en.json
+LANGUAGE_DIRECTORY = os.path.join( os.path.dirname( os.path.abspath(__file__) ), "languages" )
+
+# language -> language dicts, each file is read once per process
+language_dicts_cache = {}
+
+
+def get_available_languages():
+    """
+    @return languages (list of str) e.g. ["de", "en"]
+    """
+    return sorted( [ name[:-len(".json")] for name in os.listdir(LANGUAGE_DIRECTORY) if name.endswith(".json") ] )
+
+
+def load_language_dicts(language):
+    """
+    @brief: Reads the language pack on first use. Later calls return the cached dicts.
     
-    modifiers2 = {
-        "uturn": "U-turn",
-        "sharp right"  : "sharp right",
-        "right"        : "right",
-        "slight right" : "slight right",
-        "straight"     : "straight",
-        "slight left"  : "slight left",
-        "left"         : "left",
-        "sharp left"   : "sharp left",    
-        }
+    A language pack contains the keys
+    "distance_preposition" (str)
+    "verbs", "modifiers", "to_prepositions", "street_name_after" (dicts) templates per maneuver type
+    "modifiers2" (dict) text of each movement modifier
+    "ordinals" (dict) text of each exit number
+    "compass" (dict) text of each name of helpers.angles.NESW_SECTOR_NAMES
     
-    to_prepositions = {
-       "arrive"          : "at",
-       "continue"        : "to",
-       "straight"        : "to",
-       "depart"          : "to",
-       "end of road"     : "to",
-       "new name"        : "to",
-       "turn"            : "to",
-       "fork"            : "to",
-       "merge"           : "on",
-       "on ramp"         : "onto",
-       "off ramp"        : "to",
-       "roundabout"      : "",
-       "exit roundabout" : "to",
-       "roundabout turn" : "to",
-       "rotary"          : "",
-       "exit rotary"     : "to",
-        }
+    @param language (str) name of a file in LANGUAGE_DIRECTORY without .json
     
-    street_name_after = {
-       "arrive"     :"{street_name_after}",
-       "continue"   :"{street_name_after}",
-       "straight"   :"{street_name_after}",
-       "depart"     :"{street_name_after}",
-       "end of road":"{street_name_after}",
-       "exit rotary":"{street_name_after}",
-       "new name"   :"{street_name_after}",
-       "turn"       :"{street_name_after}",
-       "fork"       :"{street_name_after}",
-       "merge"      :"{street_name_after}",
-       "on ramp"    :"{street_name_after}",
-       "off ramp"   :"{street_name_after}",
-       "roundabout" :"",
-       "rotary"     :"",
-       "roundabout turn" : 	"{street_name_after}",
-       "exit roundabout":"{street_name_after}",
-        }
+    @return language_dicts (dict of dicts) shared by all users, do not modify
+    """
+    if language not in language_dicts_cache:
+        filename = os.path.join( LANGUAGE_DIRECTORY, str(language) + ".json" )
+        if not os.path.isfile(filename):
+            raise Exception("Language \'" + str(language) + "\' not found. Choose one of " + str( get_available_languages() ) )
+        f = open(filename, "r", encoding="utf-8")
+        dicts = json.load(f)
+        f.close()
+        # json keys are strings
+        dicts["ordinals"] = { int(key): dicts["ordinals"][key] for key in dicts["ordinals"] }
+        language_dicts_cache[language] = dicts
+    return language_dicts_cache[language]
+
+
+# maneuver data that the templates of the language dicts can refer to as {key}
+TEMPLATE_FIELDS = ["street_name_after", "movement_modifier", "exit_number", "nesw_after"]
+
+# blocks of the text, and the language dict of the template of each block
+TEMPLATE_BLOCKS = {"verb"              : "verbs",
+                   "verb_modifier"     : "modifiers",
+                   "to_preposition"    : "to_prepositions",
+                   "street_name_after" : "street_name_after",
+                  }
+
+
+def compile_template(template, constants):
+    """
+    @brief: Converts a template of a language dict to a str.format string.
     
-    ordinals = {
-       0:  "None",
-       1:  "first",
-       2:  "second",
-       3:  "third",
-       4:  "4th",
-       5:  "5th",
-       6:  "6th",
-       7:  "7th",
-       8:  "8th",
-       9:  "9th",
-       10: "10th"
-       }
+    {key} with a key of TEMPLATE_FIELDS stays a field. 
+    {key} with a key of constants is replaced now.
+    All other braces are kept literally.
     
-    dicts = { "distance_preposition": "in",
-              "verbs"            : verbs, 
-              "modifiers"        : modifiers, 
-              "modifiers2"       : modifiers2,
-              "to_prepositions"  : to_prepositions, 
-              "street_name_after": street_name_after,
-              "ordinals"         : ordinals
-            }
+    @param template (str) e.g. "{movement_modifier} and exit"
+    @param constants (dict) e.g. the modifiers2 dict of the language
     
-    return dicts
+    @return format_string (str)
+    """
+    format_string = ""
+    for part in re.split( r"(\{[^{}]*\})", template ):
+        name = part[1:-1]
+        if part.startswith("{") and name in TEMPLATE_FIELDS:
+            format_string += part
+        elif part.startswith("{") and name in constants:
+            format_string += constants[name].replace("{", "{{").replace("}", "}}")
+        else:
+            format_string += part.replace("{", "{{").replace("}", "}}")
+    return format_string
 
 
 class Director(object):
-    def __init__(self, language_dicts = english_dicts() ):
+    def __init__(self, language = "en", language_dicts = None ):
         """
-        @param maneuvers (list of dicts)
-        @param language_dicts (dict of dicts)
-        
-        # TODO: param language as str. The dicts are created based on that str. The profile definitions can set the language str.
+        @param language (str) language pack, see get_available_languages
+        @param language_dicts (dict of dicts or None) 
+               custom language pack in the format of load_language_dicts,
+               None means the language pack of language.
         """
-        self.language_dicts = language_dicts
         self.maneuvers = []
         self.i_current_maneuver = 0
+        self.language = language
+        if language_dicts is None:
+            language_dicts = load_language_dicts(language)
+        self.language_dicts = language_dicts
+        self.compile_language_dicts()
+    
+    def set_language(self, language):
+        """
+        @brief: switches the language of the text blocks. The route remains untouched.
+        """
+        self.language = language
+        self.language_dicts = load_language_dicts(language)
+        self.compile_language_dicts()
+        self.update_text_blocks()
+    
+    def compile_language_dicts(self):
+        """
+        @brief: Compiles the templates of each maneuver type once,
+                so that rendering a maneuver is one str.format per block.
+        """
+        dicts = self.language_dicts
+        self.compiled_templates = {}
+        for typ in dicts["verbs"]:
+            self.compiled_templates[typ] = { block_name: compile_template( dicts[TEMPLATE_BLOCKS[block_name]][typ], constants = dicts["modifiers2"] )
+                                             for block_name in TEMPLATE_BLOCKS }
     
     def set_data(self, router_maneuvers):
         pass # base class does not do anything
+    
+    def update_text_blocks(self):
+        pass # base class does not do anything
+    
+    def render_text_blocks(self, typ, fields):
+        """
+        @param typ (str) maneuver type
+        @param fields (dict) a value for each key of TEMPLATE_FIELDS
         
-    def maneuver_to_text_blocks(self, maneuver):        
-
-        # get the first draft        
-        typ = maneuver["type"]
-        blocks = {"distance_preposition": self.language_dicts["distance_preposition"],
-                  "verb": self.language_dicts["verbs"][typ],
-                  "verb_modifier": self.language_dicts["modifiers"][typ],
-                  "to_preposition": self.language_dicts["to_prepositions"][typ],
-                  "street_name_after": self.language_dicts["street_name_after"][typ]
-                 }
+        @return blocks (dict of str)
+        """
+        templates = self.compiled_templates[typ]
+        blocks = { block_name: templates[block_name].format_map(fields) for block_name in templates }
+        blocks["distance_preposition"] = self.language_dicts["distance_preposition"]
 
-        # replace {variables} by maneuver data
-        text_replacement_dict = {
-           "{street_name_after}": maneuver["street_name_after"],
-           "{movement_modifier}": "{" + maneuver["movement_modifier"] +"}",
-           "{exit_number}"      : self.language_dicts["ordinals"][maneuver["exit_number"]],
-           "{nesw_after}"       : helpers.angles.azimuth_to_nesw_string( azim_deg = maneuver["out_bearing_deg"] )
-            }
-        for key in self.language_dicts["modifiers2"]:
-            text_replacement_dict["{"+ key + "}"] = self.language_dicts["modifiers2"][key]
-            
-        for block_name in blocks:
-            for key in text_replacement_dict:
-                blocks[block_name] = blocks[block_name].replace( key, text_replacement_dict[key] )        
-        
         # do the final polishing
         if blocks["street_name_after"] == "":
             blocks["to_preposition"] = ""
-    
         return blocks
+        
+    def movement_modifier_text(self, modifier):
+        # a movement modifier without translation is kept in braces
+        return self.language_dicts["modifiers2"].get( modifier, "{" + modifier + "}" )
+        
+    def compass_text(self, nesw_string):
+        return self.language_dicts.get("compass", {}).get( nesw_string, nesw_string )
+        
+    def maneuver_to_text_blocks(self, maneuver):
+        fields = {"street_name_after": maneuver["street_name_after"],
+                  "movement_modifier": self.movement_modifier_text( maneuver["movement_modifier"] ),
+                  "exit_number"      : self.language_dicts["ordinals"][int(maneuver["exit_number"])],
+                  "nesw_after"       : self.compass_text( helpers.angles.azimuth_to_nesw_string( azim_deg = maneuver["out_bearing_deg"] ) ),
+                 }
+        return self.render_text_blocks( typ = maneuver["type"], fields = fields )
+    
+    def maneuvers_to_text_blocks(self, maneuvers):
+        """
+        @brief: Batch version of maneuver_to_text_blocks for all maneuvers of a route.
+                The columns are read once, and the compass directions are computed in one vectorized call.
+        
+        @param maneuvers (helpers.maneuvers.ManeuverTable)
+        
+        @return text_blocks (list of dicts) one per maneuver
+        """
+        ordinals  = self.language_dicts["ordinals"]
+        modifiers = [ self.movement_modifier_text(m) for m in maneuvers.get_strings("movement_modifier") ]
+        nesw      = helpers.angles.azimuth_to_nesw_string( azim_deg = maneuvers.columns["out_bearing_deg"] )
+        
+        text_blocks = []
+        for typ, street, modifier, exit_number, nesw_after in zip( maneuvers.get_strings("type"),
+                                                                   maneuvers.get_strings("street_name_after"),
+                                                                   modifiers,
+                                                                   maneuvers.columns["exit_number"].tolist(),
+                                                                   nesw.tolist() ):
+            fields = {"street_name_after": street,
+                      "movement_modifier": modifier,
+                      "exit_number"      : ordinals[exit_number],
+                      "nesw_after"       : self.compass_text(nesw_after),
+                     }
+            text_blocks.append( self.render_text_blocks( typ = typ, fields = fields ) )
+        return text_blocks
     
 
 class CarDirector(Director):
     def set_data(self, router_maneuvers):
         self.maneuvers = router_maneuvers
         self.i_current_maneuver = 0
-        
-        for maneuver in self.maneuvers:
-            maneuver["text_blocks"] = self.maneuver_to_text_blocks( maneuver )
-
+        self.update_text_blocks()
+    
+    def update_text_blocks(self):
+        if len(self.maneuvers) == 0:
+            return # no route yet
+        self.maneuvers.set_extras( key = "text_blocks", values = self.maneuvers_to_text_blocks( self.maneuvers ) )
@@ -12,8 +12,11 @@ from gi.repository import Geoclue
 import numpy as np
 import serial
 import datetime
+import time
+import threading
 
 import helpers.angles
+import helpers.kalman
 
 def get_mapping_of_names_to_classes():
     """
@@ -25,10 +28,34 @@ def get_mapping_of_names_to_classes():
     d = {"PositionSerialNMEA": PositionSerialNMEA,
          "PositionGeoClue": PositionGeoClue,
          "PositionSimulation": PositionSimulation,
+         "PositionLogReplay": PositionLogReplay,
+         "PositionKalmanFilter": PositionKalmanFilter,
+         "PositionMultiplexer": PositionMultiplexer,
         }
     return d
 
+def make_position_provider(class_name, parameters):
+    """
+    @brief: make a position provider object from a profile entry.
+    
+    Used by position providers that are composed of other position providers.
+    
+    @param class_name (str) key of get_mapping_of_names_to_classes()
+    @param parameters (dict) keyword arguments of the class
+    
+    @return provider (PositionProvider)
+    """
+    mapping = get_mapping_of_names_to_classes()
+    if class_name not in mapping:
+        raise Exception("Position provider class '" + str(class_name) + "' not found. Choose one of " + str(list(mapping.keys())) )
+    provider = mapping[class_name](**parameters)
+    return provider
+
 class PositionProvider(object):
+    # True if the fixes are delivered by callbacks of the GLib main loop,
+    # such a provider must be created on the GUI thread
+    is_driven_by_main_loop = False
+    
     def __init__(self, **params ):
         """
         Baseclass to connect to position provider services.
@@ -38,6 +65,7 @@ class PositionProvider(object):
         self.time      = 0 # unix timestamp of last sensor update
         self.velocity  = 0 # in m/s
         self.heading   = 0 # heading of velocity in degree
+        self.accuracy  = float("nan") # horizontal accuracy in m, nan if unknown
         self.is_connected = False
         
         self.connect( **params )
@@ -56,50 +84,69 @@ class PositionProvider(object):
         success = False
         raise NotImplementedError()
         return success
-
-class PositionSerialNMEA(PositionProvider):
-    def connect(self, serial_port, timeout = 1.0):
+    
+    @property
+    def fix_time(self):
         """
-        Connect to a NMEA device on a serial port.
+        Unix timestamp of the last measured fix. 
+        Providers that predict positions between fixes keep it constant until the next fix.
         """
-        if self.is_connected:
-            self.disconnect()
-        self.serial_connection = serial.Serial( port=serial_port, timeout = timeout )
-        self.serial_connection.isOpen() # wait until open
-        self.is_connected = True
+        return self.time
     
-    def disconnect(self):
+    def get_fix(self):
         """
-        Close the serial connection (free the serial port).
+        @brief: the current fix in one piece, for readers on other threads.
+                Must be called from the thread that calls update_position.
+        
+        @return fix (dict) with keys time, latitude, longitude, velocity, heading, accuracy
         """
-        if self.is_connected:
-            self.serial_connection.close()
-            self.is_connected = False
+        return {"time"      : self.time,
+                "latitude"  : self.latitude,
+                "longitude" : self.longitude,
+                "velocity"  : self.velocity,
+                "heading"   : self.heading,
+                "accuracy"  : self.accuracy,
+               }
+
+class NMEAParser(object):
+    """
+    Mixin for position providers that read NMEA sentences,
+    no matter whether they come from a serial device or a log file.
+    """
+    def __parse_rmc__(self, sentence):
+        """
+        Extracts a position fix from a RMC sentence.
         
-    def update_position(self):
-        sentence = self.serial_connection.readline().decode("utf-8")
-        is_active = False
-        if sentence.startswith("$GPRMC"):
-            data = sentence[:-3].split(",")[1:]
-            is_active = ( data[1] == "A" )
+        @param sentence (str) one line of NMEA data
+        @return fix (dict or None)
+               None if the sentence is no RMC sentence or the fix is not active.
+               Otherwise a dict with keys
+               time, latitude, longitude, velocity and heading.
+        """
+        fix = None
+        if sentence.startswith("$GPRMC") or sentence.startswith("$GNRMC"):
+            data = sentence.strip().split("*")[0].split(",")[1:]
+            is_active = ( len(data) > 8 and data[1] == "A" )
             if is_active:
-                self.time      = self.__raw_to_time__(raw_date = data[8], raw_time = data[0])
-                self.latitude  = self.__raw_angle_to_decimal__( data[2] ) * (1 - 2 * (data[3] == "S") )
-                self.longitude = self.__raw_angle_to_decimal__( data[4] ) * (1 - 2 * (data[5] == "W") )
-                self.velocity  = self.__raw_to_float__(data[6]) * 1.852 / 3.6
-                self.heading   = self.__raw_to_float__(data[7])
-        return is_active
+                fix = {"time"      : self.__raw_to_time__(raw_date = data[8], raw_time = data[0]),
+                       "latitude"  : self.__raw_angle_to_decimal__( data[2] ) * (1 - 2 * (data[3] == "S") ),
+                       "longitude" : self.__raw_angle_to_decimal__( data[4] ) * (1 - 2 * (data[5] == "W") ),
+                       "velocity"  : self.__raw_to_float__(data[6]) * 1.852 / 3.6,
+                       "heading"   : self.__raw_to_float__(data[7]),
+                      }
+        return fix
         
     def __raw_to_time__(self, raw_date, raw_time):
         sec = float(raw_time[4:])
         time = datetime.datetime(
-                    year        = int(raw_date[4:]), 
+                    year        = 2000 + int(raw_date[4:]) % 100, 
                     month       = int(raw_date[2:4]), 
                     day         = int(raw_date[:2]), 
                     hour        = int(raw_time[:2]), 
                     minute      = int(raw_time[2:4]), 
                     second      = int(sec), 
-                    microsecond = int( 1000000 * (sec % 1))
+                    microsecond = int( 1000000 * (sec % 1)),
+                    tzinfo      = datetime.timezone.utc
                     ).timestamp()
         return time     
         
@@ -140,6 +187,39 @@ class PositionSerialNMEA(PositionProvider):
         if len(raw) > 0:
             flo = float(raw)
         return flo
+
+
+class PositionSerialNMEA(NMEAParser, PositionProvider):
+    def connect(self, serial_port, timeout = 1.0):
+        """
+        Connect to a NMEA device on a serial port.
+        """
+        if self.is_connected:
+            self.disconnect()
+        self.serial_connection = serial.Serial( port=serial_port, timeout = timeout )
+        self.serial_connection.isOpen() # wait until open
+        self.is_connected = True
+    
+    def disconnect(self):
+        """
+        Close the serial connection (free the serial port).
+        """
+        if self.is_connected:
+            self.serial_connection.close()
+            self.is_connected = False
+        
+    def update_position(self):
+        sentence = self.serial_connection.readline().decode("utf-8")
+        fix = self.__parse_rmc__(sentence)
+        is_active = ( fix is not None )
+        if is_active:
+            self.time      = fix["time"]
+            self.latitude  = fix["latitude"]
+            self.longitude = fix["longitude"]
+            self.velocity  = fix["velocity"]
+            self.heading   = fix["heading"]
+        return is_active
+
     
 class PositionGeoClue(PositionProvider):
     """
@@ -147,36 +227,65 @@ class PositionGeoClue(PositionProvider):
     https://howtotrainyourrobot.com/building-a-mobile-app-for-linux-part-4-gps-mobile-tracking/
     https://www.freedesktop.org/software/geoclue/docs/libgeoclue/GClueLocation.html
     """
+    is_driven_by_main_loop = True
 
     def connect(self):
         self.clue = Geoclue.Simple.new_sync('something',
                                             Geoclue.AccuracyLevel.NEIGHBORHOOD,
                                             None
                                             )
+        # GeoClue notifies about new locations, so there is no need to poll it
+        self.__has_new_fix = False
+        self.__on_location_changed__( self.clue, None )
+        self.__handler_id = self.clue.connect("notify::location", self.__on_location_changed__)
         self.is_connected = True
         
     def disconnect(self):
+        if self.is_connected:
+            self.clue.disconnect(self.__handler_id)
         self.clue = None
         self.is_connected = False
+    
+    def __on_location_changed__(self, clue, pspec):
+        """
+        Callback for GeoClue's location notifications. Caches the new fix.
+        Runs on the GLib main loop, so the fix is published in one assignment
+        and update_position may run on another thread.
+        """
+        location = clue.get_location()
+        self.__fix = {"time"      : location.get_property("timestamp"),
+                      "latitude"  : location.get_property('latitude'),
+                      "longitude" : location.get_property('longitude'),
+                      "velocity"  : location.get_property("speed"),
+                      "heading"   : location.get_property("heading"),
+                      "accuracy"  : location.get_property("accuracy"),
+                     }
+        self.__has_new_fix = True
         
     def update_position(self):
-        location = self.clue.get_location()        
-        self.time      = location.get_property("timestamp")
-        self.latitude  = location.get_property('latitude')
-        self.longitude = location.get_property('longitude')
-        self.velocity  = location.get_property("speed")
-        self.heading   = location.get_property("heading")
-        #location.get_property("accuracy") )            
+        """
+        @return has_changed (bool) 
+                True if GeoClue delivered a new location since the last call.
+        """
+        if not self.__has_new_fix:
+            return False
+        self.__has_new_fix = False # reset before reading, a fix arriving meanwhile is read next time
+        fix = self.__fix
+        self.time      = fix["time"]
+        self.latitude  = fix["latitude"]
+        self.longitude = fix["longitude"]
+        self.velocity  = fix["velocity"]
+        self.heading   = fix["heading"]
+        self.accuracy  = fix["accuracy"]
         return True
 
     
 class PositionSimulation(PositionProvider):
     def __init__(self, **params ):
         
-        self.velocity = 10 # m/s
+        self.__simulated_velocity = 10 # m/s
         
         import json
-        from scipy.interpolate import interp1d
         f = open("providers/position_simulation_data.json","r")
         dic = json.load(f)
         f.close()
@@ -188,12 +297,20 @@ class PositionSimulation(PositionProvider):
                                                     lat2_deg = self.__path_lat_deg[:-1], 
                                                     lon2_deg = self.__path_lon_deg[:-1],
                                                    )
-        covered_dist_in_m = np.cumsum(delta_in_m)
-        start_time = datetime.datetime.now().timestamp() #- 28150
-        self.__path_time = start_time + np.hstack([[0],covered_dist_in_m]) / self.velocity
+        self.__path_dist_in_m = np.hstack([[0],np.cumsum(delta_in_m)])
+        self.__start_time = datetime.datetime.now().timestamp() #- 28150
+        
+        # bearing of each path segment, segments of zero length inherit the previous bearing
+        airline = helpers.angles.calc_properties_of_airline(lat1_deg = self.__path_lat_deg[:-1], 
+                                                            lon1_deg = self.__path_lon_deg[:-1], 
+                                                            lat2_deg = self.__path_lat_deg[1:], 
+                                                            lon2_deg = self.__path_lon_deg[1:])
+        has_length = ( delta_in_m > 0 )
+        i_last_with_length = np.maximum.accumulate( np.where( has_length, np.arange(len(delta_in_m)), 0 ) )
+        self.__path_bearing_deg = np.where( has_length, airline["azimuth_from_point_1_towards_2_deg"], 0. )[i_last_with_length]
         
-        self.lat_interpolator = interp1d(self.__path_time, self.__path_lat_deg)
-        self.lon_interpolator = interp1d(self.__path_time, self.__path_lon_deg)
+        # index of the path segment of the last update
+        self.__cursor = 0
 
         PositionProvider.__init__(self, **params)
 
@@ -206,22 +323,546 @@ class PositionSimulation(PositionProvider):
         
     def update_position(self):
         self.time = datetime.datetime.now().timestamp()
+        covered_dist_in_m = (self.time - self.__start_time) * self.__simulated_velocity
         
-        epsilon = 1 # time to calculate the difference quotient for the heading
-        
-        if self.time <= self.__path_time[0]:
+        if covered_dist_in_m <= 0:
             self.latitude  = self.__path_lat_deg[0]
             self.longitude = self.__path_lon_deg[0]
             self.heading   = 0
-        elif self.time >= self.__path_time[-1] - epsilon:
+            self.velocity  = 0
+        elif covered_dist_in_m >= self.__path_dist_in_m[-1]:
             self.latitude  = self.__path_lat_deg[-1]
             self.longitude = self.__path_lon_deg[-1]
             self.heading   = 0
+            self.velocity  = 0
         else:
-            self.latitude  = self.lat_interpolator(self.time)
-            self.longitude = self.lon_interpolator(self.time)
-            lat2           = self.lat_interpolator(self.time+epsilon)
-            lon2           = self.lon_interpolator(self.time+epsilon)
-            airline        = helpers.angles.calc_properties_of_airline(lat1_deg=self.latitude, lon1_deg=self.longitude, lat2_deg=lat2, lon2_deg=lon2)
-            self.heading   = airline["azimuth_from_point_1_towards_2_deg"]
+            # usually, the position is still on the segment of the last update
+            i = self.__cursor
+            if covered_dist_in_m < self.__path_dist_in_m[i] or covered_dist_in_m >= self.__path_dist_in_m[i+1]:
+                i = np.searchsorted(self.__path_dist_in_m, covered_dist_in_m, side="right") - 1
+                self.__cursor = i
+            
+            a_rel = (covered_dist_in_m - self.__path_dist_in_m[i]) / (self.__path_dist_in_m[i+1] - self.__path_dist_in_m[i])
+            self.latitude  = self.__path_lat_deg[i] + a_rel * (self.__path_lat_deg[i+1] - self.__path_lat_deg[i])
+            self.longitude = self.__path_lon_deg[i] + a_rel * (self.__path_lon_deg[i+1] - self.__path_lon_deg[i])
+            self.heading   = self.__path_bearing_deg[i]
+            self.velocity  = self.__simulated_velocity
         return True
+
+
+class PositionLogReplay(NMEAParser, PositionProvider):
+    """
+    Replays a recorded NMEA or GPX log with its original timestamps.
+    
+    The log is read lazily, fix by fix,
+    so multi-hour recordings do not have to fit into memory.
+    Seeking backwards re-opens the file and skips forward.
+    """
+    def connect(self, filename, speedup = 1.0, loop = False, start_offset_s = 0.0, log_format = "auto"):
+        """
+        @param filename (str) NMEA or GPX log file.
+        @param speedup (float) replay speed relative to the recording, from 1 to 100.
+        @param loop (bool) restart at the beginning when the end of the log is reached.
+        @param start_offset_s (float) 
+               Where to start the replay, in seconds after the first fix of the log.
+        @param log_format (str) "nmea", "gpx", or "auto" (decide by file extension).
+        """
+        if self.is_connected:
+            self.disconnect()
+        if log_format == "auto":
+            log_format = "gpx" if filename.lower().endswith(".gpx") else "nmea"
+        if log_format not in ["nmea", "gpx"]:
+            raise Exception("Unknown log format \'" + str(log_format) + "\'. Choose one of nmea, gpx, auto.")
+        
+        self.filename   = filename
+        self.log_format = log_format
+        self.loop       = loop
+        self.set_speedup(speedup)
+        
+        self.__log_duration_s = None # known as soon as the end of the log was reached once
+        self.__open_log__()
+        self.is_connected = True
+        self.seek( start_offset_s )
+        
+    def disconnect(self):
+        if self.is_connected:
+            self.__fixes.close()
+            self.is_connected = False
+    
+    def set_speedup(self, speedup):
+        """
+        @brief: change the replay speed without jumping in the log.
+        
+        @param speedup (float) replay speed relative to the recording, from 1 to 100.
+        """
+        if speedup < 1 or speedup > 100:
+            raise Exception("Replay speedup must be between 1 and 100, not " + str(speedup) )
+        if self.is_connected:
+            self.__anchor_offset_s  = self.get_replay_offset()
+            self.__anchor_wall_time = datetime.datetime.now().timestamp()
+        self.speedup = speedup
+        
+    def seek(self, offset_s):
+        """
+        @brief: jump to a position in the log.
+        
+        @param offset_s (float) seconds after the first fix of the log
+        """
+        offset_s = max(0, offset_s)
+        if self.__log_duration_s is not None and self.__log_duration_s > 0 and self.loop:
+            offset_s = offset_s % self.__log_duration_s
+        if offset_s < self.__current_offset_s:
+            self.__open_log__()
+        self.__anchor_offset_s  = offset_s
+        self.__anchor_wall_time = datetime.datetime.now().timestamp()
+        
+    def get_replay_offset(self):
+        """
+        @return offset_s (float) 
+                Current replay position in seconds after the first fix of the log.
+        """
+        wall_time = datetime.datetime.now().timestamp()
+        return self.__anchor_offset_s + (wall_time - self.__anchor_wall_time) * self.speedup
+            
+    def update_position(self):
+        offset_s = self.get_replay_offset()
+        
+        if self.__next_fix is None and self.loop and self.__log_duration_s > 0 and offset_s > self.__log_duration_s:
+            self.seek( offset_s )
+            offset_s = self.__anchor_offset_s
+            
+        has_new_fix = False
+        while self.__next_fix is not None and self.__next_fix["time"] - self.__log_start_time <= offset_s:
+            fix = self.__next_fix
+            self.time      = fix["time"]
+            self.latitude  = fix["latitude"]
+            self.longitude = fix["longitude"]
+            self.velocity  = fix["velocity"]
+            self.heading   = fix["heading"]
+            self.__current_offset_s = fix["time"] - self.__log_start_time
+            self.__next_fix = next( self.__fixes, None )
+            has_new_fix = True
+            
+        if self.__next_fix is None:
+            self.__log_duration_s = self.__current_offset_s
+        return has_new_fix
+    
+    def __open_log__(self):
+        """
+        (Re-)start reading the log from its beginning.
+        """
+        if self.log_format == "gpx":
+            self.__fixes = self.__read_gpx_fixes__()
+        else:
+            self.__fixes = self.__read_nmea_fixes__()
+        self.__next_fix = next( self.__fixes, None )
+        if self.__next_fix is None:
+            raise Exception("No valid position fix found in " + str(self.filename) )
+        self.__log_start_time   = self.__next_fix["time"]
+        self.__current_offset_s = -1
+        
+    def __read_nmea_fixes__(self):
+        with open(self.filename, "r", errors="replace") as f:
+            for sentence in f:
+                fix = self.__parse_rmc__(sentence)
+                if fix is not None:
+                    yield fix
+
+    def __read_gpx_fixes__(self):
+        """
+        GPX 1.0 track points may contain speed and course.
+        If they are missing, both are calculated from the previous track point.
+        """
+        import xml.etree.ElementTree
+        
+        previous = None
+        open_elements = [] # path from the root to the current element
+        with open(self.filename, "rb") as f:
+            for event, elem in xml.etree.ElementTree.iterparse(f, events=("start", "end")):
+                if event == "start":
+                    open_elements.append(elem)
+                    continue
+                open_elements.pop()
+                if not elem.tag.endswith("trkpt"):
+                    continue
+                children = {}
+                for child in elem:
+                    children[child.tag.split("}")[-1]] = child.text
+                lat_deg = float( elem.get("lat") )
+                lon_deg = float( elem.get("lon") )
+                # keep the memory footprint small for long logs: 
+                # a cleared element that is still attached to its trkseg would pile up
+                elem.clear()
+                if len(open_elements) != 0:
+                    open_elements[-1].remove(elem)
+                if "time" not in children:
+                    continue
+                
+                fix = {"time"      : datetime.datetime.fromisoformat( children["time"].strip().replace("Z", "+00:00") ).timestamp(),
+                       "latitude"  : lat_deg,
+                       "longitude" : lon_deg,
+                       "velocity"  : float( children.get("speed", "nan") ),
+                       "heading"   : float( children.get("course", "nan") ),
+                      }
+                if previous is not None and fix["time"] > previous["time"] and ( np.isnan(fix["velocity"]) or np.isnan(fix["heading"]) ):
+                    airline = helpers.angles.calc_properties_of_airline(lat1_deg = previous["latitude"], 
+                                                                        lon1_deg = previous["longitude"], 
+                                                                        lat2_deg = fix["latitude"], 
+                                                                        lon2_deg = fix["longitude"])
+                    if np.isnan(fix["velocity"]):
+                        fix["velocity"] = airline["distance_m"] / (fix["time"] - previous["time"])
+                    if np.isnan(fix["heading"]):
+                        fix["heading"] = airline["azimuth_from_point_1_towards_2_deg"]
+                previous = fix
+                yield fix
+
+
+class PositionKalmanFilter(PositionProvider):
+    """
+    Smooths and predicts the fixes of another position provider.
+    
+    Receivers typically deliver one fix per second, but the map is redrawn
+    much more often. Between fixes, and during short outages,
+    this provider extrapolates with a constant velocity Kalman filter.
+    Fixes that are too far off the prediction are rejected as outliers.
+    
+    The source is read on a worker thread of a PositionMultiplexer,
+    so a blocking source, e.g. a serial port waiting for its next line, 
+    does not block the predictions on the GUI thread.
+    
+    Any position provider can be filtered by wrapping it in a profile, e.g.
+    {"class_name": "PositionKalmanFilter", 
+     "parameters": {"source": {"class_name": "PositionGeoClue", "parameters": {}}}}
+    """
+    def connect(self, 
+                source, 
+                position_sigma_m              = 5.0, 
+                velocity_sigma_m_per_s        = 1.0, 
+                acceleration_sigma_m_per_s2   = 2.0, 
+                max_outage_s                  = 5.0, 
+                max_consecutive_rejections    = 3,
+                ):
+        """
+        @param source (dict) 
+               Profile of the position provider to be filtered,
+               with keys class_name and parameters.
+        @param position_sigma_m (float) measurement uncertainty of the position
+        @param velocity_sigma_m_per_s (float) measurement uncertainty of the velocity
+        @param acceleration_sigma_m_per_s2 (float) process noise
+        @param max_outage_s (float)
+               Dead reckoning is done for this long after the last accepted fix.
+               Afterwards, the position is held.
+               If the next fix arrives later, the filter starts over.
+        @param max_consecutive_rejections (int)
+               If more fixes in a row are rejected as outliers, 
+               the filter follows the source and starts over.
+        """
+        if source["class_name"] == "PositionMultiplexer":
+            self.source = make_position_provider( **source ) # reads its sources on worker threads itself
+        else:
+            self.source = PositionMultiplexer( sources = [source] )
+        self.position_sigma_m           = position_sigma_m
+        self.velocity_sigma_m_per_s     = velocity_sigma_m_per_s
+        self.max_outage_s               = max_outage_s
+        self.max_consecutive_rejections = max_consecutive_rejections
+        
+        self.kalman = helpers.kalman.ConstantVelocityKalmanFilter( acceleration_sigma = acceleration_sigma_m_per_s2 )
+        self.__is_initialized        = False
+        self.__consecutive_rejections = 0
+        self.__last_fix_time         = 0 # time of the last accepted fix, on the source clock
+        self.__last_update_time      = 0 # time of the last accepted fix, on the monotonic clock
+        self.__origin_lat_deg        = 0 # origin of the local metric frame of the filter
+        self.__origin_lon_deg        = 0
+        self.is_connected = True
+        
+        # the source took its first fix during its construction
+        if self.source.time != 0:
+            self.__apply_fix__( time.monotonic() )
+        
+    def disconnect(self):
+        if self.is_connected:
+            self.source.disconnect()
+            self.is_connected = False
+    
+    def update_position(self):
+        now = time.monotonic()
+        if self.source.update_position():
+            self.__apply_fix__( now )
+            
+        if not self.__is_initialized:
+            return False
+        
+        dt = min( now - self.__last_update_time, self.max_outage_s )
+        x, P = self.kalman.predict(dt)
+        
+        self.latitude, self.longitude = helpers.angles.local_east_north_to_angles(
+                                             east_m   = x[0], 
+                                             north_m  = x[1], 
+                                             lat0_deg = self.__origin_lat_deg, 
+                                             lon0_deg = self.__origin_lon_deg )
+        self.velocity = np.sqrt( x[2]**2 + x[3]**2 )
+        if self.velocity > 0.5:
+            self.heading = ( np.arctan2( x[2], x[3] ) * 180 / np.pi ) % 360
+        self.time = self.__last_fix_time + dt
+        return True
+    
+    @property
+    def fix_time(self):
+        return self.__last_fix_time
+    
+    def __apply_fix__(self, now):
+        """
+        @brief: feed the current fix of the source into the filter.
+        
+        @param now (float) monotonic time of the fix arrival
+        """
+        if not self.__is_initialized:
+            self.__origin_lat_deg = self.source.latitude
+            self.__origin_lon_deg = self.source.longitude
+        
+        east_m, north_m = helpers.angles.angles_to_local_east_north( 
+                                             lat_deg  = self.source.latitude, 
+                                             lon_deg  = self.source.longitude, 
+                                             lat0_deg = self.__origin_lat_deg, 
+                                             lon0_deg = self.__origin_lon_deg )
+        
+        # Providers report unknown speed or heading as nan or negative values
+        has_velocity = ( self.source.velocity >= 0 and self.source.heading >= 0 )
+        if has_velocity:
+            heading_rad = self.source.heading * np.pi / 180
+            z = np.array([ east_m, 
+                           north_m, 
+                           self.source.velocity * np.sin(heading_rad), 
+                           self.source.velocity * np.cos(heading_rad) ])
+            R = np.diag([ self.position_sigma_m**2, self.position_sigma_m**2, self.velocity_sigma_m_per_s**2, self.velocity_sigma_m_per_s**2 ])
+        else:
+            z = np.array([ east_m, north_m ])
+            R = np.diag([ self.position_sigma_m**2, self.position_sigma_m**2 ])
+        
+        dt = now - self.__last_update_time
+        is_accepted = False
+        if self.__is_initialized and dt <= self.max_outage_s:
+            is_accepted = self.kalman.update( dt = dt, z = z, R = R )
+            if is_accepted:
+                self.__consecutive_rejections = 0
+            else:
+                self.__consecutive_rejections += 1
+                
+        start_over = ( not self.__is_initialized 
+                       or dt > self.max_outage_s 
+                       or self.__consecutive_rejections > self.max_consecutive_rejections )
+        if start_over:
+            velocity_east = velocity_north = 0
+            if has_velocity:
+                velocity_east, velocity_north = z[2], z[3]
+            self.kalman.reset( east_m, north_m, velocity_east, velocity_north, 
+                               position_sigma_m = self.position_sigma_m, 
+                               velocity_sigma   = self.velocity_sigma_m_per_s if has_velocity else 30. )
+            self.__is_initialized = True
+            self.__consecutive_rejections = 0
+            is_accepted = True
+            
+        if is_accepted:
+            self.__last_update_time = now
+            self.__last_fix_time    = self.source.time
+            
+            # keep the local frame small, so that the flat projection stays accurate
+            if np.sqrt( self.kalman.x[0]**2 + self.kalman.x[1]**2 ) > 10000:
+                self.__origin_lat_deg, self.__origin_lon_deg = helpers.angles.local_east_north_to_angles(
+                                             east_m   = self.kalman.x[0], 
+                                             north_m  = self.kalman.x[1], 
+                                             lat0_deg = self.__origin_lat_deg, 
+                                             lon0_deg = self.__origin_lon_deg )
+                self.kalman.x[:2] = 0
+
+
+class PositionMultiplexer(PositionProvider):
+    """
+    Combines several position providers, for example a serial GNSS and GeoClue.
+    
+    Every source is polled on its own thread,
+    so a slow or blocking source cannot block the GUI.
+    Sources are created on their thread as well, except for sources 
+    that are driven by the GLib main loop, which are created on the GUI thread.
+    update_position only looks at the latest fix of each source.
+    Sources without a recent fix are ignored,
+    so if a source stalls, the others take over as soon as its next fix is overdue.
+    """
+    def connect(self, sources, mode = "select", stale_after_s = 2.0, missed_fixes = 1.5, poll_interval_s = 0.05, default_accuracy_m = 10.0):
+        """
+        @param sources (list of dicts)
+               Profiles of the position providers to be combined,
+               with keys class_name and parameters.
+               The optional key accuracy_m is used 
+               if the provider does not report its accuracy itself.
+        @param mode (str)
+               "select": use the fix with the best accuracy 
+               "fuse":   weighted mean of all recent fixes
+               The accuracy of older fixes is degraded by the distance 
+               that may have been driven since.
+        @param stale_after_s (float) fixes older than this are always ignored
+        @param missed_fixes (float) 
+               A fix is ignored as soon as it is older than this many update intervals of its source
+               (plus one poll interval), so a 10 Hz source is dropped after 0.2 s.
+               The update interval of each source is measured from the arrivals of its fixes.
+        @param poll_interval_s (float) pause between two polls of a source
+        @param default_accuracy_m (float) 
+               assumed accuracy if neither the provider nor the profile tell it
+        """
+        if mode not in ["select", "fuse"]:
+            raise Exception("Unknown mode '" + str(mode) + "'. Choose one of select, fuse.")
+        self.mode               = mode
+        self.stale_after_s      = stale_after_s
+        self.missed_fixes       = missed_fixes
+        self.poll_interval_s    = poll_interval_s
+        self.default_accuracy_m = default_accuracy_m
+        
+        self.sources           = sources
+        self.__snapshots       = [None] * len(sources) # latest fix of each source
+        self.__errors          = [None] * len(sources) # why a source stopped, None while it runs
+        self.__used_snapshots  = []
+        self.__stop_event      = threading.Event()
+        self.__threads         = []
+        classes = get_mapping_of_names_to_classes()
+        for i in range(len(sources)):
+            provider = None
+            cls = classes.get( sources[i]["class_name"] )
+            if cls is not None and cls.is_driven_by_main_loop:
+                # its callbacks run on the main loop, which belongs to the GUI thread
+                try:
+                    provider = make_position_provider( class_name = sources[i]["class_name"], parameters = sources[i]["parameters"] )
+                except Exception as e:
+                    self.__set_error__(i, e)
+                    continue
+            thread = threading.Thread( target = self.__poll_source__, args = (i, sources[i], provider), daemon = True )
+            thread.start()
+            self.__threads.append(thread)
+        self.is_connected = True
+    
+    def disconnect(self):
+        """
+        Ask all source threads to stop. Does not wait for blocked sources.
+        """
+        if self.is_connected:
+            self.__stop_event.set()
+            for thread in self.__threads:
+                thread.join( timeout = self.poll_interval_s )
+            self.is_connected = False
+            
+    def __set_error__(self, i, error):
+        """
+        @brief: mark a source as dead, so that it is reported by get_source_states.
+        """
+        print("Position source", self.sources[i]["class_name"], "failed:", error)
+        self.__errors[i] = error
+    
+    def get_source_states(self):
+        """
+        @return states (list of dicts) one per source, with keys
+                "class_name",
+                "state" ("failed", "waiting" for the first fix, "stale" or "ok"),
+                "error" (Exception or None) why a failed source stopped
+        """
+        now = time.monotonic()
+        states = []
+        for source, snap, error in zip(self.sources, list(self.__snapshots), list(self.__errors)):
+            if error is not None:
+                state = "failed"
+            elif snap is None:
+                state = "waiting"
+            elif now - snap["arrival"] > snap["stale_after_s"]:
+                state = "stale"
+            else:
+                state = "ok"
+            states.append( {"class_name": source["class_name"], "state": state, "error": error} )
+        return states
+    
+    def __poll_source__(self, i, source, provider = None):
+        """
+        Thread function: create a source and poll it until disconnect.
+        
+        @param i (int) index of the source
+        @param source (dict) profile of the source
+        @param provider (PositionProvider or None) the source, if it was created on the GUI thread
+        """
+        if provider is None:
+            try:
+                provider = make_position_provider( class_name = source["class_name"], parameters = source["parameters"] )
+            except Exception as e:
+                self.__set_error__(i, e)
+                return
+        
+        has_new_fix = ( provider.time != 0 ) # the first fix is taken during construction
+        previous_arrival = None
+        interval_s       = None # smoothed time between 2 fixes of this source
+        try:
+            while not self.__stop_event.is_set():
+                if has_new_fix:
+                    arrival = time.monotonic()
+                    if previous_arrival is not None:
+                        if interval_s is None:
+                            interval_s = arrival - previous_arrival
+                        interval_s = 0.8 * interval_s + 0.2 * ( arrival - previous_arrival )
+                    previous_arrival = arrival
+                    
+                    stale_after_s = self.stale_after_s
+                    if interval_s is not None:
+                        stale_after_s = min( stale_after_s, self.missed_fixes * interval_s + self.poll_interval_s )
+                    
+                    snap = provider.get_fix()
+                    if not snap["accuracy"] > 0:
+                        snap["accuracy"] = source.get("accuracy_m", self.default_accuracy_m)
+                    snap["arrival"]       = arrival
+                    snap["stale_after_s"] = stale_after_s
+                    # one assignment, so the GUI thread never sees a half updated fix
+                    self.__snapshots[i] = snap
+                self.__stop_event.wait( self.poll_interval_s )
+                has_new_fix = provider.update_position()
+        except Exception as e:
+            self.__set_error__(i, e)
+        finally:
+            provider.disconnect()
+    
+    def update_position(self):
+        now = time.monotonic()
+        fresh = []
+        for snap in list(self.__snapshots):
+            if snap is not None and now - snap["arrival"] <= snap["stale_after_s"]:
+                fresh.append(snap)
+        if len(fresh) == 0:
+            return False # hold the last position
+
+        sigmas = []
+        for snap in fresh:
+            age_s    = now - snap["arrival"]
+            velocity = snap["velocity"] if snap["velocity"] > 0 else 0
+            sigmas.append( snap["accuracy"] + velocity * age_s )
+        sigmas = np.array(sigmas)
+        best   = fresh[ np.argmin(sigmas) ]
+        
+        used = fresh if self.mode == "fuse" else [best]
+        has_changed = ( list( snap["arrival"] for snap in used ) != list( snap["arrival"] for snap in self.__used_snapshots ) )
+        self.__used_snapshots = used
+        
+        if self.mode == "fuse":
+            weights = 1 / sigmas**2
+            weights = weights / np.sum(weights)
+            # average in a local frame around the best fix, so that fixes on both sides of the date line
+            # do not average to the other side of the globe
+            lat_deg = np.array(list( snap["latitude"]  for snap in fresh ))
+            lon_deg = np.array(list( snap["longitude"] for snap in fresh ))
+            lon_deg = best["longitude"] + ( lon_deg - best["longitude"] + 180 ) % 360 - 180
+            east_m, north_m = helpers.angles.angles_to_local_east_north( lat_deg = lat_deg, lon_deg = lon_deg, lat0_deg = best["latitude"], lon0_deg = best["longitude"] )
+            lat_deg, lon_deg = helpers.angles.local_east_north_to_angles( east_m = np.sum( weights * east_m ), north_m = np.sum( weights * north_m ), 
+                                                                          lat0_deg = best["latitude"], lon0_deg = best["longitude"] )
+            self.latitude  = lat_deg
+            self.longitude = ( lon_deg + 180 ) % 360 - 180
+            self.accuracy  = 1 / np.sqrt( np.sum( 1 / sigmas**2 ) )
+        else:
+            self.latitude  = best["latitude"]
+            self.longitude = best["longitude"]
+            self.accuracy  = best["accuracy"]
+        self.time     = best["time"]
+        self.velocity = best["velocity"]
+        self.heading  = best["heading"]
+        return has_changed
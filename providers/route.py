@@ -5,12 +5,26 @@ This file defines route provider.
 A route provider finds a set of roads, leading from a start location to a destination.
 """
 
-import numpy as np
+import os
+import re
+import copy
+import time
+import pickle
+import threading
 
-from polyline.polyline.codec import PolylineCodec
+import numpy as np
 
 import helpers.download
+import helpers.disk_cache
+import helpers.json_stream
 import helpers.angles
+import helpers.route_index
+import helpers.polyline
+import helpers.simplify
+import helpers.road_graph
+import helpers.maneuvers
+import helpers.route_progress
+import helpers.map_matching
 
 
 def get_mapping_of_names_to_classes():
@@ -22,12 +36,107 @@ def get_mapping_of_names_to_classes():
     d = {"Router": Router,
         "OSRM": OSRM,
         "OSM_Scout": OSM_Scout,
+        "OfflineRouter": OfflineRouter,
+        "RouterRace": RouterRace,
         }
     return d
 
 
+def make_router(class_name, parameters):
+    """
+    @brief: make a router object from a profile entry.
+    
+    Used by routers that are composed of other routers.
+    
+    @param class_name (str) key of get_mapping_of_names_to_classes()
+    @param parameters (dict) keyword arguments of the class
+    
+    @return router (Router)
+    """
+    mapping = get_mapping_of_names_to_classes()
+    if class_name not in mapping:
+        raise Exception("Router class '" + str(class_name) + "' not found. Choose one of " + str(list(mapping.keys())) )
+    router = mapping[class_name](**parameters)
+    return router
+
+
+OSRM_ICON_TYPES = {
+   "arrive"          :"arrive",
+   "continue"        :"crossing",
+   "straight"        :"crossing",
+   "depart"          :"nesw_arrow",
+   "end of road"     :"crossing",
+   "exit rotary"     :"crossing",
+   "new name"        :"crossing",
+   "turn"            :"crossing",
+   "fork"            :"crossing",
+   "merge"           :"crossing",
+   "on ramp"         :"crossing",
+   "off ramp"        :"crossing",
+   "roundabout"      :"crossing",
+   "rotary"          :"crossing",
+   "notification"    :"notification",
+   "roundabout turn" :"crossing",
+   "exit roundabout" :"crossing",
+    }
+
+
+class RouteCache(helpers.disk_cache.DiskCache):
+    def __init__(self, directory = "route_cache", grid_deg = 1E-4, ttl_s = 86400, max_size_bytes = 50000000):
+        """
+        @brief: Persistent cache of parsed routes on disk.
+        
+        Routes are stored with pickle, one file per route,
+        so a cache hit needs neither a server request nor JSON parsing.
+        
+        @param directory (str) where the cached routes are stored
+        @param grid_deg (float) 
+               Waypoints are rounded to this grid before they are compared,
+               so slightly different start positions hit the same cache entry.
+        @param ttl_s (float) routes older than this are not used
+        @param max_size_bytes (int) 
+               If the cache grows larger, the oldest routes are deleted.
+        """
+        self.grid_deg = grid_deg
+        self.ttl_s    = ttl_s
+        helpers.disk_cache.DiskCache.__init__(self, directory = directory, extension = ".pickle", max_size_bytes = max_size_bytes)
+        
+    def make_key(self, router_name, options, waypoints):
+        """
+        @param router_name (str) e.g. the class name of the router
+        @param options (str) everything else that affects the route, e.g. the URL template
+        @param waypoints (2d numpy array of Nx2 float)
+        
+        @return key (str)
+        """
+        quantized = np.round( np.array(waypoints, dtype=float) / self.grid_deg ).astype(np.int64)
+        return self.hash_key( router_name, options, str(self.grid_deg), quantized.tobytes() )
+    
+    def load(self, key):
+        """
+        @return state (dict or None) None if not cached or expired
+        """
+        filename = self.get_filename(key)
+        try:
+            if time.time() - os.path.getmtime(filename) > self.ttl_s:
+                os.remove(filename)
+                return None
+            with open(filename, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        return state
+    
+    def store(self, key, state):
+        """
+        @param key (str)
+        @param state (dict) anything that can be pickled
+        """
+        self.write( key, pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL) )
+
+
 class Router(object):
-    def __init__(self, url_template= "", waypoints=[]):
+    def __init__(self, url_template= "", waypoints=[], cache=None):
         """
         @brief: A router that connects start an destination by a series of roads and turns.
             This is a baseclass that provides all methods, but does not do anything.
@@ -42,12 +151,19 @@ class Router(object):
         @param waypoints (numpy array)
             If not empty, a trip will be generated.
             See self.set_trip for details.
+        @param cache (dict or None)
+            Parameters of a RouteCache. None means no caching.
         """
         self.url_template = url_template
         self.waypoints = waypoints
         self.trip = {}
+        self.route_cache = None
+        if cache is not None:
+            self.route_cache = RouteCache(**cache)
         if len(self.waypoints) != 0:
             self.route = self.set_route(waypoints)
+        else:
+            Router.set_route(self, waypoints) # empty route
 
     def set_route(self, waypoints):
         """
@@ -62,32 +178,293 @@ class Router(object):
              waypoints[:,0] are longitudes
              waypoints[:,1] are latitudes
         """
+        self.waypoints = waypoints
         self.lat_deg = []
         self.lon_deg = []
-        self.maneuvers = []
+        self.maneuvers = helpers.maneuvers.ManeuverTable()
         self.dist_from_start = []
+        self.precompute_route_geometry()
+        self.attach_route_to_maneuvers()
+    
+    def get_route_state(self):
+        """
+        @brief: everything that describes the current route, 
+                without data that can be derived from it.
+        
+        @return state (dict)
+        """
+        return {"lat_deg"         : self.lat_deg,
+                "lon_deg"         : self.lon_deg,
+                "dist_from_start" : self.dist_from_start,
+                "maneuvers"       : self.maneuvers, # pickled without the whole route
+               }
+    
+    def set_route_state(self, state):
+        """
+        @brief: restore a route from get_route_state.
+        """
+        self.lat_deg         = state["lat_deg"]
+        self.lon_deg         = state["lon_deg"]
+        self.dist_from_start = state["dist_from_start"]
+        self.maneuvers       = state["maneuvers"]
+        if isinstance(self.maneuvers, list): # cached by an older version
+            self.maneuvers = helpers.maneuvers.ManeuverTable( self.maneuvers )
+        self.precompute_route_geometry()
+        self.attach_route_to_maneuvers()
+    
+    def restore_route_from_cache(self, waypoints):
+        """
+        @return is_restored (bool) True if the route was found in the cache.
+        """
+        if self.route_cache is None:
+            return False
+        key = self.route_cache.make_key( router_name = type(self).__name__, options = self.url_template, waypoints = waypoints )
+        state = self.route_cache.load(key)
+        if state is None:
+            return False
+        self.set_route_state(state)
+        return True
+    
+    def store_route_in_cache(self, waypoints):
+        if self.route_cache is not None:
+            key = self.route_cache.make_key( router_name = type(self).__name__, options = self.url_template, waypoints = waypoints )
+            self.route_cache.store(key, self.get_route_state())
+    
+    def adopt_route(self, router):
+        """
+        @brief: use the route of another router, without recalculating anything.
+        
+        @param router (Router)
+        """
+        self.lat_deg         = router.lat_deg
+        self.lon_deg         = router.lon_deg
+        self.dist_from_start = router.dist_from_start
+        self.maneuvers       = router.maneuvers
+        self.route_index     = router.route_index
+        self.route_pyramid   = router.route_pyramid
+        self.route_progress  = router.route_progress
+        self.map_matcher     = router.map_matcher
+    
+    def get_waypoints_ahead(self, lat_deg, lon_deg):
+        """
+        @brief: waypoints for a new route from the given position,
+                without the intermediate waypoints that were passed already 
+                according to route_progress.
+        
+        @param lat_deg (float) new start
+        @param lon_deg (float)
+        
+        @return waypoints (2d numpy array of Nx2 float) see set_route
+        """
+        waypoints = np.array(self.waypoints, dtype=float).reshape(-1,2)
+        is_ahead = np.ones(len(waypoints), dtype=bool)
+        is_ahead[0] = False
+        i_min = 0
+        for i in range(1, len(waypoints) - 1):
+            # the waypoints are visited in order, so each one is searched behind the previous one
+            i_segment, a_rel, distance_m = self.route_index.closest_segment( lat_deg = waypoints[i,1], lon_deg = waypoints[i,0], i_min = i_min )
+            if i_segment is None:
+                continue
+            i_min = i_segment
+            segment_length_m = self.dist_from_start[i_segment+1] - self.dist_from_start[i_segment]
+            is_ahead[i] = ( self.dist_from_start[i_segment] + a_rel * segment_length_m > self.route_progress.distance_along_route_m )
+        return np.vstack([ [[lon_deg, lat_deg]], waypoints[is_ahead] ])
+    
+    def poll_better_route(self):
+        """
+        @brief: adopt a better route that was found after set_route returned.
+                Must be called from the GUI thread.
+        
+        @return is_changed (bool)
+        """
+        return False # base class finds all routes in set_route
+    
+    def attach_route_to_maneuvers(self):
+        """
+        @brief: make the whole route accessible from each maneuver
+                (stored once in the maneuver table),
+                and start matching positions to the route and tracking the progress along it.
+        """
+        self.maneuvers.set_route( lat_deg         = self.lat_deg, 
+                                  lon_deg         = self.lon_deg, 
+                                  dist_from_start = self.dist_from_start, 
+                                  route_index     = self.route_index )
+        self.route_progress = helpers.route_progress.RouteProgress( 
+                                  dist_from_start        = self.dist_from_start, 
+                                  route_index            = self.route_index, 
+                                  maneuver_inds_on_route = self.maneuvers.columns["ind_on_route"], 
+                                  maneuver_durations_s   = self.maneuvers.columns["duration_to_next"] )
+        self.map_matcher = helpers.map_matching.HMMRouteMatcher( route_index = self.route_index, dist_from_start = self.dist_from_start )
+    
+    def precompute_route_geometry(self):
+        """
+        @brief: build everything that only depends on the route polyline,
+                so that it need not be calculated once per frame.
+        """
+        self.route_index   = helpers.route_index.RouteIndex( lat_deg = self.lat_deg, lon_deg = self.lon_deg )
+        self.route_pyramid = self.make_route_pyramid()
+    
+    def make_route_pyramid(self, zooms = np.arange(20), tolerance_px = 1.):
+        """
+        @brief: simplified versions of the route polyline for each zoom level.
+        
+        @param zooms (1d numpy array of int) slippy map zoom levels
+        @param tolerance_px (float) 
+               Douglas-Peucker tolerance, in pixels of the zoom level.
+        
+        @return pyramid (dict)
+               zoom (int) -> indices of the route points to be drawn 
+               (1d numpy array of int, sorted).
+               None instead of indices if all points must be drawn.
+        """
+        pyramid = {}
+        if len(self.lat_deg) == 0:
+            return pyramid
+        
+        lat0_deg = self.route_index.lat0_deg
+        tolerances_m = tolerance_px * helpers.simplify.slippy_map_meters_per_pixel( zoom = zooms, lat_deg = lat0_deg )
+        
+        east_m, north_m = self.route_index.project( lat_deg = self.lat_deg, lon_deg = self.lon_deg )
+        significance = helpers.simplify.douglas_peucker_significance( x = east_m, y = north_m, min_tolerance = np.min(tolerances_m) )
+        
+        for zoom, tolerance_m in zip(zooms, tolerances_m):
+            indices = np.nonzero( significance > tolerance_m )[0]
+            if len(indices) == len(self.lat_deg):
+                indices = None
+            pyramid[int(zoom)] = indices
+        return pyramid
         
     def get_polyline_of_whole_route(self, color_rgba = (0,0,1,0.5) ):
-        return {"lat_deg":self.lat_deg,"lon_deg":self.lon_deg, "color_rgba": color_rgba}
+        """
+        @param color_rgba (tuple of 4 float)
+        
+        @return line_dict (dict) 
+                the full route, with route_index and route_pyramid that refer to its points.
+                The line marker simplifies the route for each zoom level with the pyramid.
+        """
+        return {"lat_deg": self.lat_deg, "lon_deg": self.lon_deg, "color_rgba": color_rgba, "route_index": self.route_index, "route_pyramid": self.route_pyramid}
     
 
 
-class OSRM(Router):    
+class CoordinateBuffer(object):
+    def __init__(self, capacity = 1024):
+        """
+        @brief: Collects longitudes and latitudes of unknown total count.
+                The capacity is doubled when it is exhausted, 
+                so appending is linear in the total number of points.
+        
+        @param capacity (int) initial number of points
+        """
+        self.lon_lat_deg = np.zeros((capacity, 2))
+        self.no_points = 0
+    
+    def append(self, lon_lat_deg):
+        """
+        @param lon_lat_deg (2d numpy array of Nx2 float)
+        """
+        no_new = len(lon_lat_deg)
+        if self.no_points + no_new > len(self.lon_lat_deg):
+            capacity = max( 2 * len(self.lon_lat_deg), self.no_points + no_new )
+            grown = np.zeros((capacity, 2))
+            grown[:self.no_points] = self.lon_lat_deg[:self.no_points]
+            self.lon_lat_deg = grown
+        self.lon_lat_deg[self.no_points : self.no_points + no_new] = lon_lat_deg
+        self.no_points += no_new
+    
+    def get_lat_lon_deg(self):
+        """
+        @return lat_deg (1d numpy array of float)
+        @return lon_deg (1d numpy array of float)
+        """
+        return self.lon_lat_deg[:self.no_points, 1].copy(), self.lon_lat_deg[:self.no_points, 0].copy()
+
+
+class OSRM(Router):
+    def __init__(self, url_template = "", waypoints = [], cache = None, streaming = False):
+        """
+        @param url_template (str) see Router
+        @param waypoints (numpy array) see Router
+        @param cache (dict or None) see Router
+        @param streaming (bool)
+            If True, the response is parsed step by step while it is downloaded,
+            instead of decoding the complete response at once.
+            Saves RAM for long routes. 
+            Requires a response with only one route (no alternatives).
+        """
+        self.streaming = streaming
+        Router.__init__(self, url_template = url_template, waypoints = waypoints, cache = cache)
+    
     def set_route(self, waypoints):
+        self.waypoints = waypoints
+        if self.restore_route_from_cache(waypoints):
+            return
  
         waypoints_as_str = ";".join( list(",".join(point) for point in np.array(waypoints, dtype=str) ) )
         url = self.url_template.replace("{waypoints}", waypoints_as_str)
-        d = helpers.download.remote_json_to_py(url=url)
         
-        if d["code"].upper() != "OK":
-            raise Exception(d["code"])
-        
-        self.route = d["routes"][0]
-        self.__set_maneuvers(route = self.route)
+        if self.streaming:
+            self.route = None
+            self.__set_maneuvers_from_stream( chunks = helpers.download.remote_text_chunks(url=url) )
+        else:
+            d = helpers.download.remote_json_to_py(url=url)
+            
+            if d["code"].upper() != "OK":
+                raise Exception(d["code"])
+            
+            self.route = d["routes"][0]
+            self.__set_maneuvers(route = self.route)
+        self.store_route_in_cache(waypoints)
         
         
     def __set_maneuvers(self, route):    
-
+        self.maneuvers = []
+        coordinates = CoordinateBuffer()
+        
+        if"legs" in route:
+            for leg in route["legs"]:
+                for step in leg["steps"]:
+                    self.__add_step__( step = step, coordinates = coordinates )
+        
+        self.__finish_maneuvers__( coordinates = coordinates )
+    
+    def __set_maneuvers_from_stream(self, chunks):
+        """
+        @brief: like __set_maneuvers, but decodes the JSON text one step at a time.
+        
+        @param chunks (iterable of str) the JSON text of the OSRM response
+        """
+        self.maneuvers = []
+        coordinates = CoordinateBuffer()
+        
+        streamer = helpers.json_stream.ArrayItemStreamer( key = "steps" )
+        for step in streamer.iter_items( chunks = chunks ):
+            self.__add_step__( step = step, coordinates = coordinates )
+        
+        match = re.search( r'"code"\s*:\s*"([^"]*)"', streamer.outside_text )
+        if match is None or match.group(1).upper() != "OK":
+            raise Exception( match.group(1) if match is not None else "No code in OSRM response" )
+        
+        self.__finish_maneuvers__( coordinates = coordinates )
+    
+    def __add_step__(self, step, coordinates):
+        """
+        @brief: append the geometry of an OSRM step to the route 
+                and the step as maneuver.
+        
+        @param step (dict) OSRM route step
+        @param coordinates (CoordinateBuffer) route points so far
+        """
+        maneuver_ind = max( 0, coordinates.no_points-1 )
+        coordinates.append( np.array(step["geometry"]["coordinates"], dtype=float).reshape(-1,2) )
+        self.maneuvers.append( self.__step_to_maneuver__( step = step, maneuver_ind = maneuver_ind ) )
+    
+    def __step_to_maneuver__(self, step, maneuver_ind):
+        """
+        @param step (dict) OSRM route step
+        @param maneuver_ind (int) index of the maneuver location in the route points
+        
+        @return maneuver (dict) only with the data that is needed later on
+        """
         # First shot: every OSRM step is exactly one maneuver.
         # TODO: Rotary entry and exit are 2 separate steps. 
         #       Both, entry and exit, are represented by a 3-way crossing (rotary, rotary, exit).
@@ -96,78 +473,54 @@ class OSRM(Router):
         # TODO: Notifications are a maneuver. Let's check whether this is a good choice in practice.
         # TODO: use different icon types for roundabouts
         # TODO: use different icon type for U-Turn
+        
+        typ = step["maneuver"]["type"]
 
-        self.lat_deg = []
-        self.lon_deg = []
-        self.maneuvers = []
+        modifier = ""
+        if "modifier" in step["maneuver"]:
+            modifier = step["maneuver"]["modifier"]
+            if modifier == "uturn":
+                typ = "uturn"
+            if typ == "turn" and modifier == "straight":
+                typ = "straight"
+    
+        bearings_deg = step["intersections"][0]["bearings"]
+
+        in_bearing_deg = float("nan")
+        if "in" in step["intersections"][0]:
+            in_bearing_deg = bearings_deg[ step["intersections"][0]["in"] ]
+
+        out_bearing_deg = float("nan")
+        if "out" in step["intersections"][0]:
+            out_bearing_deg = bearings_deg[ step["intersections"][0]["out"] ]
+
+        exit_number = 0
+        if "exit" in step["maneuver"]:
+            exit_number = step["maneuver"]["exit"]
         
-        icon_types = {"arrive":"arrive",
-           "continue"        :"crossing",
-           "straight"        :"crossing",
-           "depart"          :"nesw_arrow",
-           "end of road"     :"crossing",
-           "exit rotary"     :"crossing",
-           "new name"        :"crossing",
-           "turn"            :"crossing",
-           "fork"            :"crossing",
-           "merge"           :"crossing",
-           "on ramp"         :"crossing",
-           "off ramp"        :"crossing",
-           "roundabout"      :"crossing",
-           "rotary"          :"crossing",
-           "notification"    :"notification",
-           "roundabout turn" :"crossing",
-           "exit roundabout" :"crossing",
+        return {
+           "location"            : step["intersections"][0]["location"],
+           "bearings_deg"        : np.array(bearings_deg),
+           "in_bearing_deg"      : in_bearing_deg,
+           "out_bearing_deg"     : out_bearing_deg,
+           "icon_type"           : OSRM_ICON_TYPES[ typ ],
+           "left_driving"        : ( step["driving_side"].upper() == "LEFT" ),
+           "type"                : typ,
+           "street_name_after"   : step["name"],
+           "movement_modifier"   : modifier,
+           "exit_number"         : exit_number,
+           "ind_on_route"        : maneuver_ind,
+           "distance_to_next"    : step["distance"],
+           "duration_to_next"    : step["duration"],
             }
-
-        if"legs" in route:
-            for leg in route["legs"]:
-                for step in leg["steps"]:
-                    maneuver_ind =  max( 0, len(self.lat_deg)-1 )
-
-                    coords = np.array(step["geometry"]["coordinates"])
-                    self.lat_deg = np.hstack([self.lat_deg, coords[:,1]])
-                    self.lon_deg = np.hstack([self.lon_deg, coords[:,0]])
-                       
-
-                    typ = step["maneuver"]["type"]
-
-                    modifier = ""
-                    if "modifier" in step["maneuver"]:
-                        modifier = step["maneuver"]["modifier"]
-                        if modifier == "uturn":
-                            typ = "uturn"
-                        if typ == "turn" and modifier == "straight":
-                            typ = "straight"
-                
-                    bearings_deg = step["intersections"][0]["bearings"]
-
-                    in_bearing_deg = float("nan")
-                    if "in" in step["intersections"][0]:
-                        in_bearing_deg = bearings_deg[ step["intersections"][0]["in"] ]
-
-                    out_bearing_deg = float("nan")
-                    if "out" in step["intersections"][0]:
-                        out_bearing_deg = bearings_deg[ step["intersections"][0]["out"] ]
-
-                    exit_number = 0
-                    if "exit" in step["maneuver"]:
-                        exit_number = step["maneuver"]["exit"]
-                    
-                    self.maneuvers += [{
-                       "location"            : step["intersections"][0]["location"],
-                       "bearings_deg"        : np.array(bearings_deg),
-                       "in_bearing_deg"      : in_bearing_deg,
-                       "out_bearing_deg"     : out_bearing_deg,
-                       "icon_type"           : icon_types[ typ ],
-                       "left_driving"        : ( step["driving_side"].upper() == "LEFT" ),
-                       "type"                : typ,
-                       "street_name_after"   : step["name"],
-                       "movement_modifier"   : modifier,
-                       "exit_number"         : exit_number,
-                       "ind_on_route"        : maneuver_ind,
-                       "distance_to_next"    : step["distance"],
-                        }]
+    
+    def __finish_maneuvers__(self, coordinates):
+        """
+        @brief: derive the route data that needs all steps.
+        
+        @param coordinates (CoordinateBuffer) all route points
+        """
+        self.lat_deg, self.lon_deg = coordinates.get_lat_lon_deg()
 
         # calculate the road distance from the start
         delta = helpers.angles.haversine_distance(lat1_deg = self.lat_deg[:-1], 
@@ -175,22 +528,23 @@ class OSRM(Router):
                                                   lat2_deg = self.lat_deg[1:], 
                                                   lon2_deg = self.lon_deg[1:])
         self.dist_from_start = np.hstack( [[0], np.cumsum(delta)] )
+        self.precompute_route_geometry()
+        
+        self.maneuvers = helpers.maneuvers.ManeuverTable( self.maneuvers )
         
         # add distance to previous
-        self.maneuvers[0]["distance_to_prev"] = 0
-        for i_man in np.arange(len(self.maneuvers)-1)+1:
-            self.maneuvers[i_man]["distance_to_prev"] = self.maneuvers[i_man-1]["distance_to_next"]
+        distance_to_next = self.maneuvers.columns["distance_to_next"]
+        self.maneuvers.columns["distance_to_prev"] = np.hstack( [[0], distance_to_next[:-1]] )
 
-        # add whole route to each maneuver
-        # (Python uses lazy copy, so RAM is occupied only once)
-        for i_man in np.arange(len(self.maneuvers)):
-            self.maneuvers[i_man]["route_lat_deg"]              = self.lat_deg
-            self.maneuvers[i_man]["route_lon_deg"]              = self.lon_deg
-            self.maneuvers[i_man]["distances_from_route_start"] = self.dist_from_start
+        self.attach_route_to_maneuvers()
 
 
 class OSM_Scout(Router):    
     def set_route(self, waypoints):
+        self.waypoints = waypoints
+        if self.restore_route_from_cache(waypoints):
+            return
+        
         locs = []
         for point in np.array(waypoints):
             locs += ["{\"lat\": " + str(point[1]) + ", \"lon\": " + str(point[0]) +"}"]
@@ -210,21 +564,446 @@ class OSM_Scout(Router):
 
         self.route = d["trip"]
         self.__set_maneuvers( route = self.route )
+        self.store_route_in_cache(waypoints)
 
     def __set_maneuvers(self, route):    
 
-        self.lat_deg = []
-        self.lon_deg = []
-        self.maneuvers = []
-        
-        polycodec = PolylineCodec()
+        self.maneuvers = helpers.maneuvers.ManeuverTable()
         
+        leg_lat_deg = []
+        leg_lon_deg = []
         for leg in route["legs"]:
-            coords = np.array( polycodec.decode( leg["shape"], precision=6) )
-
-            self.lat_deg = np.hstack([self.lat_deg, coords[:,1]])
-            self.lon_deg = np.hstack([self.lon_deg, coords[:,0]])
+            lat_deg, lon_deg = helpers.polyline.decode( leg["shape"], precision=6 )
+            leg_lat_deg.append( lat_deg )
+            leg_lon_deg.append( lon_deg )
+        self.lat_deg = np.concatenate( [np.zeros(0)] + leg_lat_deg )
+        self.lon_deg = np.concatenate( [np.zeros(0)] + leg_lon_deg )
+        
+        delta = helpers.angles.haversine_distance(lat1_deg = self.lat_deg[:-1], 
+                                                  lon1_deg = self.lon_deg[:-1], 
+                                                  lat2_deg = self.lat_deg[1:], 
+                                                  lon2_deg = self.lon_deg[1:])
+        self.dist_from_start = np.hstack( [[0], np.cumsum(delta)] )
+        self.precompute_route_geometry()
+        self.attach_route_to_maneuvers()
             
         # TODO: maneuvers
 
 
+
+
+class OfflineRouter(Router):
+    def __init__(self, graph_directory = "road_graph", metric = "duration", left_driving = False, waypoints = [], cache = None):
+        """
+        @brief: A router that needs no server.
+            The route is searched in a road graph on the local disk,
+            made by osm_to_road_graph.py from an OSM extract.
+        
+        @param graph_directory (str) see helpers.road_graph.save_road_graph
+        @param metric (str) "duration" for the fastest or "distance" for the shortest route
+        @param left_driving (bool)
+        @param waypoints (numpy array) see Router
+        @param cache (dict or None) see Router
+        """
+        self.road_graph   = helpers.road_graph.RoadGraph( directory = graph_directory )
+        self.metric       = metric
+        self.left_driving = left_driving
+        url_template = "file://" + os.path.abspath(graph_directory) + "?metric=" + metric
+        Router.__init__(self, url_template = url_template, waypoints = waypoints, cache = cache)
+    
+    def set_route(self, waypoints):
+        self.waypoints = waypoints
+        if self.restore_route_from_cache(waypoints):
+            return
+        
+        graph = self.road_graph
+        nodes = []
+        for point in np.array(waypoints, dtype=float):
+            nodes.append( graph.nearest_node( lat_deg = point[1], lon_deg = point[0] ) )
+        
+        path_edges = []
+        for i_source, i_target in zip(nodes[:-1], nodes[1:]):
+            leg_edges = graph.shortest_path( i_source = i_source, i_target = i_target, metric = self.metric )
+            if leg_edges is None:
+                raise Exception("No route found in the offline road graph")
+            path_edges += leg_edges
+        
+        self.__set_maneuvers( path_edges = np.array(path_edges, dtype=np.int64), first_node = nodes[0] )
+        self.store_route_in_cache(waypoints)
+
+    def __set_maneuvers(self, path_edges, first_node, min_turn_angle_deg = 35 ):
+        """
+        @brief: make OSRM-like maneuvers from a path in the road graph.
+            A maneuver is made where the street name changes,
+            or where the path turns at a junction.
+        
+        @param path_edges (1d numpy array of int)
+        @param first_node (int)
+        @param min_turn_angle_deg (float)
+        """
+        graph = self.road_graph
+        path_nodes = np.hstack([ [first_node], graph.edge_targets[path_edges] ]).astype(np.int64)
+        
+        self.lat_deg = np.array( graph.node_lat_deg[path_nodes], dtype=float )
+        self.lon_deg = np.array( graph.node_lon_deg[path_nodes], dtype=float )
+        delta = np.array( graph.edge_lengths_m[path_edges], dtype=float )
+        self.dist_from_start = np.hstack( [[0], np.cumsum(delta)] )
+        self.precompute_route_geometry()
+        
+        self.maneuvers = helpers.maneuvers.ManeuverTable()
+        if len(path_edges) == 0:
+            self.attach_route_to_maneuvers()
+            return
+        self.maneuvers = []
+        duration_from_start = np.hstack( [[0], np.cumsum( graph.edge_durations_s[path_edges], dtype=float )] )
+        
+        name_ids = np.array( graph.edge_name_ids[path_edges] )
+        bearings_deg = helpers.road_graph.get_bearings( lat1_deg = self.lat_deg[:-1], lon1_deg = self.lon_deg[:-1], 
+                                                        lat2_deg = self.lat_deg[1:],  lon2_deg = self.lon_deg[1:] )
+        turn_deg = ( bearings_deg[1:] - bearings_deg[:-1] + 180 ) % 360 - 180
+        
+        # candidates: interior nodes with a name change or a turn
+        is_candidate = ( name_ids[1:] != name_ids[:-1] ) | ( np.abs(turn_deg) > min_turn_angle_deg )
+        
+        maneuver_inds = [0]
+        for i_node in np.nonzero(is_candidate)[0] + 1:
+            neighbor_bearings = graph.get_neighbor_bearings( path_nodes[i_node] )
+            if name_ids[i_node] != name_ids[i_node-1] or len(neighbor_bearings) > 2:
+                maneuver_inds.append( int(i_node) )
+        maneuver_inds.append( len(path_nodes) - 1 )
+        
+        for i_man, ind in enumerate(maneuver_inds):
+            in_bearing_deg  = float("nan")
+            out_bearing_deg = float("nan")
+            modifier = ""
+            if ind == 0:
+                typ = "depart"
+                out_bearing_deg = bearings_deg[0]
+                bearings = [out_bearing_deg]
+                name_id  = name_ids[0]
+            elif ind == len(path_nodes) - 1:
+                typ = "arrive"
+                in_bearing_deg = ( bearings_deg[-1] + 180 ) % 360
+                bearings = [in_bearing_deg]
+                name_id  = name_ids[-1]
+            else:
+                in_bearing_deg  = ( bearings_deg[ind-1] + 180 ) % 360
+                out_bearing_deg = bearings_deg[ind]
+                bearings = graph.get_neighbor_bearings( path_nodes[ind] )
+                name_id  = name_ids[ind]
+                modifier = self.turn_angle_to_modifier( turn_deg[ind-1] )
+                typ = "turn"
+                if modifier == "straight":
+                    typ = "new name"
+            
+            distance_to_next = 0
+            duration_to_next = 0
+            if i_man < len(maneuver_inds) - 1:
+                distance_to_next = self.dist_from_start[ maneuver_inds[i_man+1] ] - self.dist_from_start[ind]
+                duration_to_next = duration_from_start[ maneuver_inds[i_man+1] ] - duration_from_start[ind]
+            
+            self.maneuvers += [{
+               "location"            : [ self.lon_deg[ind], self.lat_deg[ind] ],
+               "bearings_deg"        : np.array(bearings, dtype=float),
+               "in_bearing_deg"      : in_bearing_deg,
+               "out_bearing_deg"     : out_bearing_deg,
+               "icon_type"           : {"depart": "nesw_arrow", "arrive": "arrive"}.get(typ, "crossing"),
+               "left_driving"        : self.left_driving,
+               "type"                : typ,
+               "street_name_after"   : graph.names[name_id],
+               "movement_modifier"   : modifier,
+               "exit_number"         : 0,
+               "ind_on_route"        : ind,
+               "distance_to_next"    : distance_to_next,
+               "duration_to_next"    : duration_to_next,
+                }]
+        
+        self.maneuvers = helpers.maneuvers.ManeuverTable( self.maneuvers )
+        
+        # add distance to previous
+        distance_to_next = self.maneuvers.columns["distance_to_next"]
+        self.maneuvers.columns["distance_to_prev"] = np.hstack( [[0], distance_to_next[:-1]] )
+        
+        self.attach_route_to_maneuvers()
+    
+    def turn_angle_to_modifier(self, turn_deg):
+        """
+        @param turn_deg (float) positive to the right
+        @return modifier (str) OSRM movement modifier
+        """
+        side = "right" if turn_deg > 0 else "left"
+        if abs(turn_deg) < 15:
+            return "straight"
+        elif abs(turn_deg) < 45:
+            return "slight " + side
+        elif abs(turn_deg) < 135:
+            return side
+        return "sharp " + side
+
+
+class RouterRace(Router):
+    def __init__(self, routers = [], grace_s = 5., min_improvement = 0.05, timeout_s = 60., waypoints = []):
+        """
+        @brief: Asks several routers in parallel and uses the first valid route.
+        
+        set_route returns as soon as the first router delivers a valid route.
+        The other routers are not interrupted. A later route replaces 
+        the adopted route on the next call of poll_better_route
+        - if it has maneuvers, the adopted route has none (e.g. of OSM_Scout), 
+          and it arrives within timeout_s after set_route, 
+          because the directions need the maneuvers, or
+        - if it is shorter by min_improvement, arrives within grace_s 
+          after the adopted route, and has maneuvers if the adopted route has.
+        
+        @param routers (list of dicts) 
+               profile entries with "class_name" and "parameters" of the routers
+        @param grace_s (float)
+        @param min_improvement (float) relative length reduction, 0.05 means 5% shorter
+        @param timeout_s (float) maximum waiting time for a route with maneuvers,
+               after a route without maneuvers was adopted. The GUI does not wait for it.
+        @param waypoints (numpy array) see Router
+        """
+        self.routers = [ make_router( class_name = r["class_name"], parameters = r["parameters"] ) for r in routers ]
+        self.grace_s = grace_s
+        self.min_improvement = min_improvement
+        self.timeout_s = timeout_s
+        
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.results = []
+        self.adopted_length_m = None
+        self.adopted_has_maneuvers = False
+        self.adoption_time = None
+        self.start_time = None
+        self.better_router = None
+        Router.__init__(self, waypoints = waypoints)
+    
+    def set_route(self, waypoints):
+        self.waypoints = waypoints
+        if len(waypoints) == 0:
+            Router.set_route(self, waypoints)
+            return
+        
+        with self.condition:
+            self.generation += 1
+            generation = self.generation
+            self.results = [] # new list, so late threads of a copied router do not write here
+            self.adopted_length_m = None
+            self.start_time = time.monotonic()
+            self.better_router = None
+        
+        for router in self.routers:
+            # each thread works on its own copy, so overlapping requests do not interfere
+            threading.Thread( target = self.__race__, args = (copy.copy(router), waypoints, generation), daemon = True ).start()
+        
+        def first_valid_or_all_finished():
+            return ( any( r is not None for r, e in self.results ) or len(self.results) == len(self.routers) )
+        with self.condition:
+            # no longer than the fastest router, better routes are adopted by poll_better_route
+            self.condition.wait_for( first_valid_or_all_finished )
+            finished = [ r for r, e in self.results if r is not None ]
+            errors   = [ e for r, e in self.results if e is not None ]
+            if len(finished) == 0:
+                raise Exception("No router found a route: " + ", ".join( str(e) for e in errors ))
+            winner = min( finished, key = lambda r: ( not self.has_maneuvers(r), self.get_route_length(r) ) )
+            self.adopted_length_m = self.get_route_length(winner)
+            self.adopted_has_maneuvers = self.has_maneuvers(winner)
+            self.adoption_time = time.monotonic()
+        self.adopt_route(winner)
+    
+    def __race__(self, router, waypoints, generation):
+        result, error = None, None
+        try:
+            router.set_route( waypoints = waypoints )
+            if len(router.lat_deg) >= 2:
+                result = router
+            else:
+                error = Exception(type(router).__name__ + " returned an empty route")
+        except Exception as e:
+            error = e
+        
+        with self.condition:
+            if generation != self.generation:
+                return # the route was set again in the meantime
+            self.results.append( (result, error) )
+            now = time.monotonic()
+            if result is not None and self.adopted_length_m is not None and (
+                   ( self.has_maneuvers(result) and not self.adopted_has_maneuvers 
+                     and now - self.start_time <= self.timeout_s )
+                or ( now - self.adoption_time <= self.grace_s 
+                     and self.has_maneuvers(result) >= self.adopted_has_maneuvers
+                     and self.get_route_length(result) < (1 - self.min_improvement) * self.adopted_length_m ) ):
+                self.better_router = result
+                self.adopted_length_m = self.get_route_length(result)
+                self.adopted_has_maneuvers = self.has_maneuvers(result)
+            self.condition.notify_all()
+    
+    def get_route_length(self, router):
+        return router.dist_from_start[-1]
+    
+    def has_maneuvers(self, router):
+        return len(router.maneuvers) != 0
+    
+    def poll_better_route(self):
+        with self.condition:
+            better_router = self.better_router
+            self.better_router = None
+        if better_router is None:
+            return False
+        self.adopt_route(better_router)
+        return True
+
+
+class OffRouteDetector(object):
+    def __init__(self, 
+                 max_distance_m           = 40., 
+                 on_route_distance_m      = 20., 
+                 max_heading_mismatch_deg = 90., 
+                 min_velocity             = 3., 
+                 window_s                 = 5., 
+                 min_reroute_interval_s   = 30.,
+                 ):
+        """
+        @brief: Decides whether the ego vehicle has left the route.
+        
+        A position is off route if it is farther than max_distance_m from the route,
+        or farther than on_route_distance_m and driving in a different direction
+        than the route. 
+        A position closer than on_route_distance_m in the direction of the 
+        route is on route. Positions in between keep the previous state (hysteresis).
+        
+        A reroute is triggered if the position stays off route for window_s,
+        at most once per min_reroute_interval_s, 
+        and only once until the route is reached again or a new route is set.
+        
+        @param max_distance_m (float)
+        @param on_route_distance_m (float)
+        @param max_heading_mismatch_deg (float)
+        @param min_velocity (float) in m/s, heading is ignored below this velocity
+        @param window_s (float)
+        @param min_reroute_interval_s (float)
+        """
+        self.max_distance_m           = max_distance_m
+        self.on_route_distance_m      = on_route_distance_m
+        self.max_heading_mismatch_deg = max_heading_mismatch_deg
+        self.min_velocity             = min_velocity
+        self.window_s                 = window_s
+        self.min_reroute_interval_s   = min_reroute_interval_s
+        self.last_trigger_time        = -float("inf")
+        self.reset()
+        
+    def reset(self):
+        """
+        @brief: forget the off route history, e.g. after a new route was set.
+        """
+        self.is_off_route   = False
+        self.off_route_time = None # time when the position left the route
+        self.is_armed       = True
+        
+    def update(self, lat_deg, lon_deg, heading_deg, velocity, route_index, now = None):
+        """
+        @param lat_deg (float) ego position
+        @param lon_deg (float)
+        @param heading_deg (float)
+        @param velocity (float) in m/s
+        @param route_index (helpers.route_index.RouteIndex)
+        @param now (float or None) monotonic time, None means now
+        
+        @return do_reroute (bool) True if a reroute should be started now.
+        """
+        if now is None:
+            now = time.monotonic()
+        i_segment, a_rel, distance_m = route_index.closest_segment( lat_deg = lat_deg, lon_deg = lon_deg )
+        if i_segment is None:
+            return False
+        
+        heading_mismatch = False
+        if velocity >= self.min_velocity and heading_deg >= 0:
+            route_bearing_deg = route_index.bearing_deg[i_segment]
+            mismatch_deg = abs( ( heading_deg - route_bearing_deg + 180 ) % 360 - 180 )
+            heading_mismatch = ( mismatch_deg > self.max_heading_mismatch_deg )
+        
+        if distance_m > self.max_distance_m or ( distance_m > self.on_route_distance_m and heading_mismatch ):
+            if not self.is_off_route:
+                self.is_off_route   = True
+                self.off_route_time = now
+        elif distance_m <= self.on_route_distance_m and not heading_mismatch:
+            self.reset()
+        
+        do_reroute = bool( self.is_off_route 
+                       and self.is_armed 
+                       and now - self.off_route_time  >= self.window_s 
+                       and now - self.last_trigger_time >= self.min_reroute_interval_s )
+        if do_reroute:
+            self.is_armed          = False
+            self.last_trigger_time = now
+        return do_reroute
+    
+
+class BackgroundRerouter(object):
+    def __init__(self):
+        """
+        @brief: Calculates a new route on a worker thread.
+        
+        The route is calculated by a copy of the router, 
+        so the router in use is not changed while the GUI reads it.
+        The GUI thread swaps the routers when the copy is finished.
+        """
+        self.source_router = None
+        self.generation    = 0 # incremented with each reroute and cancel, results of older generations are dropped
+        self.__result      = None # new router of the current generation, written by the worker
+        self.__thread      = None
+        self.__lock        = threading.Lock()
+    
+    @property
+    def is_busy(self):
+        return self.__thread is not None and self.__thread.is_alive()
+    
+    def start(self, router, waypoints):
+        """
+        @param router (Router) the router in use
+        @param waypoints (2d numpy array of Nx2 float) see Router.set_route
+        
+        @return is_started (bool) False if a reroute is still running
+        """
+        if self.is_busy:
+            return False
+        with self.__lock:
+            self.generation   += 1
+            self.source_router = router
+            self.__result      = None
+        self.__thread = threading.Thread( target = self.__reroute__, args = (copy.copy(router), waypoints, self.generation), daemon = True )
+        self.__thread.start()
+        return True
+    
+    def cancel(self):
+        """
+        @brief: drop the result of a running reroute, e.g. when a new destination is set 
+                or the router is replaced. The worker is not interrupted.
+        """
+        with self.__lock:
+            self.generation   += 1
+            self.source_router = None
+            self.__result      = None
+        self.__thread = None # a new reroute may start while the cancelled one finishes
+    
+    def __reroute__(self, new_router, waypoints, generation):
+        try:
+            new_router.set_route( waypoints = waypoints )
+        except Exception as e:
+            print("Rerouting failed:", e)
+            return
+        with self.__lock:
+            if generation == self.generation: # a cancelled worker must not overwrite a newer result
+                self.__result = new_router
+        
+    def poll(self):
+        """
+        @brief: get the new router, if the reroute is finished.
+        
+        @return new_router (Router or None) None if the reroute was cancelled
+        """
+        with self.__lock:
+            new_router = self.__result
+            self.__result = None
+        return new_router
@@ -5,6 +5,8 @@ This file defines search providers.
 A search provider is used to convert a text input to destination coordinates.
 """
 
+import threading
+
 import helpers.download
 
 # TODO: make a new simple provider that accepts coordinate inputs and converts them to float.
@@ -23,12 +25,26 @@ def get_mapping_of_names_to_classes():
 
 
 class SearchProvider(object):
+    def __init__(self, as_you_type = False, as_you_type_interval_s = 1.):
+        """
+        @param as_you_type (bool) search while the query is typed
+        @param as_you_type_interval_s (float) minimum time between 2 requests while typing
+        """
+        self.as_you_type            = as_you_type
+        self.as_you_type_interval_s = as_you_type_interval_s
+        
     def find(self, query):
         raise NotImplementedError()
 
 class Nominatim(SearchProvider):
-    def __init__(self, url_template):
+    def __init__(self, url_template, **kwargs):
+        """
+        @param url_template (str) with {query}
+        @param kwargs see SearchProvider.
+               Keep as_you_type off for the public Nominatim server, its usage policy forbids autocomplete.
+        """
         self.url_template = url_template
+        SearchProvider.__init__(self, **kwargs)
         
     def find(self, query):
         query = helpers.download.encode_special_characters(query) # encode special characters, URL style
@@ -47,6 +63,87 @@ class OSMScout(Nominatim):
             res["display_name"] = res["title"]
         return search_results
 
+
+class AsyncSearch(object):
+    def __init__(self, call_in_main_loop, call_later):
+        """
+        @brief: Runs the queries of a search provider on a worker thread.
+        
+        The results are delivered on the main loop, so the GUI never waits for a server.
+        Each new query makes all pending queries stale. 
+        A request that is already sent can not be aborted, 
+        but its results are dropped instead of being delivered.
+        
+        @param call_in_main_loop (callable) 
+               call_in_main_loop(function, *args) runs function(*args) on the main loop, 
+               from any thread, e.g. GLib.idle_add
+        @param call_later (callable) 
+               call_later(delay_ms, function, *args) runs function(*args) on the main loop after delay_ms, 
+               e.g. GLib.timeout_add
+        """
+        self.call_in_main_loop = call_in_main_loop
+        self.call_later        = call_later
+        self.generation        = 0 # only results of the current generation are delivered
+        
+        self.typed_query       = None # newest query, that is not sent yet
+        self.is_timer_running  = False
+        
+    def cancel(self):
+        """
+        @brief: drop the results of all pending queries. Must be called from the main loop.
+        """
+        self.generation += 1
+        self.typed_query = None
+    
+    def search(self, provider, query, on_results):
+        """
+        @brief: start a query. Must be called from the main loop.
+        
+        @param provider (SearchProvider)
+        @param query (str)
+        @param on_results (callable) 
+               on_results(query, list_of_result_dicts, error) is called on the main loop.
+               error is None or the exception of the provider.
+        """
+        self.cancel()
+        thread = threading.Thread( target = self.__find__, args = (provider, query, on_results, self.generation), daemon = True )
+        thread.start()
+    
+    def __find__(self, provider, query, on_results, generation):
+        results, error = [], None
+        try:
+            results = provider.find(query)
+        except Exception as e:
+            error = e
+        self.call_in_main_loop( self.__deliver__, query, results, error, on_results, generation )
+    
+    def __deliver__(self, query, results, error, on_results, generation):
+        if generation == self.generation:
+            on_results(query, results, error)
+        repeat = False
+        return repeat
+    
+    def search_as_you_type(self, provider, query, on_results):
+        """
+        @brief: like search, but for every keystroke. Must be called from the main loop.
+        
+        Pending results are dropped at once. The newest query is sent 
+        provider.as_you_type_interval_s after the first keystroke, 
+        so there is at most one request per interval.
+        """
+        self.cancel()
+        self.typed_query = query
+        if not self.is_timer_running:
+            self.is_timer_running = True
+            self.call_later( int( 1000 * provider.as_you_type_interval_s ), self.__on_timer__, provider, on_results )
+    
+    def __on_timer__(self, provider, on_results):
+        self.is_timer_running = False
+        if self.typed_query is not None:
+            self.search(provider, self.typed_query, on_results)
+        repeat = False
+        return repeat
+
     
 if __name__ == "__main__":
     
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file defines voice providers.
+A voice provider speaks the text blocks of a direction provider.
+"""
+
+import io
+import time
+import wave
+import threading
+import subprocess
+
+import helpers.disk_cache
+
+
+def get_mapping_of_names_to_classes():
+    """
+    @brief: Pointers to all classes that shall be usable.
+
+    @return d (dict)
+    """
+    d = {
+        "VoiceGuidance": VoiceGuidance,
+        "EspeakVoiceGuidance": EspeakVoiceGuidance,
+        }
+    return d
+
+
+def get_prompt_text(text_blocks):
+    """
+    @param text_blocks (dict or None) see providers.directions.Director.render_text_blocks
+
+    @return text (str) the spoken instruction, e.g. "turn right to Main Street"
+    """
+    if text_blocks is None:
+        return ""
+    blocks = [ text_blocks[key] for key in ["verb", "verb_modifier", "to_preposition", "street_name_after"] ]
+    return " ".join( b for b in blocks if b != "" )
+
+
+def get_wav_duration_s(audio_bytes):
+    """
+    @brief: Playing time of a wav file.
+            The size fields of the header are not used,
+            because TTS engines that write to stdout leave them open.
+
+    @return duration_s (float) 0 if the audio is no wav
+    """
+    try:
+        w = wave.open( io.BytesIO(audio_bytes), "rb" )
+        bytes_per_s = w.getframerate() * w.getnchannels() * w.getsampwidth()
+    except (wave.Error, EOFError):
+        return 0.
+    return max( 0., len(audio_bytes) - 44 ) / bytes_per_s
+
+
+class AudioCache(helpers.disk_cache.DiskCache):
+    def __init__(self, directory = "voice_cache", max_size_bytes = 20000000):
+        """
+        @brief: Synthesized prompts on disk, one wav file per text.
+
+        Street names repeat on every drive through a neighbourhood,
+        so most prompts are synthesized only once.
+
+        @param directory (str)
+        @param max_size_bytes (int)
+               If the cache grows larger, the least recently used prompts are deleted.
+        """
+        helpers.disk_cache.DiskCache.__init__(self, directory = directory, extension = ".wav", max_size_bytes = max_size_bytes)
+
+    def make_key(self, engine_name, text):
+        """
+        @param engine_name (str) everything that affects the audio besides the text, e.g. command and voice
+        @param text (str)
+
+        @return key (str)
+        """
+        return self.hash_key( engine_name, text )
+
+    def load(self, key):
+        """
+        @return filename (str or None) None if not cached
+        """
+        return self.touch(key)
+
+    def store(self, key, audio_bytes):
+        """
+        @return filename (str)
+        """
+        return self.write( key, audio_bytes )
+
+
+class VoiceGuidance(object):
+    can_synthesize = False # True if synthesize returns audio
+    
+    def __init__(self, lead_time_s = 6., min_velocity = 5., cache_directory = "voice_cache"):
+        """
+        @brief: Speaks each maneuver of a route shortly before it is due.
+
+        When a route is set, the prompts of all maneuvers are synthesized
+        on a worker thread, in the order in which they will be needed,
+        and stored in an AudioCache. When a prompt is due,
+        its audio file only needs to be played.
+
+        A prompt is due when the time to the maneuver,
+        from the distance and the current velocity,
+        is less than the playing time of the prompt plus lead_time_s.
+
+        This baseclass is silent: synthesize and play do not do anything,
+        so neither a worker nor a cache directory is needed.
+        Derived classes plug in a TTS engine and an audio player
+        and set can_synthesize.
+
+        @param lead_time_s (float) time between the end of a prompt and the maneuver
+        @param min_velocity (float) in m/s, slower velocities are rounded up,
+               so that a prompt is not delayed until the maneuver when standing at a traffic light
+        @param cache_directory (str) see AudioCache
+        """
+        self.lead_time_s     = lead_time_s
+        self.min_velocity    = min_velocity
+        self.cache_directory = cache_directory
+        self.audio_cache     = None
+
+        self.generation      = 0 # incremented with each route, stale workers stop
+        self.prompt_texts    = []
+        self.audio_files     = {} # maneuver index -> (filename, duration_s), written by the worker
+        self.played          = set()
+        self.playback_end_time = 0.
+        self.__thread        = None
+
+    @property
+    def engine_name(self):
+        """
+        @brief: everything that affects the audio besides the text
+        """
+        return type(self).__name__
+
+    def synthesize(self, text):
+        """
+        @param text (str)
+
+        @return audio_bytes (bytes or None) wav data, None if there is no TTS engine
+        """
+        return None # base class does not do anything
+
+    def play(self, filename):
+        """
+        @brief: starts the playback and returns immediately
+        """
+        pass # base class does not do anything
+
+    def set_route(self, maneuvers):
+        """
+        @param maneuvers (helpers.maneuvers.ManeuverTable or list)
+               maneuvers with the text_blocks of a direction provider
+        """
+        self.cancel()
+        if not self.can_synthesize:
+            return
+        self.prompt_texts = [ get_prompt_text( maneuver.get("text_blocks") ) for maneuver in maneuvers ]
+
+        # the worker writes into the dict of its own route only
+        self.__thread = threading.Thread( target = self.__synthesize_all__, args = (self.generation, self.prompt_texts, self.audio_files), daemon = True )
+        self.__thread.start()
+
+    def cancel(self):
+        """
+        @brief: forget the current route and stop its worker after the current prompt,
+                e.g. before this provider is replaced.
+        """
+        self.generation += 1
+        self.prompt_texts = []
+        self.audio_files = {}
+        self.played = set()
+
+    def __synthesize_all__(self, generation, prompt_texts, audio_files):
+        if self.audio_cache is None:
+            self.audio_cache = AudioCache( directory = self.cache_directory )
+        for i_man, text in enumerate(prompt_texts):
+            if generation != self.generation:
+                return # a new route was set in the meantime
+            if text == "":
+                continue
+            key = self.audio_cache.make_key( engine_name = self.engine_name, text = text )
+            filename = self.audio_cache.load(key)
+            try:
+                if filename is None:
+                    audio_bytes = self.synthesize(text)
+                    if audio_bytes is None:
+                        return
+                    filename = self.audio_cache.store( key, audio_bytes )
+                with open(filename, "rb") as f:
+                    duration_s = get_wav_duration_s( f.read() )
+            except Exception as e:
+                print("Speech synthesis failed:", e)
+                return
+            audio_files[i_man] = (filename, duration_s)
+
+    def update(self, route_progress, now = None):
+        """
+        @brief: plays the prompt of the next maneuver, if it is due.
+                Must be called regularly from the GUI thread.
+
+        @param route_progress (helpers.route_progress.RouteProgress)
+        @param now (float or None) monotonic time in s, None means now
+
+        @return is_playing_started (bool)
+        """
+        if now is None:
+            now = time.monotonic()
+        i_man = route_progress.i_next_maneuver
+        if i_man in self.played or i_man not in self.audio_files or now < self.playback_end_time:
+            return False
+
+        filename, duration_s = self.audio_files[i_man]
+        velocity = max( self.min_velocity, route_progress.velocity )
+        time_to_maneuver_s = route_progress.distance_to_next_maneuver_m / velocity
+        if time_to_maneuver_s > duration_s + self.lead_time_s:
+            return False
+
+        self.played.add(i_man)
+        self.playback_end_time = now + duration_s
+        self.play(filename)
+        return True
+
+
+class EspeakVoiceGuidance(VoiceGuidance):
+    can_synthesize = True
+    
+    def __init__(self, command = "espeak-ng", voice = "en", words_per_minute = 160, player_command = ["aplay", "-q"], **kwargs):
+        """
+        @brief: Voice guidance with a local espeak or espeak-ng installation.
+
+        @param command (str) TTS executable that understands the espeak options -v, -s and --stdout
+        @param voice (str) e.g. "en" or "de", should match the language of the direction provider
+        @param words_per_minute (int)
+        @param player_command (list of str) the wav filename is appended
+        @param kwargs see VoiceGuidance
+        """
+        self.command          = command
+        self.voice            = voice
+        self.words_per_minute = words_per_minute
+        self.player_command   = player_command
+        VoiceGuidance.__init__(self, **kwargs)
+
+    @property
+    def engine_name(self):
+        return " ".join( [self.command, self.voice, str(self.words_per_minute)] )
+
+    def synthesize(self, text):
+        result = subprocess.run( [self.command, "-v", self.voice, "-s", str(self.words_per_minute), "--stdout", text],
+                                 stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, timeout = 30, check = True )
+        return result.stdout
+
+    def play(self, filename):
+        try:
+            subprocess.Popen( self.player_command + [filename], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL )
+        except OSError as e:
+            print("Playback failed:", e)
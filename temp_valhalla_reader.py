@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import json
-from polyline.polyline.codec import PolylineCodec
+import helpers.polyline
 
 filename = "valhalla_result.json"
 f = open(filename,"r")
@@ -14,6 +14,4 @@ shape = dic["trip"]["legs"][0]["shape"]
 #print(dic["trip"]["legs"][0]["maneuvers"])
 
 
-decoder = PolylineCodec()
-
-print( decoder.decode( shape, precision=6) )
\ No newline at end of file
+print( helpers.polyline.decode( shape, precision=6) )
\ No newline at end of file
@@ -9,49 +9,52 @@ from gi.repository import Gtk, Gdk, GLib
 import numpy as np
 
 import widgets.maneuver_widget
-import helpers.angles
+import helpers.round
 
 
 class ManeuverBar(Gtk.Box):
-    def __init__(self, in_bearing_is_down = True, pos_tolerance = 20, orientation = Gtk.Orientation.HORIZONTAL ):
+    def __init__(self, in_bearing_is_down = True, orientation = Gtk.Orientation.HORIZONTAL ):
     
         Gtk.Window.__init__(self, orientation=orientation, spacing = 10)
         
         self.maneuvers = []
         self.in_bearing_is_down = in_bearing_is_down
-        self.search_index_range = [0,0]
-        self.pos_tolerance = pos_tolerance
         
     
-    def set_new_route(self, maneuvers_with_direction_data, window_xsize_px):
+    def set_new_route(self, maneuvers_with_direction_data, window_xsize_px, keep_valid_widgets = False):
+        """
+        @param maneuvers_with_direction_data (helpers.maneuvers.ManeuverTable)
+        @param window_xsize_px (int)
+        @param keep_valid_widgets (bool) 
+               if True, widgets of maneuvers that are also part of the new route are reused,
+               e.g. after rerouting.
+        """
+        reusable_widgets = {}
+        if keep_valid_widgets:
+            for child in self.get_children():
+                reusable_widgets[ self.get_maneuver_key(child.maneuver) ] = child
+        
         self.window_xsize_px = window_xsize_px
         self.maneuvers = maneuvers_with_direction_data
-        
-        if len(self.maneuvers) != 0:
-            self.search_index_range = self.get_search_range( i_maneuver = 0)
-        else:
-            self.search_index_range = [0,0]
-
-        self.remake_all_widgets(i_start=0, window_xsize_px = self.window_xsize_px, spacing = self.get_spacing())
 
+        self.remake_all_widgets(i_start=0, window_xsize_px = self.window_xsize_px, spacing = self.get_spacing(), reusable_widgets = reusable_widgets)
 
-    def get_search_range(self, i_maneuver, overlap_distance = 200 ):
-        dist_from_start = self.maneuvers[i_maneuver]["distances_from_route_start"]
-        no_points = len(dist_from_start)
 
-        man_i_on_route = self.maneuvers[i_maneuver]["ind_on_route"]
-        man_dist_from_start = dist_from_start[man_i_on_route]
+    def get_maneuver_key(self, maneuver):
+        """
+        @brief: two maneuvers with the same key look the same in a ManeuverWidget.
         
-        indices_with_short_distance = (i for i in np.arange(no_points) if dist_from_start[i] <= man_dist_from_start - overlap_distance )
-        imin = next(  indices_with_short_distance, 0 )
-        
-        # TODO: do not start from 0, but from man_i_on_route
-        indices_with_large_distance = (i for i in np.arange(no_points) if dist_from_start[i] >= man_dist_from_start + overlap_distance )
-        imax = max( 0, next(  indices_with_large_distance,  len(self.maneuvers[0]["route_lat_deg"])-1 ) )
-        
-        return [imin, imax]
+        @param maneuver (dict)
+        @return key (tuple)
+        """
+        location = tuple( np.round( maneuver.get("location", (np.nan, np.nan) ), 5 ) )
+        return ( maneuver["icon_type"], 
+                 maneuver["text_blocks"]["street_name_after"], 
+                 location, 
+                 int(round(maneuver["distance_to_prev"])) )
+
 
-    def remake_all_widgets(self, i_start, window_xsize_px, spacing):
+    def remake_all_widgets(self, i_start, window_xsize_px, spacing, reusable_widgets = {}):
         for child in self.get_children():
             self.remove(child)
         self.set_size_request(0,0) # if no widgets are created later on, the size stays zero and the bar disappears
@@ -70,70 +73,58 @@ class ManeuverBar(Gtk.Box):
             number_of_icons = len(self.maneuvers) - i_start
 
         for i_man in np.arange( number_of_icons ) + i_start:
-            self.add_a_widget(i_man, icon_size=self.icon_size)
-
-
-    def add_a_widget(self, i_man, icon_size):
-        man_widget = widgets.maneuver_widget.ManeuverWidget(
-                         maneuver = self.maneuvers[i_man], 
-                         maneuver_id = i_man, 
-                         in_bearing_is_down = self.in_bearing_is_down, 
-                         size_px = icon_size)
+            self.add_a_widget(i_man, icon_size=self.icon_size, reusable_widgets = reusable_widgets)
+
+
+    def add_a_widget(self, i_man, icon_size, reusable_widgets = {}):
+        """
+        @param i_man (int) index of the maneuver
+        @param icon_size (int)
+        @param reusable_widgets (dict) maneuver key -> ManeuverWidget,
+               a matching widget is moved to this bar instead of creating a new one.
+        """
+        man_widget = reusable_widgets.pop( self.get_maneuver_key(self.maneuvers[i_man]), None )
+        if ( man_widget is not None 
+             and man_widget.size_px == icon_size 
+             and man_widget.in_bearing_is_down == self.in_bearing_is_down ):
+            man_widget.maneuver    = self.maneuvers[i_man]
+            man_widget.maneuver_id = i_man
+        else:
+            man_widget = widgets.maneuver_widget.ManeuverWidget(
+                             maneuver = self.maneuvers[i_man], 
+                             maneuver_id = i_man, 
+                             in_bearing_is_down = self.in_bearing_is_down, 
+                             size_px = icon_size)
         self.add( man_widget )
         self.set_size_request(icon_size,icon_size) 
         self.show_all()
         
     
-    def update(self, lat_deg, lon_deg, in_bearing_is_down ):
+    def update(self, route_progress, in_bearing_is_down ):
+        """
+        @param route_progress (helpers.route_progress.RouteProgress) 
+               progress along the route of self.maneuvers, already updated for this frame
+        @param in_bearing_is_down (bool)
+        """
         
         # check if auto-rotate was toggled
-        if in_bearing_is_down != self.in_bearing_is_down:
+        if in_bearing_is_down != self.in_bearing_is_down and len(self.get_children()) != 0:
             self.in_bearing_is_down = in_bearing_is_down
             self.remake_all_widgets( i_start = self.get_children()[0].maneuver_id, window_xsize_px = self.window_xsize_px, spacing=self.get_spacing())
         
-        # check if the current position is in the search range
+        if len(self.get_children()) == 0:
+            return
+        
+        # drop the widgets of passed maneuvers and append the following ones
+        while len(self.get_children()) != 0 and self.get_children()[0].maneuver_id < route_progress.i_next_maneuver:
+            last_id = self.get_children()[-1].maneuver_id
+            self.remove( self.get_children()[0] )
+            if last_id < len(self.maneuvers)-1:
+                self.add_a_widget(i_man = last_id + 1, icon_size=self.icon_size)
+        
         if len(self.get_children()) != 0:
-            
-            # TODO: make this whole section elegant, 
-            # encapsulate
-            # less if statements
-            # and don't calculate everything on the fly over and over again
-            
             man_id = self.get_children()[0].maneuver_id
-            
-            # slice out a small part of the route
-            search_i = self.search_index_range
-            route_dists_from_start = self.maneuvers[man_id]["distances_from_route_start"][ search_i[0] : search_i[1] ]
-            route_lats_deg         = self.maneuvers[man_id]["route_lat_deg"][ search_i[0] : search_i[1] ]
-            route_lons_deg         = self.maneuvers[man_id]["route_lon_deg"][ search_i[0] : search_i[1] ]
-            route_i_man            = self.maneuvers[man_id]["ind_on_route"] - search_i[0]
-                       
-            a_rel, mindist = helpers.angles.relation_of_angular_polyline_segments_to_reference_position(
-                                 lat_poly_deg = route_lats_deg, 
-                                 lon_poly_deg = route_lons_deg, 
-                                 lat_ref_deg  = lat_deg, 
-                                 lon_ref_deg  = lon_deg)
-            
-            i_closest_segment = np.argmin(mindist)
-            dist_from_start = route_dists_from_start[i_closest_segment] + a_rel[i_closest_segment] * (route_dists_from_start[i_closest_segment+1]-route_dists_from_start[i_closest_segment])           
-
-            if dist_from_start - route_dists_from_start[route_i_man] > self.pos_tolerance:
-                self.remove( self.get_children()[0] )
-                
-                if self.get_children()[-1].maneuver_id < len(self.maneuvers)-1:
-                    self.add_a_widget(i_man = self.get_children()[-1].maneuver_id + 1, icon_size=self.icon_size)
-                
-                self.search_index_range = self.get_search_range(i_maneuver = self.get_children()[0].maneuver_id, overlap_distance = 200 )
-                
-                
-            else:
-                air_dist_to_next = helpers.angles.haversine_distance(lat1_deg=route_lats_deg[i_closest_segment+1], 
-                                                                     lon1_deg=route_lons_deg[i_closest_segment+1],
-                                                                     lat2_deg=lat_deg, 
-                                                                     lon2_deg=lon_deg)
-
-                dist = route_dists_from_start[ route_i_man ] - route_dists_from_start[ i_closest_segment+1 ] + air_dist_to_next
-                dist_blocks = helpers.round.distance_to_rounded_textblocks(dist)
+            if man_id == route_progress.i_next_maneuver:
+                dist_blocks = helpers.round.distance_to_rounded_textblocks( route_progress.distance_to_next_maneuver_m )
                 text = self.maneuvers[man_id]["text_blocks"]["distance_preposition"] + " " + dist_blocks["distance"] + " " + dist_blocks["distance_unit_abbrev"]
                 self.get_children()[0].set_top_text( text )
-    
\ No newline at end of file
@@ -17,6 +17,9 @@ class ManeuverWidget(Gtk.Box):
         Gtk.Box.__init__( self, orientation = Gtk.Orientation.VERTICAL, spacing = 0 )
         
         self.maneuver_id = maneuver_id
+        self.maneuver = maneuver
+        self.in_bearing_is_down = in_bearing_is_down
+        self.size_px = size_px
         
         text_blocks = maneuver["text_blocks"]
         dist_text_blocks = helpers.round.distance_to_rounded_textblocks(distance_in_m = maneuver["distance_to_prev"] )
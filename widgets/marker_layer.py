@@ -10,7 +10,8 @@ class MarkerLayerWidget(Gtk.DrawingArea):
     def __init__(self, map_copyright):       
         Gtk.DrawingArea.__init__(self)
         self.connect("draw", self.on_draw)
-                
+        
+        self.version = 0 # incremented with every change of the markers, see mark_changed
         self.list_of_markers = self.make_marker_list(map_copyright=map_copyright)
         
     def make_marker_list(self, destination = None, route_line_dicts = [], map_copyright=""):
@@ -39,7 +40,16 @@ class MarkerLayerWidget(Gtk.DrawingArea):
     
         # Polygon lines
         for line_dict in route_line_dicts:
-            m += [markers.FixedLatLonMarker(
+            if "route_index" in line_dict:
+                m += [markers.RouteLineMarker(
+                                        draftsman = markers.PolygonLine(color_rgba=line_dict["color_rgba"]),
+                                        lat_deg = line_dict["lat_deg"],
+                                        lon_deg = line_dict["lon_deg"],
+                                        route_index = line_dict["route_index"],
+                                        route_pyramid = line_dict.get("route_pyramid", {}),
+                                        )]
+            else:
+                m += [markers.FixedLatLonMarker(
                                         draftsman = markers.PolygonLine(color_rgba=line_dict["color_rgba"]),
                                         lat_deg = line_dict["lat_deg"],
                                         lon_deg = line_dict["lon_deg"],
@@ -50,8 +60,16 @@ class MarkerLayerWidget(Gtk.DrawingArea):
         m += [markers.FollowingMarker(draftsman = markers.Dot(fill_color=(0,1,0), border_color=(0,0,0)))]
         
         self.list_of_markers = m
+        self.mark_changed()
         return m
     
+    def mark_changed(self):
+        """
+        @brief: must be called after the markers were changed in place,
+                so that the next frame is redrawn
+        """
+        self.version += 1
+    
     def on_draw(self, da, ctx):
         """
         @brief: draw markers overlaid on the map.
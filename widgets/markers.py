@@ -77,6 +77,57 @@ class FixedLatLonMarker(Marker):
         self.y, self.x = cropped_tile.angles_to_pxpos(lat_deg = self.lat_deg, lon_deg = self.lon_deg)
 
 
+class RouteLineMarker(Marker):
+    def __init__(self, draftsman, lat_deg, lon_deg, route_index, route_pyramid = {}, max_unculled_points = 2000):
+        """
+        @brief: Polygon line of a route.
+        
+        The route is drawn with the simplified polyline of the tile's zoom level.
+        If that is long, only the segments on the tile are converted to pixels.
+        Separate parts of the route are separated by nan in x and y.
+        
+        @param draftsman (PolygonLine)
+        @param lat_deg (1d numpy array)
+        @param lon_deg (1d numpy array)
+        @param route_index (helpers.route_index.RouteIndex) 
+               spatial index of the route segments
+        @param route_pyramid (dict) 
+               zoom level -> indices of the points to draw, None for all points.
+        @param max_unculled_points (int)
+               Simplified lines up to this number of points are drawn without
+               looking up the segments on the tile.
+        """
+        Marker.__init__(self, draftsman)
+        self.lat_deg = np.asarray(lat_deg)
+        self.lon_deg = np.asarray(lon_deg)
+        self.route_index = route_index
+        self.route_pyramid = route_pyramid
+        self.max_unculled_points = max_unculled_points
+
+    def update(self, cropped_tile, position):
+        level = self.route_pyramid.get(cropped_tile.zoom)
+        
+        if level is not None and len(level) <= self.max_unculled_points:
+            points = level
+            gaps   = np.zeros(0, dtype=int)
+        else:
+            south_lat, west_lon, north_lat, east_lon = cropped_tile.get_bounding_box()
+            segments = self.route_index.segments_in_box( south_lat = south_lat, west_lon = west_lon, north_lat = north_lat, east_lon = east_lon )
+            if level is None:
+                points = np.union1d( segments, segments+1 )
+                gaps   = np.nonzero( np.diff(points) > 1 )[0] + 1
+            else:
+                # simplified segments that contain a visible segment
+                j = np.unique( np.searchsorted(level, segments, side="right") - 1 )
+                j = np.union1d( j, j+1 )
+                points = level[j]
+                gaps   = np.nonzero( np.diff(j) > 1 )[0] + 1
+        
+        y, x = cropped_tile.angles_to_pxpos(lat_deg = self.lat_deg[points], lon_deg = self.lon_deg[points])
+        self.x = np.insert( np.asarray(x, dtype=float), gaps, np.nan )
+        self.y = np.insert( np.asarray(y, dtype=float), gaps, np.nan )
+
+
 class FixedLatLonMarkerWithAlternativeOffTilePointer(Marker):
     def __init__(self, draftsman, off_tile_draftsman, lat_deg, lon_deg):
         """
@@ -437,9 +488,16 @@ class PolygonLine(Draftsman):
         ctx.set_line_width(self.linewidth_px)
         ctx.set_source_rgba(*self.color_rgba)
         
-        ctx.move_to(x[0], y[0])        
-        for i in np.arange(len(x)-1)+1:
-            ctx.line_to(x[i] , y[i])
+        # nan separates parts of the line
+        is_new_part = True
+        for i in np.arange(len(x)):
+            if np.isnan(x[i]) or np.isnan(y[i]):
+                is_new_part = True
+            elif is_new_part:
+                ctx.move_to(x[i] , y[i])
+                is_new_part = False
+            else:
+                ctx.line_to(x[i] , y[i])
 
         ctx.stroke()
         ctx.set_line_width(1)